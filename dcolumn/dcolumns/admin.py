@@ -48,7 +48,8 @@ class ColumnCollectionAdmin(UserAdminMixin):
     Used internally to DColumn for the ``ColumnCollection`` model.
     """
     fieldsets = (
-        (None, {'fields': ('name', 'related_model', 'dynamic_column',)}),
+        (None, {'fields': ('name', 'related_model', 'storage',
+                           'dynamic_column',)}),
         (_('Status'), {'classes': ('collapse',),
                        'fields': ('active', 'creator', 'created', 'updater',
                                   'updated',)}),
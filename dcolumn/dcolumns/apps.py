@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/apps.py
+#
+
+"""
+Application configuration for dynamic columns.
+"""
+__docformat__ = "restructuredtext en"
+
+from django.apps import AppConfig
+
+
+class DColumnsConfig(AppConfig):
+    name = 'dcolumn.dcolumns'
+
+    def ready(self):
+        # Connect the signal receivers.
+        from . import choices, pivot, schema
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/choices.py
+#
+
+"""
+Batched resolution of ``CHOICE`` values that are stored as the pk of a
+Django model. The first label asked for resolves the pks of every object
+in the group, one object or a page loaded with ``with_key_values``, with
+one ``in_bulk`` per choice model. While a request is being handled the
+resolved objects are kept for the rest of it.
+
+The resolved values are also kept in a bounded LRU cache per choice
+model, shared with ``CollectionBaseManager.get_value_by_pk``. Entries are
+evicted by the ``post_save`` and ``post_delete`` signals of the model, so
+changes made with ``QuerySet.update`` or by other processes are only seen
+once the entry falls out of the cache.
+"""
+__docformat__ = "restructuredtext en"
+
+import logging
+import threading
+from collections import OrderedDict
+
+from asgiref.local import Local
+
+from django.core.exceptions import ValidationError
+from django.core.signals import request_started, request_finished
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+log = logging.getLogger('dcolumns.dcolumns.choices')
+
+VALUE_CACHE_SIZE = 1000
+MISSING = object()
+
+_local = Local()
+_lock = threading.Lock()
+_value_caches = {}
+
+
+class ValueCache:
+    """
+    A bounded LRU cache of the ``(pk, field)`` values of one choice model
+    that counts its hits and misses.
+    """
+
+    def __init__(self, maxsize=VALUE_CACHE_SIZE):
+        """
+        :param maxsize: The number of values kept.
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        """
+        Get a value and mark it as the most recently used.
+
+        :param key: The ``(pk, field)`` of the value.
+        :type key: tuple
+        :param default: Returned if the value is not cached.
+        :rtype: The value or ``default``.
+        """
+        with self._lock:
+            result = self._values.get(key, MISSING)
+
+            if result is MISSING:
+                self.misses += 1
+                result = default
+            else:
+                self.hits += 1
+                self._values.move_to_end(key)
+
+        return result
+
+    def set(self, key, value):
+        """
+        Cache a value, the least recently used value is discarded when
+        the cache is full.
+
+        :param key: The ``(pk, field)`` of the value.
+        :type key: tuple
+        :param value: The value.
+        """
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def evict(self, pk):
+        """
+        Discard the values of all fields of the object with ``pk``.
+
+        :param pk: The pk of the object.
+        :type pk: int
+        """
+        with self._lock:
+            for key in [key for key in self._values if key[0] == pk]:
+                del self._values[key]
+
+    def clear(self):
+        """
+        Discard all values and reset the counters.
+        """
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        Get the counters of this cache.
+
+        :rtype: A dict of ``{'hits': <int>, 'misses': <int>,
+                'size': <int>, 'maxsize': <int>}``.
+        """
+        with self._lock:
+            result = {'hits': self.hits, 'misses': self.misses,
+                      'size': len(self._values), 'maxsize': self.maxsize}
+
+        return result
+
+
+def get_value_cache(model):
+    """
+    Get the ``ValueCache`` of a choice model.
+
+    :param model: The choice model class.
+    :type model: ``django.db.models.Model``
+    :rtype: A ``ValueCache`` object.
+    """
+    label = model._meta.label
+    result = _value_caches.get(label)
+
+    if result is None:
+        with _lock:
+            result = _value_caches.setdefault(label, ValueCache())
+
+    return result
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def _evict_value(sender, instance, **kwargs):
+    cache = _value_caches.get(sender._meta.label)
+
+    if cache is not None:
+        cache.evict(instance.pk)
+
+
+def get_request_cache():
+    """
+    Get the choice objects resolved during the current request.
+
+    :rtype: A dict of ``{(<model label>, <pk>): <object or None>, ...}``
+            or ``None`` when not in a request.
+    """
+    return getattr(_local, 'objects', None)
+
+
+@receiver(request_started)
+def _request_started(sender, **kwargs):
+    _local.objects = {}
+
+
+@receiver(request_finished)
+def _request_finished(sender, **kwargs):
+    _local.objects = None
+
+
+class ChoiceResolver:
+    """
+    Resolves the ``CHOICE`` pks of a group of objects that inherit
+    ``CollectionBase``. Only objects whose ``KeyValue`` objects are
+    already loaded take part, so resolving never loads values.
+    """
+
+    def __init__(self, objs):
+        """
+        :param objs: The objects that share this resolver.
+        :type objs: list
+        """
+        self.objs = objs
+        self._objects = {}
+
+    def get_value(self, model, pk, field):
+        """
+        Get the value of ``field`` on the ``model`` object with ``pk``.
+
+        :param model: The choice model class.
+        :type model: ``django.db.models.Model``
+        :param pk: The stored pk.
+        :type pk: str
+        :param field: The field the value is taken from.
+        :type field: str
+        :rtype: Value from the ``field`` on the object.
+        :raises model.DoesNotExist: If the object was not found.
+        :raises AttributeError: If ``field`` is not on the object.
+        """
+        objects = get_request_cache()
+
+        if objects is None:
+            objects = self._objects
+
+        key = self._get_key(model, pk)
+        value_cache = get_value_cache(model)
+        value = value_cache.get((key[1], field))
+
+        if value is MISSING:
+            if key not in objects:
+                self._resolve(objects)
+
+            obj = objects.get(key)
+
+            if obj is None:
+                # Not found or a pk of 0, get_value_by_pk handles both.
+                value = model.objects.get_value_by_pk(pk, field)
+            else:
+                try:
+                    value = getattr(obj, field)
+                except (AttributeError, TypeError) as e:
+                    msg = _("The field value '%s' is not on object '%s'")
+                    log.error(msg, field, obj)
+                    raise e
+
+                value_cache.set((key[1], field), value)
+
+        return value
+
+    def _get_key(self, model, pk):
+        try:
+            pk = model._meta.pk.to_python(pk)
+        except ValidationError:
+            pass
+
+        return model._meta.label, pk
+
+    def _resolve(self, objects):
+        pks = {}
+
+        for obj in self.objs:
+            for model, pk in obj._get_choice_pks():
+                key = self._get_key(model, pk)
+
+                if key not in objects:
+                    pks.setdefault(model, {})[key[1]] = key
+
+        for model, keys in pks.items():
+            found = model.objects.in_bulk(list(keys))
+            log.debug("Resolved %s of %s %s choices.", len(found),
+                      len(keys), model._meta.label)
+
+            for pk, key in keys.items():
+                objects[key] = found.get(pk)
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/counters.py
+#
+
+"""
+An optional write-behind buffer for ``NUMBER`` dynamic columns used as
+high frequency counters. Enable it for slugs in the settings::
+
+  DYNAMIC_COLUMNS = {
+      'COUNTER_BUFFER': {
+          'SLUGS': ['views', 'downloads'],
+          'BACKEND': 'cache',
+          'MAX_PENDING': 100,
+          'FLUSH_INTERVAL': 10,
+          },
+      }
+
+Increments of these slugs are then added to the buffer and written to
+the database in batches. Use ``CollectionBase.get_counter`` to read a
+value with its pending amount.
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.core.cache import caches
+
+from .manager import dcolumn_manager
+from .models import CollectionBase, DynamicColumn, KeyValue
+from .signals import key_values_saved
+
+log = logging.getLogger('dcolumns.dcolumns.counters')
+
+
+class CounterBuffer:
+    """
+    The pending amounts of the buffered counters keyed by
+    ``(<CollectionBase pk>, <DynamicColumn pk>)``. A flush is done by the
+    ``add`` that reaches ``max_pending`` counters or comes
+    ``flush_interval`` seconds after the last flush.
+    """
+
+    def __init__(self, max_pending=100, flush_interval=10):
+        """
+        Constructor
+
+        :param max_pending: The number of pending counters that causes a
+                            flush.
+        :type max_pending: int
+        :param flush_interval: The seconds between flushes.
+        :type flush_interval: int or float
+        """
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def add(self, collection_pk, dc_pk, n):
+        """
+        Add ``n`` to a pending counter, flushing the buffer if it is full
+        or due. A failed flush is logged and the amounts are kept for the
+        next one, it does not raise here.
+
+        :param collection_pk: The pk of the object that inherits
+                              ``CollectionBase``.
+        :type collection_pk: int
+        :param dc_pk: The pk of the ``NUMBER`` ``DynamicColumn``.
+        :type dc_pk: int
+        :param n: The amount to add, may be negative.
+        :type n: int
+        """
+        size = self._add(collection_pk, dc_pk, n)
+
+        if (size >= self.max_pending or
+            time.monotonic() - self._last_flush >= self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # Logged by flush, the increment itself is not lost.
+                pass
+
+    def _add(self, collection_pk, dc_pk, n): # pragma: no cover
+        """
+        :rtype: The number of pending counters.
+        """
+        raise NotImplementedError
+
+    def pending(self, collection_pk, dc_pk): # pragma: no cover
+        """
+        Get the amount not yet written to the database.
+
+        :param collection_pk: The pk of the object that inherits
+                              ``CollectionBase``.
+        :type collection_pk: int
+        :param dc_pk: The pk of the ``NUMBER`` ``DynamicColumn``.
+        :type dc_pk: int
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def _pop_all(self): # pragma: no cover
+        """
+        Remove and return all the pending amounts.
+
+        :rtype: A dict of ``{(<collection pk>, <dc pk>): <n>, ...}``.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Write all the pending amounts to the database in batches. If the
+        write fails the amounts are put back in the buffer.
+
+        :rtype: The number of counters written.
+        """
+        self._last_flush = time.monotonic()
+        deltas = {key: n for key, n in self._pop_all().items() if n}
+
+        try:
+            write_deltas(deltas)
+        except Exception:
+            log.exception("Could not write %s counters, they are kept.",
+                          len(deltas))
+
+            for (collection_pk, dc_pk), n in deltas.items():
+                self._add(collection_pk, dc_pk, n)
+
+            raise
+
+        return len(deltas)
+
+
+class MemoryCounterBuffer(CounterBuffer):
+    """
+    A buffer in this process. Amounts are lost if the process dies
+    before a flush, they are flushed when it exits normally.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(int)
+        atexit.register(self.flush)
+
+    def _add(self, collection_pk, dc_pk, n):
+        with self._lock:
+            self._deltas[(collection_pk, dc_pk)] += n
+            return len(self._deltas)
+
+    def pending(self, collection_pk, dc_pk):
+        return self._deltas.get((collection_pk, dc_pk), 0)
+
+    def _pop_all(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(int)
+
+        return dict(deltas)
+
+
+class CacheCounterBuffer(CounterBuffer):
+    """
+    A buffer in a Django cache shared by all processes, the cache must
+    not evict keys before they are flushed. Each counter is a cache key
+    changed with atomic ``incr`` and ``decr``, a counter is logged the
+    first time it becomes pending so a flush can find it.
+    """
+    PREFIX = 'dcolumn:counter'
+
+    def __init__(self, alias='default', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = caches[alias]
+
+    def _key(self, *parts):
+        return ':'.join([self.PREFIX] + [str(part) for part in parts])
+
+    def _incr(self, key, n):
+        self.cache.add(key, 0, timeout=None)
+        return self.cache.incr(key, n)
+
+    def _add(self, collection_pk, dc_pk, n):
+        key = self._key(collection_pk, dc_pk)
+        self._incr(key, n)
+
+        if self.cache.add(key + ':dirty', True, timeout=None):
+            seq = self._incr(self._key('seq'), 1)
+            self.cache.set(self._key('log', seq), (collection_pk, dc_pk),
+                           timeout=None)
+        else:
+            seq = self.cache.get(self._key('seq'), 0)
+
+        return seq - self.cache.get(self._key('flushed'), 0)
+
+    def pending(self, collection_pk, dc_pk):
+        return self.cache.get(self._key(collection_pk, dc_pk), 0)
+
+    def _pop_all(self):
+        deltas = defaultdict(int)
+        lock = self._key('lock')
+
+        # Only one process reads the log at a time.
+        if self.cache.add(lock, True, timeout=60):
+            try:
+                flushed = self.cache.get(self._key('flushed'), 0)
+                seq = self.cache.get(self._key('seq'), 0)
+                log_keys = [self._key('log', i)
+                            for i in range(flushed + 1, seq + 1)]
+                entries = self.cache.get_many(log_keys)
+                done = []
+
+                for log_key in log_keys:
+                    # The entry of an add in progress, try it next time.
+                    if log_key not in entries:
+                        break
+
+                    collection_pk, dc_pk = entries[log_key]
+                    key = self._key(collection_pk, dc_pk)
+                    # Clear the flag first, a later add logs it again.
+                    self.cache.delete(key + ':dirty')
+                    n = self.cache.get(key, 0)
+
+                    if n:
+                        self.cache.decr(key, n)
+                        deltas[(collection_pk, dc_pk)] += n
+
+                    done.append(log_key)
+
+                self.cache.delete_many(done)
+                self.cache.set(self._key('flushed'), flushed + len(done),
+                               timeout=None)
+            finally:
+                self.cache.delete(lock)
+
+        return dict(deltas)
+
+
+def write_deltas(deltas):
+    """
+    Add amounts to the ``NUMBER`` values of many objects with one batched
+    write per storage engine.
+
+    :param deltas: A dict of ``{(<collection pk>, <dc pk>): <n>, ...}``.
+    :type deltas: dict
+    :rtype: A list of the saved ``KeyValue`` objects.
+    """
+    from .storage import add_many_values
+
+    key_values = []
+
+    if deltas:
+        objs = CollectionBase.objects.only('pk', 'json_values').in_bulk(
+            {pk for pk, dc_pk in deltas})
+        dcs = DynamicColumn.objects.in_bulk({dc_pk for pk, dc_pk in deltas})
+        key_values = add_many_values([
+            (objs[pk], dcs[dc_pk], n) for (pk, dc_pk), n in deltas.items()
+            if pk in objs and dc_pk in dcs])
+
+        collections = {}
+
+        for kv in key_values:
+            collections.setdefault(kv.collection_id, []).append(kv)
+
+        for kvs in collections.values():
+            key_values_saved.send(sender=KeyValue, key_values=kvs)
+
+    return key_values
+
+
+_counter_buffer = None
+_counter_buffer_config = None
+
+
+def get_counter_buffer(slug=None):
+    """
+    Get the counter buffer from ``settings.DYNAMIC_COLUMNS
+    ['COUNTER_BUFFER']``.
+
+    :param slug: If given only return the buffer if this slug is
+                 buffered.
+    :type slug: str or None
+    :rtype: A ``CounterBuffer`` object or ``None`` if the buffer or slug
+            is not enabled.
+    """
+    global _counter_buffer, _counter_buffer_config
+    config = dcolumn_manager.counter_buffer
+
+    if config != _counter_buffer_config:
+        kwargs = {'max_pending': config['MAX_PENDING'],
+                  'flush_interval': config['FLUSH_INTERVAL']}
+
+        if config['BACKEND'] not in ('memory', 'cache'):
+            msg = "Invalid COUNTER_BUFFER backend '{}'.".format(
+                config['BACKEND'])
+            log.error(msg)
+            raise ValueError(msg)
+
+        # Do not lose the amounts in a replaced buffer.
+        if _counter_buffer is not None:
+            _counter_buffer.flush()
+
+        if not config['SLUGS']:
+            _counter_buffer = None
+        elif config['BACKEND'] == 'cache':
+            _counter_buffer = CacheCounterBuffer(config['CACHE'], **kwargs)
+        else:
+            _counter_buffer = MemoryCounterBuffer(**kwargs)
+
+        _counter_buffer_config = config
+
+    if slug is not None and slug not in config['SLUGS']:
+        result = None
+    else:
+        result = _counter_buffer
+
+    return result
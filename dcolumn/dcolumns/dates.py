@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/dates.py
+#
+
+"""
+Decoding of the stored ``DATE``, ``DATETIME`` and ``TIME`` strings. New
+values are stored in ISO 8601 format by ``CollectionBase``, these are
+parsed with the standard library. Only legacy values fall back to
+``dateutil``, and every result is cached by its string.
+"""
+__docformat__ = "restructuredtext en"
+
+import datetime
+import functools
+
+from dateutil import parser
+
+CACHE_SIZE = 10000
+
+
+def parse_datetime(value, default=None):
+    """
+    Parse a stored date, datetime or time string the same way as
+    ``dateutil.parser.parse``.
+
+    :param value: The string to parse.
+    :type value: str
+    :param default: A datetime that supplies the parts missing from
+                    ``value``, the default is today at midnight.
+    :type default: ``datetime.datetime`` or None
+    :rtype: A ``datetime.datetime`` object.
+    :raises ValueError: If the string cannot be parsed.
+    """
+    if default is None:
+        default = datetime.datetime.combine(datetime.date.today(),
+                                            datetime.time())
+
+    return _parse_datetime(value, default)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _parse_datetime(value, default):
+    try:
+        result = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        result = None
+
+        # Without a ':' fromisoformat reads digits such as '2020' as a
+        # time, dateutil reads them as a date.
+        if ':' in value:
+            try:
+                result = datetime.datetime.combine(
+                    default.date(), datetime.time.fromisoformat(value))
+            except ValueError:
+                pass
+
+        if result is None:
+            # Legacy values in other formats.
+            try:
+                result = parser.parse(value, default=default)
+            except OverflowError as e:
+                raise ValueError(str(e))
+
+    return result
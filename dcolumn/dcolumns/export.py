@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/export.py
+#
+
+"""
+Streaming export of the objects of a collection with their decoded
+dynamic values. The objects and their ``KeyValue`` rows are read with two
+``iterator`` queries merged in pk order, so memory use does not grow with
+the size of the collection.
+"""
+__docformat__ = "restructuredtext en"
+
+import csv
+import json
+import logging
+import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .choices import ChoiceResolver
+from .models import DynamicColumn, CollectionBase, KeyValue
+
+log = logging.getLogger('dcolumns.dcolumns.export')
+
+FORMATS = ('csv', 'jsonl')
+
+
+def get_collection_model(name):
+    """
+    Get the model that inherits ``CollectionBase`` from its related model
+    name.
+
+    :param name: The related model name, ex. 'book'.
+    :type name: str
+    :rtype: The model class.
+    :raises ValueError: If no model inherits ``CollectionBase`` by that
+                        name.
+    """
+    models = {ro.name: ro.related_model
+              for ro in CollectionBase._meta.related_objects
+              if ro.one_to_one and ro.parent_link}
+    result = models.get(name.lower())
+
+    if result is None:
+        msg = "Invalid related model '{}', must be one of {}.".format(
+            name, sorted(models))
+        log.error(msg)
+        raise ValueError(msg)
+
+    return result
+
+
+def get_export_fields(model):
+    """
+    Get the concrete fields of ``model`` that are exported, these are the
+    fields of ``get_all_fields``.
+
+    :param model: A model that inherits ``CollectionBase``.
+    :type model: ``django.db.models.Model``
+    :rtype: A list of field objects.
+    """
+    names = model.objects.get_all_fields()
+    return [field for field in model._meta.concrete_fields
+            if field.name in names]
+
+
+def iter_export_rows(model, slugs=None, choice_raw=False, chunk_size=2000):
+    """
+    Iterate the objects of ``model`` in pk order as dicts of their field
+    values followed by their decoded dynamic column values.
+
+    :param model: A model that inherits ``CollectionBase``.
+    :type model: ``django.db.models.Model``
+    :param slugs: The slugs to export, defaults to ``get_all_slugs``.
+    :type slugs: list or None
+    :param choice_raw: If ``True`` ``CHOICE`` values are exported as the
+                       stored pk or value, else as their label.
+    :type choice_raw: bool
+    :param chunk_size: The number of rows fetched from the database at a
+                       time.
+    :type chunk_size: int
+    :rtype: A generator of dicts keyed by field ``attname`` and slug.
+    """
+    fields = get_export_fields(model)
+
+    if slugs is None:
+        slugs = model.objects.get_all_slugs()
+
+    batch = []
+
+    for obj in _iter_objects(model, chunk_size):
+        batch.append(obj)
+
+        if len(batch) >= chunk_size:
+            yield from _decode_batch(batch, fields, slugs, choice_raw)
+            batch = []
+
+    yield from _decode_batch(batch, fields, slugs, choice_raw)
+
+
+def _iter_objects(model, chunk_size):
+    """
+    Iterate the objects of ``model`` with their ``KeyValue`` objects
+    loaded, the two queries are merged on the object pk.
+    """
+    dcs = DynamicColumn.objects.in_bulk()
+    objs = model.objects.order_by('pk').iterator(chunk_size=chunk_size)
+    kvs = KeyValue.objects.filter(
+        collection_id__in=model.objects.values('pk')).order_by(
+        'collection_id').iterator(chunk_size=chunk_size)
+    kv = next(kvs, None)
+
+    for obj in objs:
+        key_values = []
+
+        while kv is not None and kv.collection_id <= obj.pk:
+            if kv.collection_id == obj.pk:
+                kv.dynamic_column = dcs[kv.dynamic_column_id]
+                key_values.append(kv)
+
+            kv = next(kvs, None)
+
+        if obj.uses_json_storage:
+            key_values = [
+                KeyValue(collection=obj, dynamic_column=dcs[int(pk)],
+                         value=value)
+                for pk, value in obj.json_values.items() if int(pk) in dcs]
+
+        obj._set_key_value_cache(key_values)
+        yield obj
+
+
+def _decode_batch(objs, fields, slugs, choice_raw):
+    # The objects of a batch resolve their CHOICE values together.
+    resolver = ChoiceResolver(objs)
+
+    for obj in objs:
+        obj._choice_resolver = resolver
+        row = {field.attname: getattr(obj, field.attname) for field in fields}
+
+        for slug in slugs:
+            if obj._get_cached_key_value(slug) is None:
+                row[slug] = ''
+            else:
+                row[slug] = obj.get_key_value(slug, choice_raw=choice_raw)
+
+        yield row
+
+
+def export_collection(model, stream, format='csv', slugs=None,
+                      choice_raw=False, chunk_size=2000):
+    """
+    Write the objects of ``model`` with their decoded dynamic column values
+    to ``stream`` as CSV with a header row or as JSON lines.
+
+    :param model: A model that inherits ``CollectionBase``.
+    :type model: ``django.db.models.Model``
+    :param stream: A text stream to write to.
+    :type stream: file object
+    :param format: 'csv' or 'jsonl'.
+    :type format: str
+    :param slugs: The slugs to export, defaults to ``get_all_slugs``.
+    :type slugs: list or None
+    :param choice_raw: See ``iter_export_rows``.
+    :type choice_raw: bool
+    :param chunk_size: See ``iter_export_rows``.
+    :type chunk_size: int
+    :rtype: The number of objects written.
+    :raises ValueError: If the format is invalid.
+    """
+    if format not in FORMATS:
+        msg = "Invalid format '{}', must be one of {}.".format(
+            format, FORMATS)
+        log.error(msg)
+        raise ValueError(msg)
+
+    if slugs is None:
+        slugs = model.objects.get_all_slugs()
+
+    rows = iter_export_rows(model, slugs=slugs, choice_raw=choice_raw,
+                            chunk_size=chunk_size)
+    count = 0
+
+    if format == 'csv':
+        header = [field.attname for field in get_export_fields(model)]
+        writer = csv.writer(stream)
+        writer.writerow(header + list(slugs))
+
+        for row in rows:
+            writer.writerow([_csv_value(value) for value in row.values()])
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+            count += 1
+
+    return count
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    elif value is None:
+        value = ''
+
+    return value
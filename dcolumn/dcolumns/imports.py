@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/imports.py
+#
+
+"""
+Bulk import of the objects of a collection and their dynamic column values
+from CSV or JSON lines, as written by ``dcolumn.dcolumns.export``.
+
+Rows are read in batches and converted by a pool of worker processes with
+the same converters ``set_key_value`` uses, then each batch is inserted in
+one transaction with ``CollectionBaseManager.bulk_create_with_values``.
+The number of rows done is written to an ``ImportProgress`` object in
+the transaction of each batch, so an interrupted import is resumed after
+exactly the committed rows.
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import csv
+import json
+import hashlib
+import logging
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.db import transaction
+
+from .export import get_export_fields
+from .models import ColumnCollection, ImportProgress
+
+log = logging.getLogger('dcolumns.dcolumns.imports')
+
+FORMATS = ('csv', 'jsonl')
+
+
+def get_import_format(path):
+    """
+    Get the format of a file from its extension.
+
+    :param path: The path of the file.
+    :type path: str
+    :rtype: 'csv' or 'jsonl'.
+    :raises ValueError: If the extension is not a known format.
+    """
+    result = os.path.splitext(path)[1].lstrip('.').lower()
+
+    if result not in FORMATS:
+        msg = "Invalid format '{}', must be one of {}.".format(
+            result, FORMATS)
+        log.error(msg)
+        raise ValueError(msg)
+
+    return result
+
+
+def _iter_rows(stream, format):
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line, text in enumerate(stream, start=1):
+            if text.strip():
+                yield line, json.loads(text)
+
+
+def import_collection(model, path, format=None, batch_size=1000,
+                      workers=None, resume=False, user=None, progress=None):
+    """
+    Import the objects of ``model`` from a file. The columns are the field
+    ``attname`` values and the slugs of the collection, the primary key
+    is not imported. Empty values are not stored and ``CHOICE`` values
+    must be the stored pk, or the stored field value of a
+    ``store_relation`` column, see the ``choice_raw`` argument of the
+    export. Invalid rows are skipped and returned with the reason.
+
+    :param model: A model that inherits ``CollectionBase``.
+    :type model: ``django.db.models.Model``
+    :param path: The path of the file.
+    :type path: str
+    :param format: 'csv' or 'jsonl', defaults to the file extension.
+    :type format: str or None
+    :param batch_size: The number of rows per transaction.
+    :type batch_size: int
+    :param workers: The number of worker processes, 0 converts in this
+                    process and ``None`` is the number of CPUs.
+    :type workers: int or None
+    :param resume: If ``True`` skip the rows done by an earlier run.
+    :type resume: bool
+    :param user: The creator and updater of rows without them, a batch
+                 with rows that have neither fails.
+    :type user: User object or None
+    :param progress: Called after every batch with the number of rows
+                     done, imported and invalid.
+    :type progress: function or None
+    :rtype: A tuple of the number of objects imported and a list of
+            ``(<line>, <error message>)`` of the invalid rows.
+    :raises ValueError: If the format or the collection is invalid.
+    """
+    format = format or get_import_format(path)
+    name = model._meta.model_name
+    cc = ColumnCollection.objects.active().filter(
+        related_model__iexact=model.__name__).first()
+
+    if cc is None:
+        msg = "No ColumnCollection for '{}'.".format(name)
+        log.error(msg)
+        raise ValueError(msg)
+
+    dcs = {dc.slug: dc for dc in cc.dynamic_column.active()}
+    fields = [field.attname for field in get_export_fields(model)]
+    key = get_import_key(model, path)
+    done = 0
+    count = 0
+    errors = []
+
+    if resume:
+        done = ImportProgress.objects.filter(key=key).values_list(
+            'rows', flat=True).first() or 0
+        log.info("Resuming the import of %s after %s rows.", path, done)
+    else:
+        ImportProgress.objects.filter(key=key).delete()
+
+    with open(path, newline='', encoding='utf-8') as stream:
+        rows = itertools.islice(_iter_rows(stream, format), done, None)
+        batches = _iter_batches(rows, batch_size)
+        args = (model._meta.label, dcs, fields)
+
+        for converted in _convert_batches(batches, args, workers):
+            valid = [(values, key_values)
+                     for line, error, values, key_values in converted
+                     if error is None]
+            errors.extend((line, error)
+                          for line, error, values, key_values in converted
+                          if error is not None)
+            done += len(converted)
+
+            with transaction.atomic():
+                count += _insert_batch(model, cc, valid, user)
+                ImportProgress.objects.update_or_create(
+                    key=key, defaults={'path': path, 'rows': done})
+
+            if progress:
+                progress(done, count, len(errors))
+
+    ImportProgress.objects.filter(key=key).delete()
+    return count, errors
+
+
+def get_import_key(model, path):
+    """
+    Get the ``ImportProgress.key`` of an import of ``path`` into
+    ``model``.
+
+    :param model: A model that inherits ``CollectionBase``.
+    :type model: ``django.db.models.Model``
+    :param path: The path of the file.
+    :type path: str
+    :rtype: str
+    """
+    text = '{}:{}'.format(model._meta.label, os.path.abspath(path))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _iter_batches(rows, batch_size):
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+
+        if not batch:
+            break
+
+        yield batch
+
+
+def _convert_batches(batches, args, workers):
+    """
+    Convert the batches in order, in worker processes unless ``workers``
+    is 0. No more than two batches per worker are pending at a time.
+    """
+    if workers == 0:
+        for batch in batches:
+            yield _convert_batch(args + (batch,))
+    else:
+        workers = workers or os.cpu_count() or 1
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker) as executor:
+            pending = deque()
+
+            for batch in batches:
+                pending.append(executor.submit(_convert_batch,
+                                               args + (batch,)))
+
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+
+def _init_worker():
+    # Needed when the processes are spawned instead of forked.
+    django.setup()
+
+
+def _convert_batch(args):
+    """
+    Convert the rows of a batch. This runs in a worker process and does
+    not use the database.
+
+    :param args: The model label, the ``DynamicColumn`` objects by slug,
+                 the exported field attnames and the rows.
+    :type args: tuple
+    :rtype: A list of ``(<line>, <error or None>, <field values>,
+            <{slug: stored value}>)``.
+    """
+    label, dcs, fields, rows = args
+    model = apps.get_model(label)
+    field_map = {field.attname: field for field in model._meta.fields
+                 if field.attname in fields}
+    # The primary key is exported but not imported.
+    skip = {name for name, field in field_map.items() if field.primary_key}
+    # The converters do not need a saved object.
+    converter = model()
+    result = []
+
+    for line, row in rows:
+        values = {}
+        key_values = {}
+        error = None
+
+        try:
+            for name, value in row.items():
+                if name in skip:
+                    continue
+                elif name in field_map:
+                    field = field_map[name]
+
+                    if value == '' and field.null:
+                        value = None
+
+                    values[name] = field.to_python(value)
+                elif name in dcs:
+                    dc = dcs[name]
+
+                    if value in (None, ''):
+                        continue
+                    elif dc.value_type == dc.CHOICE and dc.store_relation:
+                        # The raw export is already the stored field value.
+                        key_values[name] = str(value)
+                        continue
+
+                    value = converter._convert_value(dc, value)
+                    # A counter step on a new object counts from zero.
+                    key_values[name] = str(converter.COUNTER_STEPS.get(
+                        value, value))
+                else:
+                    raise ValueError("Unknown column '{}'.".format(name))
+        except Exception as e:
+            # Any bad value is an error of its row, not of the import.
+            error = '; '.join(getattr(e, 'messages', [str(e)]))
+
+        result.append((line, error, values, key_values))
+
+    return result
+
+
+def _insert_batch(model, cc, rows, user):
+    """
+    Insert the objects and their values of one batch.
+
+    :rtype: The number of objects inserted.
+    """
+    items = []
+
+    for values, key_values in rows:
+        values = dict(values, column_collection=cc)
+
+        if user is not None:
+            values['creator_id'] = values.get('creator_id') or user.pk
+            values['updater_id'] = values.get('updater_id') or user.pk
+
+        items.append((values, key_values))
+
+    # The values were converted by _convert_batch.
+    return len(model.objects.bulk_create_with_values(items, raw=True))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/management/commands/dcolumn_backfill_typed.py
+#
+
+"""
+Set the typed shadow fields on existing ``KeyValue`` objects.
+"""
+__docformat__ = "restructuredtext en"
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dcolumn.dcolumns.models import KeyValue
+
+log = logging.getLogger('dcolumns.dcolumns.management')
+
+
+class Command(BaseCommand):
+    help = ("Set the typed shadow fields (value_int, value_float, "
+            "value_datetime and value_bool) on all existing KeyValue "
+            "objects.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000, dest='chunk_size',
+            help="Number of KeyValue objects to update per query "
+            "(default 1000).")
+
+    def handle(self, *args, **options):
+        count = KeyValue.objects.backfill_typed_values(
+            chunk_size=options['chunk_size'])
+        self.stdout.write("Backfilled {} KeyValue objects.".format(count))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/management/commands/dcolumn_benchmark_dates.py
+#
+
+"""
+Compare the decoding of stored date strings with ``dateutil`` and with
+``parse_datetime``.
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+import datetime
+
+from dateutil import parser
+from django.core.management.base import BaseCommand
+
+from dcolumn.dcolumns.dates import parse_datetime, _parse_datetime
+
+
+class Command(BaseCommand):
+    help = ("Time the decoding of stored DATE, DATETIME and TIME strings "
+            "with dateutil and with the fast path, no database is used.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=100000, dest='count',
+            help="Number of values to decode (default 100000).")
+        parser.add_argument(
+            '--distinct', type=int, default=1000, dest='distinct',
+            help="Number of distinct values (default 1000).")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        distinct = max(1, options['distinct'])
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        values = []
+
+        # The formats CollectionBase stores, in equal parts.
+        for i in range(distinct):
+            dt = start + datetime.timedelta(minutes=i * 97, microseconds=i)
+            values.append((dt.isoformat(), dt.date().isoformat(),
+                           dt.timetz().isoformat())[i % 3])
+
+        values = [values[i % distinct] for i in range(count)]
+        timings = (
+            ("dateutil", parser.parse),
+            ("parse_datetime (uncached)", self._uncached),
+            ("parse_datetime", parse_datetime),
+            )
+        base = None
+
+        for name, func in timings:
+            _parse_datetime.cache_clear()
+            begin = time.perf_counter()
+
+            for value in values:
+                func(value)
+
+            elapsed = time.perf_counter() - begin
+            base = base or elapsed
+            self.stdout.write("{:<26} {:>9.3f}s {:>8.1f}x".format(
+                name, elapsed, base / elapsed if elapsed else 0))
+
+        self.stdout.write("Decoded {} values, {} distinct.".format(
+            count, min(count, distinct)))
+
+    def _uncached(self, value):
+        _parse_datetime.cache_clear()
+        return parse_datetime(value)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/management/commands/dcolumn_export.py
+#
+
+"""
+Export the objects of a collection with their dynamic column values.
+"""
+__docformat__ = "restructuredtext en"
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dcolumn.dcolumns.export import (
+    FORMATS, export_collection, get_collection_model)
+
+
+class Command(BaseCommand):
+    help = ("Stream the objects of a related model and their decoded "
+            "dynamic column values as CSV or JSON lines, memory use does "
+            "not grow with the number of objects.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'related_model', help="The related model name, ex. 'book'.")
+        parser.add_argument(
+            '--format', choices=FORMATS, default='csv', dest='format',
+            help="The output format (default csv).")
+        parser.add_argument(
+            '--output', default='-', dest='output',
+            help="The file to write, '-' is stdout (default).")
+        parser.add_argument(
+            '--slugs', default=None, dest='slugs',
+            help="A comma separated list of slugs to export (default "
+            "all).")
+        parser.add_argument(
+            '--choice-raw', action='store_true', dest='choice_raw',
+            help="Export CHOICE values as their stored pk instead of "
+            "their label.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000, dest='chunk_size',
+            help="Number of rows fetched at a time (default 2000).")
+
+    def handle(self, *args, **options):
+        try:
+            model = get_collection_model(options['related_model'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        slugs = options['slugs']
+
+        if slugs is not None:
+            slugs = [slug.strip() for slug in slugs.split(',')
+                     if slug.strip()]
+
+        kwargs = {'format': options['format'], 'slugs': slugs,
+                  'choice_raw': options['choice_raw'],
+                  'chunk_size': options['chunk_size']}
+
+        if options['output'] == '-':
+            count = export_collection(model, self.stdout, **kwargs)
+            # Keep stdout for the data.
+            out = self.stderr
+        else:
+            with open(options['output'], 'w', newline='',
+                      encoding='utf-8') as stream:
+                count = export_collection(model, stream, **kwargs)
+
+            out = self.stdout
+
+        out.write("Exported {} {} objects.".format(
+            count, model._meta.model_name))
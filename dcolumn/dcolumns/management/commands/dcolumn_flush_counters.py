@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/management/commands/dcolumn_flush_counters.py
+#
+
+"""
+Write the pending amounts of the counter buffer to the database.
+"""
+__docformat__ = "restructuredtext en"
+
+from django.core.management.base import BaseCommand
+
+from dcolumn.dcolumns.counters import get_counter_buffer
+
+
+class Command(BaseCommand):
+    help = ("Write the pending amounts of the counter buffer in "
+            "settings.DYNAMIC_COLUMNS['COUNTER_BUFFER'] to the database, "
+            "run it periodically when the 'cache' backend is used.")
+
+    def handle(self, *args, **options):
+        buffer = get_counter_buffer()
+        count = buffer.flush() if buffer else 0
+        self.stdout.write("Flushed {} counters.".format(count))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/management/commands/dcolumn_import.py
+#
+
+"""
+Import the objects of a collection with their dynamic column values.
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from dcolumn.dcolumns.export import get_collection_model
+from dcolumn.dcolumns.imports import FORMATS, import_collection
+
+
+class Command(BaseCommand):
+    help = ("Import the objects of a related model and their dynamic column "
+            "values from a CSV or JSON lines file, as written by "
+            "dcolumn_export --choice-raw. Rows are converted in worker "
+            "processes and inserted in batches, an interrupted import can "
+            "be continued with --resume.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'related_model', help="The related model name, ex. 'book'.")
+        parser.add_argument(
+            'path', help="The file to import, a .csv or .jsonl file.")
+        parser.add_argument(
+            '--format', choices=FORMATS, default=None, dest='format',
+            help="The file format (default from the file extension).")
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, dest='batch_size',
+            help="Number of rows per transaction (default 1000).")
+        parser.add_argument(
+            '--workers', type=int, default=None, dest='workers',
+            help="Number of worker processes, 0 for none (default the "
+            "number of CPUs).")
+        parser.add_argument(
+            '--resume', action='store_true', dest='resume',
+            help="Skip the rows done by an earlier interrupted run.")
+        parser.add_argument(
+            '--user', default=None, dest='user',
+            help="The username set as the creator and updater of rows "
+            "without them.")
+
+    def handle(self, *args, **options):
+        user = None
+
+        if options['user']:
+            try:
+                user = get_user_model().objects.get_by_natural_key(
+                    options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(
+                    "Invalid user '{}'.".format(options['user']))
+
+        self._start = time.monotonic()
+
+        try:
+            model = get_collection_model(options['related_model'])
+            count, errors = import_collection(
+                model, options['path'], format=options['format'],
+                batch_size=options['batch_size'], workers=options['workers'],
+                resume=options['resume'], user=user, progress=self._progress)
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
+        except (ValidationError, DatabaseError) as e:
+            # The failed batch was rolled back.
+            raise CommandError("A batch failed, {}. Run again with --resume "
+                               "to continue after the last batch.".format(
+                                   '; '.join(getattr(e, 'messages',
+                                                     [str(e)]))))
+
+        for line, error in errors:
+            self.stderr.write("Line {}: {}".format(line, error))
+
+        self.stdout.write("Imported {} {} objects, {} invalid rows.".format(
+            count, model._meta.model_name, len(errors)))
+
+    def _progress(self, done, count, invalid):
+        elapsed = time.monotonic() - self._start
+        self.stdout.write("{} rows done, {} imported, {} invalid, "
+                          "{:.0f} rows/s.".format(
+                              done, count, invalid,
+                              done / elapsed if elapsed else 0))
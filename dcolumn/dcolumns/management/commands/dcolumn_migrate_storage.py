@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/management/commands/dcolumn_migrate_storage.py
+#
+
+"""
+Move the values of a collection's objects to another storage engine.
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from dcolumn.dcolumns.models import ColumnCollection, CollectionBase
+from dcolumn.dcolumns.storage import get_storage_engine, migrate_object
+
+
+class Command(BaseCommand):
+    help = ("Move the values of the objects of a related model to another "
+            "storage engine in chunks. Each chunk is one short transaction "
+            "so the site can stay live, and the command can be run again "
+            "if interrupted.")
+    STORAGE_NAMES = {
+        'key_value': ColumnCollection.KEY_VALUE,
+        'json': ColumnCollection.JSON,
+        }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'related_model', help="The related model name, ex. 'book'.")
+        parser.add_argument(
+            'storage', help="The target storage, 'key_value', 'json' or "
+            "the number of a registered engine.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=500, dest='chunk_size',
+            help="Number of objects to move per transaction (default 500).")
+        parser.add_argument(
+            '--sleep', type=float, default=0, dest='sleep',
+            help="Seconds to pause between chunks (default 0).")
+
+    def handle(self, *args, **options):
+        storage = options['storage']
+
+        try:
+            number = self.STORAGE_NAMES.get(storage) or int(storage)
+            engine = get_storage_engine(number)
+        except ValueError:
+            raise CommandError("Invalid storage '{}'.".format(storage))
+
+        name = options['related_model'].lower()
+        # New objects are created in the target engine from now on, the
+        # update skips the save signals.
+        found = ColumnCollection.objects.active().filter(
+            related_model__iexact=name).update(storage=number)
+
+        if not found:
+            raise CommandError(
+                "No ColumnCollection for '{}'.".format(name))
+
+        queryset = CollectionBase.objects.filter(
+            column_collection__active=True,
+            column_collection__related_model__iexact=name).order_by('pk')
+        last_pk = 0
+        count = 0
+
+        while True:
+            with transaction.atomic():
+                objs = list(queryset.select_for_update().filter(
+                    pk__gt=last_pk)[:options['chunk_size']])
+
+                for obj in objs:
+                    count += migrate_object(obj, engine)
+
+            if not objs:
+                break
+
+            last_pk = objs[-1].pk
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write("Moved {} objects of {} to storage {}.".format(
+            count, name, storage))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/management/commands/dcolumn_normalize_values.py
+#
+
+"""
+Rewrite existing stored values in their canonical encoding.
+"""
+__docformat__ = "restructuredtext en"
+
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dcolumn.dcolumns.models import DynamicColumn, CollectionBase, KeyValue
+
+log = logging.getLogger('dcolumns.dcolumns.management')
+
+
+class Command(BaseCommand):
+    help = ("Rewrite the stored DATE, DATETIME, TIME, BOOLEAN, FLOAT and "
+            "NUMBER values of all KeyValue objects and JSON documents in "
+            "their canonical encoding, in chunks.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000, dest='chunk_size',
+            help="Number of objects to update per transaction "
+            "(default 1000).")
+
+    def handle(self, *args, **options):
+        count = KeyValue.objects.normalize_values(
+            chunk_size=options['chunk_size'])
+        self.stdout.write("Normalized {} KeyValue objects.".format(count))
+        count = self._normalize_json(options['chunk_size'])
+        self.stdout.write("Normalized {} JSON documents.".format(count))
+
+    def _normalize_json(self, chunk_size):
+        dcs = DynamicColumn.objects.in_bulk()
+        queryset = CollectionBase.objects.filter(
+            json_values__isnull=False).order_by('pk').only('pk', 'json_values')
+        last_pk = 0
+        count = 0
+
+        while True:
+            with transaction.atomic():
+                objs = list(queryset.select_for_update().filter(
+                    pk__gt=last_pk)[:chunk_size])
+
+                for obj in objs:
+                    values = {}
+
+                    for key, value in obj.json_values.items():
+                        try:
+                            values[key] = KeyValue.canonical_value(
+                                dcs[int(key)], value)
+                        except (KeyError, ValueError, OverflowError) as e:
+                            log.warning("Could not normalize %s on object "
+                                        "%s, %s", key, obj.pk, e)
+                            values[key] = value
+
+                    if values != obj.json_values:
+                        CollectionBase.objects.filter(pk=obj.pk).update(
+                            json_values=values)
+                        count += 1
+
+            if not objs:
+                break
+
+            last_pk = objs[-1].pk
+
+        return count
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/management/commands/dcolumn_rebuild_pivot.py
+#
+
+"""
+Create or rebuild the denormalized pivot tables.
+"""
+__docformat__ = "restructuredtext en"
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dcolumn.dcolumns.manager import dcolumn_manager
+from dcolumn.dcolumns.pivot import get_pivot_table
+
+
+class Command(BaseCommand):
+    help = ("Create or rebuild the pivot tables listed in "
+            "settings.DYNAMIC_COLUMNS['PIVOT_TABLES'].")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*', metavar='related_model',
+            help="Related model names to rebuild (default all).")
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000, dest='chunk_size',
+            help="Number of objects to write per query (default 1000).")
+
+    def handle(self, *args, **options):
+        names = options['names'] or dcolumn_manager.pivot_tables
+
+        for name in names:
+            table = get_pivot_table(name)
+
+            if table is None:
+                raise CommandError(
+                    "'{}' is not in settings.DYNAMIC_COLUMNS"
+                    "['PIVOT_TABLES'].".format(name))
+
+            count = table.rebuild(chunk_size=options['chunk_size'])
+            self.stdout.write("Rebuilt {} with {} rows.".format(
+                table.table_name, count))
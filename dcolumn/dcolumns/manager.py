@@ -271,6 +271,60 @@ class DynamicColumnManager:
 
         return result
 
+    @property
+    def pivot_tables(self):
+        """
+        Gets the value of settings.DYNAMIC_COLUMNS.PIVOT_TABLES. This is a
+        list of ``ColumnCollection.related_model`` names that are also kept
+        in a denormalized pivot table. The default is an empty list.
+
+        :rtype: A ``list`` of lowercase related model names.
+        """
+        if hasattr(settings, 'DYNAMIC_COLUMNS'):
+            result = [name.lower() for name in settings.DYNAMIC_COLUMNS.get(
+                'PIVOT_TABLES', [])]
+        else:
+            result = []
+
+        return result
+
+    @property
+    def counter_buffer(self):
+        """
+        Gets the value of settings.DYNAMIC_COLUMNS.COUNTER_BUFFER merged
+        with its defaults. ``SLUGS`` is a list of ``NUMBER`` dynamic column
+        slugs whose increments are buffered, ``BACKEND`` is 'memory' or
+        'cache', ``CACHE`` is the cache alias used by the 'cache'
+        backend, and the buffer is flushed when ``MAX_PENDING`` counters
+        are pending or ``FLUSH_INTERVAL`` seconds have passed.
+
+        :rtype: A ``dict`` of the buffer settings, ``SLUGS`` is empty if
+                the buffer is not enabled.
+        """
+        result = {'SLUGS': [], 'BACKEND': 'memory', 'CACHE': 'default',
+                  'MAX_PENDING': 100, 'FLUSH_INTERVAL': 10}
+
+        if hasattr(settings, 'DYNAMIC_COLUMNS'):
+            result.update(settings.DYNAMIC_COLUMNS.get('COUNTER_BUFFER', {}))
+
+        return result
+
+    @property
+    def schema_cache(self):
+        """
+        Gets the value of settings.DYNAMIC_COLUMNS.SCHEMA_CACHE merged with
+        its defaults. ``CACHE`` is the cache alias the schema is stored in
+        and ``TIMEOUT`` is the number of seconds an entry is kept.
+
+        :rtype: A ``dict`` of the schema cache settings.
+        """
+        result = {'CACHE': 'default', 'TIMEOUT': 86400}
+
+        if hasattr(settings, 'DYNAMIC_COLUMNS'):
+            result.update(settings.DYNAMIC_COLUMNS.get('SCHEMA_CACHE', {}))
+
+        return result
+
     def get_related_object_names(self, choose=True):
         """
         This method provides the models that inherit ``CollectionBase``
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcolumns', '0008_alter_collectionbase_creator_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keyvalue',
+            name='value_bool',
+            field=models.BooleanField(blank=True, editable=False, null=True, verbose_name='Boolean Value'),
+        ),
+        migrations.AddField(
+            model_name='keyvalue',
+            name='value_datetime',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Date Time Value'),
+        ),
+        migrations.AddField(
+            model_name='keyvalue',
+            name='value_float',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Float Value'),
+        ),
+        migrations.AddField(
+            model_name='keyvalue',
+            name='value_int',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='Integer Value'),
+        ),
+        migrations.AddIndex(
+            model_name='keyvalue',
+            index=models.Index(fields=['dynamic_column', 'value_int'], name='dcolumns_kv_int_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='keyvalue',
+            index=models.Index(fields=['dynamic_column', 'value_float'], name='dcolumns_kv_float_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='keyvalue',
+            index=models.Index(fields=['dynamic_column', 'value_datetime'], name='dcolumns_kv_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='keyvalue',
+            index=models.Index(fields=['dynamic_column', 'value_bool'], name='dcolumns_kv_bool_idx'),
+        ),
+    ]
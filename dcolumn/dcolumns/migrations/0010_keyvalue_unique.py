@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:10
+
+from django.db import migrations, models
+
+
+def dedupe_key_values(apps, schema_editor):
+    """
+    Keep only the newest KeyValue of each (collection, dynamic_column)
+    pair so the unique constraint can be created.
+    """
+    KeyValue = apps.get_model('dcolumns', 'KeyValue')
+    duplicates = KeyValue.objects.values(
+        'collection', 'dynamic_column').annotate(
+        count=models.Count('pk'), max_pk=models.Max('pk')).filter(
+        count__gt=1).order_by()
+
+    for item in duplicates.iterator():
+        KeyValue.objects.filter(
+            collection=item['collection'],
+            dynamic_column=item['dynamic_column']).exclude(
+            pk=item['max_pk']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcolumns', '0009_keyvalue_typed_values'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_key_values, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='keyvalue',
+            constraint=models.UniqueConstraint(fields=('collection', 'dynamic_column'), name='dcolumns_kv_collection_dc_uniq'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcolumns', '0010_keyvalue_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectionbase',
+            name='json_values',
+            field=models.JSONField(blank=True, editable=False, help_text='The values keyed by DynamicColumn pk when the JSON storage is used, else null.', null=True, verbose_name='JSON Values'),
+        ),
+        migrations.AddField(
+            model_name='columncollection',
+            name='storage',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Key Value Rows'), (2, 'JSON Document')], default=1, help_text='Choose how the values of new objects are stored, either one KeyValue row per value or all values in one JSON document on the object.', verbose_name='Storage'),
+        ),
+    ]
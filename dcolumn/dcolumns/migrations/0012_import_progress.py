@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcolumns', '0011_json_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='A hash of the model label and the absolute path.', max_length=64, unique=True, verbose_name='Key')),
+                ('path', models.TextField(help_text='The path of the file.', verbose_name='Path')),
+                ('rows', models.PositiveIntegerField(default=0, help_text='The number of rows of the file done.', verbose_name='Rows')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+            ],
+            options={
+                'verbose_name': 'Import Progress',
+                'verbose_name_plural': 'Import Progress',
+            },
+        ),
+    ]
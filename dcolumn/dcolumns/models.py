@@ -9,12 +9,15 @@ Dynamic Column dependent models.
 """
 __docformat__ = "restructuredtext en"
 
+import math
 import logging
 import datetime
-from dateutil import parser
+from decimal import Decimal
 from collections import OrderedDict
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, connections, router
+from django.utils import timezone
 from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
@@ -26,7 +29,9 @@ from dcolumn.common.model_mixins import (
     UserModelMixin, TimeModelMixin, StatusModelMixin, StatusModelManagerMixin,
     ValidateOnSaveMixin)
 
+from .dates import parse_datetime
 from .manager import dcolumn_manager
+from .signals import key_values_saved, collections_created
 
 log = logging.getLogger('dcolumns.dcolumns.models')
 
@@ -42,10 +47,14 @@ class DynamicColumnManager(StatusModelManagerMixin):
     def get_fk_slugs(self):
         """
         This method returns a dict of the relation model foreign key name
-        and slug.
+        and slug. The result is kept in the schema cache.
 
         :rtype: A dict of ``{<relation class name>: <slug>, ...}``.
         """
+        from .schema import get_schema
+        return get_schema('fk_slugs', self._get_fk_slugs)
+
+    def _get_fk_slugs(self):
         result = {}
 
         for record in self.active():
@@ -218,7 +227,9 @@ class ColumnCollectionManager(StatusModelManagerMixin):
     def get_column_collection(self, name, unassigned=False):
         """
         Get the query set for the named collection. If unassigned is True
-        add the unassigned dynamic columns to the query set.
+        add the unassigned dynamic columns to the query set. The pks of the
+        records are kept in the schema cache, so only evaluating the query
+        set is a query.
 
         :param name: Name of the column collection.
         :type name: str
@@ -230,20 +241,45 @@ class ColumnCollectionManager(StatusModelManagerMixin):
                                                found and unassigned is False.
         """
         log.debug("Collection name: %s, unassigned: %s", name, unassigned)
+        records = self._get_cached_columns(name, unassigned)
+        return DynamicColumn.objects.filter(
+            pk__in=[record.pk for record in records])
+
+    def _get_cached_columns(self, name, unassigned=False):
+        """
+        Get the ``DynamicColumn`` objects of ``get_column_collection`` from
+        the schema cache.
+
+        :rtype: A list of ``DynamicColumn`` objects.
+        :raises ColumnCollection.DoesNotExist: If the collection name is not
+                                               found and unassigned is False.
+        """
+        from .schema import get_schema
+        key = 'collection:{}:{:d}'.format(name.lower(), unassigned)
+        exists, records = get_schema(
+            key, lambda: self._get_column_records(name, unassigned))
+
+        if not exists and not unassigned:
+            raise self.model.DoesNotExist(
+                "ColumnCollection matching query does not exist.")
+
+        return records
+
+    def _get_column_records(self, name, unassigned):
+        exists = True
         queryset = self.none()
 
         try:
             queryset = self.active().get(
                 related_model__iexact=name).dynamic_column.active()
-        except self.model.DoesNotExist as e:
-            if not unassigned:
-                raise e
+        except self.model.DoesNotExist:
+            exists = False
 
         if unassigned:
             queryset |= DynamicColumn.objects.active().filter(
                 column_collection=None)
 
-        return queryset
+        return exists, list(queryset)
 
     def serialize_columns(self, name, obj=None, by_slug=False):
         """
@@ -264,7 +300,7 @@ class ColumnCollectionManager(StatusModelManagerMixin):
         :rtype: An OrderedDict of serialized ``KeyValue`` values and their
                 ``DynamicColumn`` meta data.
         """
-        records = self.get_column_collection(name)
+        records = self._get_cached_columns(name)
         result = OrderedDict()
 
         if obj:
@@ -307,7 +343,7 @@ class ColumnCollectionManager(StatusModelManagerMixin):
         :rtype: A ``list`` of all ``CHOICE`` items including both model and
                 choice items.
         """
-        records = self.get_column_collection(name)
+        records = self._get_cached_columns(name)
         return [dcolumn_manager.choice_relation_map.get(record.relation)
                 for record in records if record.relation]
 
@@ -325,7 +361,7 @@ class ColumnCollectionManager(StatusModelManagerMixin):
         :type use_pk: bool
         :rtype: A list of tuples. ``[(<slug or pk>, <KeyValue name>), ...]``
         """
-        records = self.get_column_collection(name)
+        records = self._get_cached_columns(name)
         choices = [(use_pk and r.pk or r.slug, r.name) for r in records]
         return choices
 
@@ -336,6 +372,12 @@ class ColumnCollection(TimeModelMixin, UserModelMixin, StatusModelMixin,
     This model defines the collection of ``DynamicColumn`` objects in this
     set.
     """
+    KEY_VALUE = 1
+    JSON = 2
+    STORAGE_TYPES = (
+        (KEY_VALUE, _("Key Value Rows")),
+        (JSON, _("JSON Document")),
+        )
 
     name = models.CharField(
         verbose_name=_("Name"), unique=True, max_length=50,
@@ -346,6 +388,11 @@ class ColumnCollection(TimeModelMixin, UserModelMixin, StatusModelMixin,
     related_model = models.CharField(
         verbose_name=_("Related Model"), unique=True, max_length=50,
         help_text=_("Choose the related model."))
+    storage = models.PositiveSmallIntegerField(
+        verbose_name=_("Storage"), choices=STORAGE_TYPES, default=KEY_VALUE,
+        help_text=_("Choose how the values of new objects are stored, "
+                    "either one KeyValue row per value or all values in "
+                    "one JSON document on the object."))
 
     objects = ColumnCollectionManager()
 
@@ -386,7 +433,289 @@ class ColumnCollection(TimeModelMixin, UserModelMixin, StatusModelMixin,
 #
 # CollectionBase
 #
-class CollectionBaseManager(models.Manager):
+class CollectionBaseQuerySet(models.QuerySet):
+    """
+    The queryset class for any model that inherits ``CollectionBase``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._with_key_values = False
+        self._key_value_slugs = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_key_values = self._with_key_values
+        clone._key_value_slugs = self._key_value_slugs
+        return clone
+
+    def _fetch_all(self):
+        fetch = self._result_cache is None
+        super()._fetch_all()
+
+        if (fetch and self._with_key_values and
+            issubclass(self._iterable_class, models.query.ModelIterable)):
+            self._attach_key_values(self._result_cache)
+
+    def _attach_key_values(self, objs):
+        """
+        Load the ``KeyValue`` objects for all ``objs`` with one load per
+        storage engine and attach them to each instance.
+
+        :param objs: Model instances that inherit ``CollectionBase``.
+        :type objs: list
+        """
+        from .choices import ChoiceResolver
+        from .storage import get_object_engine
+
+        key_values = {}
+        engines = {}
+        # The objects resolve their CHOICE values together.
+        resolver = ChoiceResolver(objs)
+
+        for obj in objs:
+            engine = get_object_engine(obj)
+            engines.setdefault(engine, []).append(obj)
+
+        for engine, engine_objs in engines.items():
+            key_values.update(engine.load(engine_objs,
+                                          slugs=self._key_value_slugs))
+
+        for obj in objs:
+            obj._set_key_value_cache(key_values.get(obj.pk, []),
+                                     slugs=self._key_value_slugs)
+            obj._choice_resolver = resolver
+
+    def with_key_values(self, slugs=None):
+        """
+        Load the ``KeyValue`` objects for every object in this queryset
+        with one additional query, so that ``get_key_value`` is served
+        from memory. Use this on list views to avoid a query per object
+        per slug.
+
+        :param slugs: An optional list of ``DynamicColumn`` slugs to limit
+                      the ``KeyValue`` objects loaded. Slugs that are not
+                      in this list are still fetched from the database
+                      when asked for.
+        :type slugs: list or None
+        :rtype: A queryset of objects that inherit ``CollectionBase``.
+        """
+        clone = self._chain()
+        clone._with_key_values = True
+        clone._key_value_slugs = (None if slugs is None
+                                  else tuple(slugs))
+        return clone
+
+    def _get_dynamic_columns(self, slugs):
+        """
+        Get the active ``DynamicColumn`` objects of this model's
+        ``ColumnCollection`` for ``slugs``. The queries built on them only
+        read ``KeyValue`` rows, so the collection must use that storage.
+
+        :param slugs: The ``DynamicColumn`` slugs.
+        :type slugs: list
+        :rtype: A dict of ``{<slug>: <DynamicColumn object>, ...}``.
+        :raises ValueError: If a slug is not in the collection or the
+                            collection does not use ``KeyValue`` storage.
+        """
+        queryset = DynamicColumn.objects.active().filter(
+            column_collection__active=True,
+            column_collection__related_model__iexact=self.model.__name__,
+            slug__in=slugs).annotate(
+            _storage=models.F('column_collection__storage'))
+        dcs = {dc.slug: dc for dc in queryset}
+        missing = [slug for slug in slugs if slug not in dcs]
+
+        if missing:
+            msg = "Could not find DynamicColumn for slugs {}.".format(missing)
+            log.error(msg)
+            raise ValueError(msg)
+
+        if any(dc._storage != ColumnCollection.KEY_VALUE
+               for dc in dcs.values()):
+            msg = ("The collection of {} does not use KeyValue storage, its "
+                   "values cannot be queried.").format(self.model.__name__)
+            log.error(msg)
+            raise ValueError(msg)
+
+        return dcs
+
+    def _dcolumn_value(self, dc, outer_ref='pk'):
+        """
+        A correlated subquery of the ``KeyValue`` value of ``dc``, taken
+        from its typed field so the result has the column's type.
+
+        :param dc: The ``DynamicColumn`` object.
+        :type dc: ``DynamicColumn`` object
+        :param outer_ref: The outer field holding the ``CollectionBase``
+                          pk.
+        :type outer_ref: str
+        :rtype: A Django ``Subquery`` expression.
+        """
+        field = KeyValue.get_typed_field(dc)
+        queryset = KeyValue.objects.filter(
+            collection=models.OuterRef(outer_ref), dynamic_column=dc
+            ).order_by().values(field)[:1]
+        return models.Subquery(queryset)
+
+    def annotate_dcolumn(self, slug, alias=None):
+        """
+        Annotate each object with the typed value of a ``DynamicColumn``
+        slug, so it can be used in ``filter``, ``order_by`` or
+        ``values`` like a model field. Objects without a value get
+        ``None``.
+
+        :param slug: The ``DynamicColumn`` slug.
+        :type slug: str
+        :param alias: The annotation name, defaults to the slug.
+        :type alias: str or None
+        :rtype: A queryset of objects that inherit ``CollectionBase``.
+        :raises ValueError: If the slug is not in the collection or the
+                            collection does not use ``KeyValue`` storage.
+        """
+        dc = self._get_dynamic_columns([slug])[slug]
+        return self.annotate(**{alias or slug: self._dcolumn_value(dc)})
+
+    def order_by_dcolumn(self, *slugs):
+        """
+        Order by the typed values of ``DynamicColumn`` slugs in the
+        database. A slug prefixed with '-' is in descending order. This
+        replaces any previous ordering and ties are ordered by pk, so
+        the ordering is stable when paginating.
+
+        :param slugs: The ``DynamicColumn`` slugs.
+        :type slugs: str
+        :rtype: A queryset of objects that inherit ``CollectionBase``.
+        :raises ValueError: If a slug is not in the collection or the
+                            collection does not use ``KeyValue`` storage.
+        """
+        dcs = self._get_dynamic_columns([slug.lstrip('-') for slug in slugs])
+        ordering = []
+
+        for slug in slugs:
+            value = self._dcolumn_value(dcs[slug.lstrip('-')])
+            ordering.append(
+                value.desc() if slug.startswith('-') else value.asc())
+
+        return self.order_by(*ordering, 'pk')
+
+    def aggregate_dcolumn(self, slug, *aggregates, group_by=None):
+        """
+        Aggregate the typed values of a ``DynamicColumn`` slug over the
+        objects in this queryset in the database, for example
+        ``Book.objects.aggregate_dcolumn('number_of_pages', Sum, Avg)``.
+        Results are keyed like ``QuerySet.aggregate``,
+        ``<slug>__<aggregate name>``. If ``group_by`` is the slug of a
+        ``CHOICE`` (or any other) column the aggregates are grouped by its
+        value.
+
+        :param slug: The ``DynamicColumn`` slug to aggregate.
+        :type slug: str
+        :param aggregates: Django aggregate classes, ex. ``Sum``, ``Avg``,
+                           ``Min``, ``Max`` or ``Count``.
+        :type aggregates: ``django.db.models.Aggregate`` classes
+        :param group_by: An optional ``DynamicColumn`` slug to group by.
+        :type group_by: str or None
+        :rtype: A dict of ``{<alias>: <value>, ...}`` or if ``group_by``
+                is used a dict of ``{<group value>: {<alias>: <value>,
+                ...}, ...}`` where objects without a group value are
+                under ``None``.
+        :raises ValueError: If a slug is not in the collection, the
+                            collection does not use ``KeyValue`` storage
+                            or no aggregates are given.
+        """
+        if not aggregates or not all(
+            isinstance(agg, type) and issubclass(agg, models.Aggregate)
+            for agg in aggregates):
+            msg = "Invalid aggregates {}, must be Aggregate classes.".format(
+                aggregates)
+            log.error(msg)
+            raise ValueError(msg)
+
+        slugs = [slug] if group_by is None else [slug, group_by]
+        dcs = self._get_dynamic_columns(slugs)
+        field = KeyValue.get_typed_field(dcs[slug])
+        kwargs = {'{}__{}'.format(slug, agg.name.lower()): agg(field)
+                  for agg in aggregates}
+        queryset = KeyValue.objects.filter(
+            dynamic_column=dcs[slug],
+            collection__in=self.order_by().values('pk'))
+
+        if group_by is None:
+            result = queryset.aggregate(**kwargs)
+        else:
+            group = self._dcolumn_value(dcs[group_by], outer_ref='collection')
+            result = {}
+
+            for item in queryset.annotate(_dcolumn_group=group).values(
+                '_dcolumn_group').annotate(**kwargs).order_by():
+                result[item.pop('_dcolumn_group')] = item
+
+        return result
+
+    def filter_dcolumns(self, **lookups):
+        """
+        Filter on ``KeyValue`` values in the database. Each keyword is a
+        ``DynamicColumn`` slug with an optional Django lookup, for example
+        ``Book.objects.filter_dcolumns(edition__gte=2, language=2)``. Each
+        lookup becomes an ``EXISTS`` subquery against the indexed typed
+        field of the ``KeyValue`` for the slug's value type. Text types
+        use the ``value`` field and ``CHOICE`` values can be given as an
+        object or a pk. ``<slug>__isnull=True`` matches objects without a
+        value.
+
+        :param lookups: Keyword arguments of
+                        ``<slug>[__<lookup>]=<value>``.
+        :type lookups: dict
+        :rtype: A queryset of objects that inherit ``CollectionBase``.
+        :raises ValueError: If a slug is not in the collection, the
+                            collection does not use ``KeyValue`` storage
+                            or a value cannot be converted.
+        """
+        parsed = []
+
+        for key, value in lookups.items():
+            slug, sep, lookup = key.partition('__')
+            parsed.append((slug, lookup or 'exact', value))
+
+        dcs = self._get_dynamic_columns([item[0] for item in parsed])
+        queryset = self
+
+        for slug, lookup, value in parsed:
+            dc = dcs[slug]
+            field = KeyValue.get_typed_field(dc)
+            key_values = KeyValue.objects.filter(
+                collection=models.OuterRef('pk'), dynamic_column=dc)
+
+            if lookup == 'isnull':
+                condition = models.Exists(key_values.filter(
+                    **{'{}__isnull'.format(field): False}))
+
+                if value:
+                    condition = ~condition
+            else:
+                try:
+                    if lookup in ('in', 'range'):
+                        value = [KeyValue.to_typed_value(field, item)
+                                 for item in value]
+                    else:
+                        value = KeyValue.to_typed_value(field, value)
+                except (ValueError, OverflowError, TypeError) as e:
+                    msg = ("Invalid value {} for lookup {}__{}, {}.").format(
+                        value, slug, lookup, e)
+                    log.error(msg)
+                    raise ValueError(msg)
+
+                condition = models.Exists(key_values.filter(
+                    **{'{}__{}'.format(field, lookup): value}))
+
+            queryset = queryset.filter(condition)
+
+        return queryset
+
+
+class CollectionBaseManager(
+    models.Manager.from_queryset(CollectionBaseQuerySet)):
     """
     The manager class for any model that inherits ``CollectionBase``.
     """
@@ -443,7 +772,9 @@ class CollectionBaseManager(models.Manager):
 
     def get_value_by_pk(self, pk, field):
         """
-        Returns the value from 'field' using the pk as the key.
+        Returns the value from 'field' using the pk as the key. Values are
+        kept in a bounded LRU cache per model that is evicted when the
+        object is saved or deleted, see ``dcolumn.dcolumns.choices``.
 
         :param pk: The key of the object.
         :type pk: int or str
@@ -453,61 +784,280 @@ class CollectionBaseManager(models.Manager):
         :raises CollectionBase.DoesNotExist: If the `Dcolumn` model object was
                                              not found.
         """
+        from .choices import get_value_cache, MISSING
+
         value = ''
 
         if int(pk) != 0:
-            try:
-                obj = self.get(pk=pk)
-            except self.model.DoesNotExist as e:
-                msg = _("Access to PK %s failed, %s")
-                log.error(msg, pk, e)
-                raise e
-            else:
+            value_cache = get_value_cache(self.model)
+            key = (int(pk), field)
+            value = value_cache.get(key)
+
+            if value is MISSING:
                 try:
-                    value = getattr(obj, field)
-                except (AttributeError, TypeError) as e:
-                    msg = _("The field value '%s' is not on object '%s'")
-                    log.error(msg, field, obj)
+                    obj = self.get(pk=pk)
+                except self.model.DoesNotExist as e:
+                    msg = _("Access to PK %s failed, %s")
+                    log.error(msg, pk, e)
                     raise e
+                else:
+                    try:
+                        value = getattr(obj, field)
+                    except (AttributeError, TypeError) as e:
+                        msg = _("The field value '%s' is not on object '%s'")
+                        log.error(msg, field, obj)
+                        raise e
+
+                value_cache.set(key, value)
 
         return value
 
+    def value_cache_info(self):
+        """
+        Returns the counters of the cache used by ``get_value_by_pk``.
+
+        :rtype: A dict of ``{'hits': <int>, 'misses': <int>,
+                'size': <int>, 'maxsize': <int>}``.
+        """
+        from .choices import get_value_cache
+        return get_value_cache(self.model).info()
+
+    def bulk_create_with_values(self, rows, batch_size=None, raw=False):
+        """
+        Create many objects and their dynamic column values in a few batched
+        statements. Django's ``bulk_create`` does not support multi-table
+        inheritance, so the ``CollectionBase`` rows are inserted first, with
+        their pks returned by the insert where the database supports it,
+        then the rows of each child table and last the values with the
+        ``save_new`` method of the storage engine. The model's ``save`` and
+        ``full_clean`` are not called, instead of ``post_save`` and
+        ``key_values_saved`` the ``collections_created`` signal is sent
+        once for all the objects.
+
+        :param rows: A list of ``(<fields>, <values>)`` tuples, where
+                     ``fields`` is a dict of model field values and
+                     ``values`` a dict of ``{<slug>: <value>, ...}`` as in
+                     ``set_key_values``. Empty values are not stored. The
+                     ``column_collection`` defaults to the collection of
+                     this model.
+        :type rows: list
+        :param batch_size: The number of rows per insert statement, the
+                           default is as large as the database allows.
+        :type batch_size: int or None
+        :param raw: If ``True`` the values are already the stored strings,
+                    as ``KeyValue.value`` has them, and are not converted.
+        :type raw: bool
+        :rtype: A list of the created objects, their ``KeyValue`` objects
+                are cached.
+        :raises ValueError: If there is no collection, an unknown slug or an
+                            invalid value. Nothing is written when raised.
+        :raises ValidationError: If a ``KeyValue`` object is invalid.
+        """
+        from .schema import get_dynamic_column_map
+        from .storage import get_storage_engine
+
+        model = self.model
+        db = self._db or router.db_for_write(model)
+        now = timezone.now()
+        default_cc = None
+        ccs = {}
+        pairs = []
+        errors = {}
+
+        # Convert everything before anything is written.
+        for fields, values in rows:
+            obj = model(**fields)
+
+            if obj.column_collection_id is None:
+                if default_cc is None:
+                    default_cc = ColumnCollection.objects.active().filter(
+                        related_model__iexact=model.__name__).first()
+
+                    if default_cc is None:
+                        msg = "No ColumnCollection for '{}'.".format(
+                            model._meta.model_name)
+                        log.error(msg)
+                        raise ValueError(msg)
+
+                obj.column_collection = default_cc
+
+            if obj.column_collection_id not in ccs:
+                ccs[obj.column_collection_id] = obj.column_collection
+
+            obj.created = obj.created or now
+            obj.updated = obj.updated or now
+            dcs = get_dynamic_column_map(obj.column_collection_id)
+            missing = [slug for slug in values if slug not in dcs]
+
+            if missing:
+                msg = "Could not find DynamicColumn for slugs {}.".format(
+                    missing)
+                log.error(msg)
+                raise ValueError(msg)
+
+            kvs = []
+
+            for slug, value in values.items():
+                if value in (None, ''):
+                    continue
+
+                if not raw:
+                    value = obj._convert_value(dcs[slug], value)
+                    # A counter step on a new object counts from zero.
+                    value = str(obj.COUNTER_STEPS.get(value, value))
+
+                kv = KeyValue(collection=obj, dynamic_column=dcs[slug],
+                              value=value)
+                kv.populate_typed_values()
+
+                try:
+                    kv.clean_fields(exclude=('collection', 'dynamic_column'))
+                except ValidationError as e:
+                    key = '{} (row {})'.format(slug, len(pairs))
+                    errors[key] = e.messages
+
+                kvs.append(kv)
+
+            engine = get_storage_engine(ccs[obj.column_collection_id].storage)
+            engine.initialize(obj)
+            pairs.append((obj, kvs, engine))
+
+        if errors:
+            log.error("Invalid KeyValue objects: %s", errors)
+            raise ValidationError(errors)
+
+        objs = [obj for obj, kvs, engine in pairs]
+
+        with transaction.atomic(using=db):
+            self._bulk_insert_tables(objs, db, batch_size)
+            engines = {}
+
+            for obj, kvs, engine in pairs:
+                engines.setdefault(engine, []).append((obj, kvs))
+
+            for engine, items in engines.items():
+                engine.save_new(items)
+
+            for obj, kvs, engine in pairs:
+                obj._set_key_value_cache(kvs)
+
+            collections_created.send(
+                sender=model, objs=[(obj, kvs) for obj, kvs, engine in pairs])
+
+        return objs
+
+    def _bulk_insert_tables(self, objs, db, batch_size):
+        """
+        Insert the ``CollectionBase`` rows, set their pks on ``objs`` and
+        insert the rows of each child table. The child inserts use
+        ``QuerySet._insert``, which is what ``Model.save`` and
+        ``bulk_create`` use.
+        """
+        parent_fields = CollectionBase._meta.concrete_fields
+        parents = [CollectionBase(**{field.attname: getattr(
+            obj, field.attname) for field in parent_fields
+            if not field.primary_key}) for obj in objs]
+        connection = connections[db]
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            # PostgreSQL, MariaDB and SQLite 3.35+ return the pks.
+            CollectionBase._base_manager.using(db).bulk_create(
+                parents, batch_size=batch_size)
+        else: # pragma: no cover
+            for parent in parents:
+                parent.save_base(using=db, force_insert=True)
+
+        chain = [cls for cls in reversed(self.model._meta.get_parent_list())
+                 if cls is not CollectionBase] + [self.model]
+
+        for obj, parent in zip(objs, parents):
+            setattr(obj, CollectionBase._meta.pk.attname, parent.pk)
+
+            for cls in chain:
+                for link in cls._meta.parents.values():
+                    if link is not None:
+                        setattr(obj, link.attname, parent.pk)
+
+            obj._state.adding = False
+            obj._state.db = db
+
+        for cls in chain:
+            fields = cls._meta.local_concrete_fields
+            size = connection.ops.bulk_batch_size(fields, objs)
+            size = min(batch_size, size) if batch_size else size
+            size = max(size, 1)
+
+            for i in range(0, len(objs), size):
+                cls._base_manager.using(db)._insert(
+                    objs[i:i + size], fields=fields, using=db)
+
+    def pivot(self):
+        """
+        Returns the rows of this model's pivot table, where each
+        ``DynamicColumn`` slug is a typed field, for example
+        ``Book.objects.pivot().filter(edition__gte=2).order_by('-edition')``.
+        The ``collection_id`` field is the pk of the object.
+
+        :rtype: A Django queryset of the pivot table model.
+        :raises ValueError: If the model is not in
+                            ``settings.DYNAMIC_COLUMNS['PIVOT_TABLES']``.
+        """
+        from .pivot import get_pivot_table
+
+        table = get_pivot_table(self.model.__name__)
+
+        if table is None:
+            msg = ("The model '{}' does not have a pivot table, add it to "
+                   "settings.DYNAMIC_COLUMNS['PIVOT_TABLES'].").format(
+                self.model.__name__)
+            log.error(msg)
+            raise ValueError(msg)
+
+        return table.model.objects.all()
+
     def get_all_slugs(self):
         """
-        Returns all ``DynamicColumn`` slug names relative to this model.
+        Returns all ``DynamicColumn`` slug names of the ``ColumnCollection``
+        of this model. The slugs are kept in the schema cache.
 
         :rtype: List of slugs.
         """
-        result = []
-        obj = self.select_related('column_collection').first()
+        from .schema import get_schema
+        key = 'slugs:{}'.format(self.model._meta.model_name)
+        return list(get_schema(key, self._get_all_slugs))
 
-        if obj:
-            kvs = obj.column_collection.dynamic_column.values_list(
-                'slug', flat=True).order_by('slug')
-            result[:] = list(kvs)
-
-        return result
+    def _get_all_slugs(self):
+        return list(DynamicColumn.objects.filter(
+            column_collection__related_model__iexact=self.model.__name__
+            ).values_list('slug', flat=True).order_by('slug'))
 
     def get_all_fields(self):
         """
-        Returns all model field names.
+        Returns all model field names. The names are kept in the schema
+        cache.
 
         :rtype: List of fields.
         """
+        from .schema import get_schema
+        key = 'fields:{}'.format(self.model._meta.model_name)
+        return list(get_schema(key, self._get_all_fields))
+
+    def _get_all_fields(self):
         return [field.name for field in self.model._meta.get_fields()
                 if 'collection' not in field.name and
-                field.name != 'keyvalues']
+                field.name not in ('keyvalues', 'json_values')]
 
     def get_all_fields_and_slugs(self):
         """
         Returns all field names and the ``DynamicColumn`` slugs in a sorted
-        list.
+        list. The list is kept in the schema cache.
 
         :rtype: List of all field and slugs.
         """
-        result = self.get_all_slugs() + self.get_all_fields()
-        result.sort()
-        return result
+        from .schema import get_schema
+        key = 'fields_and_slugs:{}'.format(self.model._meta.model_name)
+        return list(get_schema(key, lambda: sorted(
+            self.get_all_slugs() + self.get_all_fields())))
 
 
 class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
@@ -518,23 +1068,163 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
     TRUE = _("true")
     FALSE = _("false")
     TRUE_FALSE = (TRUE, FALSE, "true", "false")
+    COUNTER_STEPS = {'increment': 1, 'decrement': -1}
 
     column_collection = models.ForeignKey(
         ColumnCollection, on_delete=models.CASCADE,
         verbose_name=_("Column Collection"),
         help_text=_("Choose the version of the dynamic columns you want "
                     "for all Collections."))
+    json_values = models.JSONField(
+        verbose_name=_("JSON Values"), null=True, blank=True, editable=False,
+        help_text=_("The values keyed by DynamicColumn pk when the JSON "
+                    "storage is used, else null."))
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.__save_deferred = []
+        self.__key_value_cache = None
+        self.__key_value_slugs = None
+        self.__decoded_cache = {}
+        self._choice_resolver = None
 
     def save(self, *args, **kwargs):
         """
-        Be sure the complete MRO has their saves called.
+        Be sure the complete MRO has their saves called. A new object gets
+        the storage engine of its ``ColumnCollection``.
         """
+        if self._state.adding:
+            from .storage import get_storage_engine
+            get_storage_engine(self.column_collection.storage).initialize(self)
+
         super().save(*args, **kwargs)
 
+    @property
+    def storage_engine(self):
+        """
+        The storage engine that owns the values of this object, see
+        ``dcolumn.dcolumns.storage``.
+        """
+        from .storage import get_object_engine
+        return get_object_engine(self)
+
+    @property
+    def uses_json_storage(self):
+        """
+        ``True`` if the values of this object are stored in
+        ``json_values``, else they are ``KeyValue`` rows.
+        """
+        return self.json_values is not None
+
+    def refresh_from_db(self, *args, **kwargs):
+        """
+        Also discard any cached ``KeyValue`` objects.
+        """
+        super().refresh_from_db(*args, **kwargs)
+        self.__key_value_cache = None
+        self.__key_value_slugs = None
+        self.__decoded_cache.clear()
+
+    def _set_key_value_cache(self, key_values, slugs=None):
+        """
+        Populate the ``KeyValue`` cache on this instance. This is normally
+        done by ``CollectionBaseQuerySet.with_key_values``.
+
+        :param key_values: The ``KeyValue`` objects, with their
+                           ``DynamicColumn`` already loaded.
+        :type key_values: list
+        :param slugs: The slugs the ``key_values`` were limited to, if
+                      ``None`` the ``key_values`` are complete.
+        :type slugs: list or None
+        """
+        self.__key_value_cache = {}
+        self.__key_value_slugs = None if slugs is None else set(slugs)
+        self.__decoded_cache.clear()
+
+        for kv in key_values:
+            kv.collection = self
+            self.__key_value_cache[kv.dynamic_column.slug] = kv
+
+    def _load_key_values(self):
+        """
+        Load all the ``KeyValue`` objects of this instance into the cache
+        from its storage engine.
+        """
+        if self.pk is None:
+            key_values = []
+        else:
+            key_values = self.storage_engine.load([self])[self.pk]
+
+        self._set_key_value_cache(key_values)
+
+    def _get_key_values(self):
+        """
+        Get all the ``KeyValue`` objects of this instance from the cache,
+        loading them if they are missing or were only partially loaded.
+
+        :rtype: A dict of ``{<slug>: <KeyValue object>, ...}``.
+        """
+        if (self.__key_value_cache is None or
+            self.__key_value_slugs is not None):
+            self._load_key_values()
+
+        return self.__key_value_cache
+
+    def _update_key_value_cache(self, kv):
+        """
+        Keep a loaded ``KeyValue`` cache current after ``kv`` was saved.
+        This is called by ``KeyValue.save``.
+
+        :param kv: A ``KeyValue`` object belonging to this instance.
+        :type kv: ``KeyValue`` object
+        """
+        if self.__key_value_cache is not None:
+            slug = kv.dynamic_column.slug
+            self.__key_value_cache[slug] = kv
+
+            for key in [key for key in self.__decoded_cache
+                        if key[0] == slug]:
+                del self.__decoded_cache[key]
+
+    def _get_choice_pks(self):
+        """
+        Get the stored pks of the ``CHOICE`` values of this instance that
+        refer to Django models. Only loaded ``KeyValue`` objects are used.
+
+        :rtype: A list of ``[(<model class>, <pk>), ...]``.
+        """
+        result = []
+
+        for kv in (self.__key_value_cache or {}).values():
+            dc = kv.dynamic_column
+
+            if (dc.value_type == dc.CHOICE and not dc.store_relation and
+                (kv.value or '').isdigit()):
+                model, field = dc.get_choice_relation_object_and_field()
+
+                if model and issubclass(model, models.Model):
+                    result.append((model, kv.value))
+
+        return result
+
+    def _get_cached_key_value(self, slug):
+        """
+        Get the ``KeyValue`` object of ``slug`` from the cache. All the
+        ``KeyValue`` objects are loaded on first access.
+
+        :param slug: The ``DynamicColumn`` slug.
+        :type slug: str
+        :rtype: The ``KeyValue`` object or ``None`` if there is not one.
+        """
+        cache = self.__key_value_cache
+
+        if cache is None or (slug not in cache and
+                             self.__key_value_slugs is not None and
+                             slug not in self.__key_value_slugs):
+            self._load_key_values()
+
+        return self.__key_value_cache.get(slug)
+
     def serialize_key_values(self, by_slug=False):
         """
         Returns a dict of the ``DynamicColumn`` PK and the ``KeyValue``
@@ -553,30 +1243,38 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
         else:
             field = 'pk'
 
-        return {
-            getattr(kv.dynamic_column, field):
-            self.get_key_value(kv.dynamic_column.slug, choice_raw=True)
-            for kv in self.keyvalues.select_related('dynamic_column').all()
-            }
+        for slug, kv in self._get_key_values().items():
+            key = (slug, None, True)
+
+            if key not in self.__decoded_cache:
+                self.__decoded_cache[key] = self._decode_key_value(
+                    kv, choice_raw=True)
+
+            result[getattr(kv.dynamic_column, field)] = self.__decoded_cache[
+                key]
+
+        return result
 
     def get_dynamic_column(self, slug):
         """
-        Gets the ``DynamicColumn`` instance given the slug.
+        Gets the ``DynamicColumn`` instance given the slug. The
+        ``DynamicColumn`` objects of the collection are cached in process,
+        see ``dcolumn.dcolumns.schema``.
 
         :param slug: The ``DynamicColumn`` slug value.
         :type slug: str
-        :rtype: ``DynamicColumn`` model instance.
-        :raises DynamicColumn.DoesNotExist: If the `DynamicColumn` model
-                                            object was not found.
-        :raises KeyValue.DoesNotExist: If the `KeyValue` model object was not
-                                       found.
+        :rtype: ``DynamicColumn`` model instance or ``None`` if the slug is
+                not in the collection.
+        :raises DynamicColumn.MultipleObjectsReturned: If the slug is used
+                                                      more than once in
+                                                      the collection.
         """
-        try:
-            dc = self.column_collection.dynamic_column.get(slug=slug)
-        except DynamicColumn.DoesNotExist as e:
+        from .schema import get_dynamic_column_map
+
+        dc = get_dynamic_column_map(self.column_collection_id).get(slug)
+
+        if dc is None:
             log.error("DynamicColumn with slug '%s' does not exist.", slug)
-            # Cannot get a dynamic column if not in a collection.
-            dc = None
 
         return dc
 
@@ -602,36 +1300,59 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
         :raises AttributeError: If a bad field is passed in.
         :raises TypeError: If wrong type is passed in.
         """
-        try:
-            obj = self.keyvalues.select_related(
-                'dynamic_column').get(dynamic_column__slug=slug)
-        except self.keyvalues.model.DoesNotExist:
-            log.error("Could not find value for slug '%s'.", slug)
-            value = ''
+        key = (slug, field, choice_raw)
+
+        if key in self.__decoded_cache:
+            value = self.__decoded_cache[key]
         else:
-            dc = obj.dynamic_column
-
-            if dc.value_type == dc.CHOICE and obj.value:
-                value = self._is_get_choice(dc, obj.value, field, choice_raw)
-            elif dc.value_type == dc.TIME and obj.value:
-                value = self._is_get_time(dc, obj.value)
-            elif dc.value_type == dc.DATE and obj.value:
-                value = self._is_get_date(dc, obj.value)
-            elif dc.value_type == dc.DATETIME and obj.value:
-                value = self._is_get_datetime(dc, obj.value)
-            elif dc.value_type == dc.BOOLEAN and obj.value:
-                value = self._is_get_boolean(dc, obj.value)
-            elif dc.value_type == dc.NUMBER and obj.value:
-                value = self._is_get_number(dc, obj.value)
-            elif dc.value_type == dc.FLOAT and obj.value:
-                value = self._is_get_float(dc, obj.value)
-            elif dc.value_type in (dc.TEXT, dc.TEXT_BLOCK) and obj.value:
-                value = obj.value
-            else: # pragma: no cover
-                # This should never happen. An invalid value_type will
-                # raise a ValidationError when the DynamicColumn is
-                # created.
-                value = obj.value
+            obj = self._get_cached_key_value(slug)
+
+            if obj is None:
+                log.error("Could not find value for slug '%s'.", slug)
+                value = ''
+            else:
+                value = self._decode_key_value(obj, field, choice_raw)
+
+            self.__decoded_cache[key] = value
+
+        return value
+
+    def _decode_key_value(self, obj, field=None, choice_raw=False):
+        """
+        Convert the stored string of a ``KeyValue`` object to the type of
+        its ``DynamicColumn``.
+
+        :param obj: A ``KeyValue`` object with its ``DynamicColumn``.
+        :type obj: ``KeyValue`` object
+        :param field: See ``get_key_value``.
+        :type field: str or None
+        :param choice_raw: See ``get_key_value``.
+        :type choice_raw: bool
+        :rtype: The coerced value.
+        """
+        dc = obj.dynamic_column
+
+        if dc.value_type == dc.CHOICE and obj.value:
+            value = self._is_get_choice(dc, obj.value, field, choice_raw)
+        elif dc.value_type == dc.TIME and obj.value:
+            value = self._is_get_time(dc, obj.value)
+        elif dc.value_type == dc.DATE and obj.value:
+            value = self._is_get_date(dc, obj.value)
+        elif dc.value_type == dc.DATETIME and obj.value:
+            value = self._is_get_datetime(dc, obj.value)
+        elif dc.value_type == dc.BOOLEAN and obj.value:
+            value = self._is_get_boolean(dc, obj.value)
+        elif dc.value_type == dc.NUMBER and obj.value:
+            value = self._is_get_number(dc, obj.value)
+        elif dc.value_type == dc.FLOAT and obj.value:
+            value = self._is_get_float(dc, obj.value)
+        elif dc.value_type in (dc.TEXT, dc.TEXT_BLOCK) and obj.value:
+            value = obj.value
+        else: # pragma: no cover
+            # This should never happen. An invalid value_type will
+            # raise a ValidationError when the DynamicColumn is
+            # created.
+            value = obj.value
 
         return value
 
@@ -644,13 +1365,24 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
             if not field:
                 field = m_field
 
-            if model and field: # value should be a pk--str(pk)
+            if (model and field and value.isdigit() and
+                issubclass(model, models.Model)):
+                result = self._get_choice_resolver().get_value(
+                    model, value, field)
+            elif model and field: # value should be a pk--str(pk)
                 result = model.objects.get_value_by_pk(value, field)
             else: # pragma: no cover
                 self._raise_exception(dc, value, field=field)
 
         return result
 
+    def _get_choice_resolver(self):
+        if self._choice_resolver is None:
+            from .choices import ChoiceResolver
+            self._choice_resolver = ChoiceResolver([self])
+
+        return self._choice_resolver
+
     def _is_get_time(self, dc, value):
         dt = self._is_get_datetime(dc, value)
         return datetime.time(
@@ -663,13 +1395,13 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
 
     def _is_get_datetime(self, dc, value):
         try:
-            return parser.parse(value)
+            return parse_datetime(value)
         except ValueError:
             self._raise_exception(dc, value)
 
     def _is_get_boolean(self, dc, value):
         if value.isdigit():
-            result = 0 if int(value) == 0 else 1
+            result = int(value) != 0
         elif value.lower() in self.TRUE_FALSE:
             result = value.lower() in (self.TRUE, 'true')
         elif value.lower() in self.YES_NO:
@@ -680,7 +1412,8 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
         return result
 
     def _is_get_number(self, dc, value):
-        if value.isdigit():
+        # Counters can be decremented below zero.
+        if value.isdigit() or (value[:1] == '-' and value[1:].isdigit()):
             result = int(value)
         else:
             self._raise_exception(dc, value)
@@ -688,17 +1421,29 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
         return result
 
     def _is_get_float(self, dc, value):
-        if value.replace('.', '').isdigit():
+        try:
             result = float(value)
-        else:
+        except ValueError:
+            result = None
+
+        # Signs and exponents are valid, infinity and NaN are not.
+        if result is None or not math.isfinite(result):
             self._raise_exception(dc, value)
 
         return result
 
     def save_deferred(self):
-        for obj in self.__save_deferred:
-            obj.collection = self
-            obj.save()
+        """
+        Save the ``KeyValue`` objects deferred by ``set_key_value`` or
+        ``set_key_values`` in one transaction. If a slug was deferred more
+        than once the last value is saved.
+
+        :raises ValidationError: If any ``KeyValue`` object is invalid,
+                                 nothing is saved.
+        """
+        objs = {obj.dynamic_column_id: obj for obj in self.__save_deferred}
+        self._bulk_save_key_values(list(objs.values()))
+        self.__save_deferred = []
 
     def set_key_value(self, slug, value, field=None, obj=None, force=False,
                       defer=False):
@@ -708,7 +1453,9 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
 
         If the argument ``value`` contains the value 'increment' or
         'decrement' the value associated with the slug will be
-        incremented or decremented.
+        incremented or decremented atomically in the database, see
+        ``add``. A deferred increment or decrement is done on the cached
+        value when it is prepared.
 
         :param slug: The slug associated with a ``KeyValue`` object.
         :type slug: str
@@ -738,48 +1485,17 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
             dc = self.get_dynamic_column(slug)
 
             if dc:
-                if dc.value_type == dc.CHOICE:
-                    value = self._is_set_choice(dc, value, field)
-                elif dc.value_type in (dc.TIME, dc.DATE, dc.DATETIME):
-                    value = self._is_set_datetime(dc, value)
-                elif (dc.value_type == dc.NUMBER and
-                      value in ('increment', 'decrement')):
-                    pass
-                elif dc.value_type == dc.BOOLEAN:
-                    value = self._is_set_boolean(dc, value)
-                elif dc.value_type == dc.FLOAT:
-                    value = self._is_set_float(dc, value)
-                elif dc.value_type == dc.NUMBER:
-                    value = self._is_set_number(dc, value)
-                elif (dc.value_type in (dc.TEXT, dc.TEXT_BLOCK) and
-                      isinstance(value, str)):
-                    pass
-                else: # pragma: no cover
-                    # This should never happen. An invalid value_type
-                    # will raise a ValidationError when the DynamicColumn
-                    # is created.
-                    self._raise_exception(dc, value)
-
-                created = False
-
-                if not obj:
-                    try:
-                        obj = self.keyvalues.get(collection=self,
-                                                 dynamic_column=dc)
-                    except (ValueError, KeyValue.DoesNotExist):
-                        obj = KeyValue(collection=self, dynamic_column=dc)
-                    else:
-                        if 'increment' == value and obj.value.isdigit():
-                            value = str(int(obj.value) + 1)
-                        elif 'decrement' == value and obj.value.isdigit():
-                            value = str(int(obj.value) - 1)
+                value = self._convert_value(dc, value, field=field)
 
-                obj.value = value
-
-                if defer:
-                    self.__save_deferred.append(obj)
+                if not defer and value in self.COUNTER_STEPS:
+                    self._add(dc, self.COUNTER_STEPS[value])
                 else:
-                    obj.save()
+                    obj = self._prepare_key_value(dc, value, obj=obj)
+
+                    if defer:
+                        self.__save_deferred.append(obj)
+                    else:
+                        self._bulk_save_key_values([obj])
             else:
                 msg = "Could not find DynamicColumn for slug '{}'.".format(
                     slug)
@@ -792,6 +1508,252 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
             log.error(msg)
             raise ValueError(msg)
 
+    def set_key_values(self, mapping, force=False, defer=False):
+        """
+        This method sets many key/value objects at once. All values are
+        validated first, the ``DynamicColumn`` objects come from the schema
+        cache and the existing ``KeyValue`` objects are found with one
+        query, then new objects are written with one upsert and existing
+        objects with one ``bulk_update`` inside a transaction.
+
+        :param mapping: A dict of ``{<slug>: <value>, ...}`` where the
+                        values are as in ``set_key_value``. ``CHOICE``
+                        values always use the default field.
+        :type mapping: dict
+        :param force: Default is ``False``, do not save empty strings else
+                      ``True`` save empty strings only.
+        :type force: bool
+        :param defer: Defer saving the KeyValue records. ``False`` is
+                      default.
+        :type defer: bool
+        :raises ValueError: Invalid combination of parameters, an unknown
+                            slug or an invalid value. Nothing is written
+                            when raised.
+        """
+        invalid = [slug for slug, value in mapping.items()
+                   if not ((force and value == '') or
+                           value not in (None, ''))]
+
+        if invalid:
+            msg = ("Could not process the data as passed to {}, "
+                   "slugs: {}, force: {}").format(
+                self.set_key_values.__name__, invalid, force)
+            log.error(msg)
+            raise ValueError(msg)
+
+        from .schema import get_dynamic_column_map
+
+        dcs = get_dynamic_column_map(self.column_collection_id)
+        missing = [slug for slug in mapping if slug not in dcs]
+
+        if missing:
+            msg = "Could not find DynamicColumn for slugs {}.".format(missing)
+            log.error(msg)
+            raise ValueError(msg)
+
+        # Convert everything before any KeyValue object is touched.
+        values = {slug: self._convert_value(dcs[slug], value)
+                  for slug, value in mapping.items()}
+        counters = {}
+
+        if not defer:
+            counters = {slug: self.COUNTER_STEPS[value]
+                        for slug, value in values.items()
+                        if value in self.COUNTER_STEPS}
+
+        self._get_key_values()
+        objs = [self._prepare_key_value(dcs[slug], value)
+                for slug, value in values.items() if slug not in counters]
+
+        if defer:
+            self.__save_deferred.extend(objs)
+        else:
+            self._bulk_save_key_values(objs)
+
+            for slug, n in counters.items():
+                self._add(dcs[slug], n)
+
+    def _bulk_save_key_values(self, objs):
+        """
+        Write the ``KeyValue`` objects with the storage engine of this
+        instance and update the cache. The objects are validated together
+        before anything is written, this replaces the ``full_clean`` each
+        ``KeyValue.save`` would do.
+
+        :param objs: ``KeyValue`` objects of this instance.
+        :type objs: list
+        :raises ValidationError: If any object is invalid.
+        """
+        errors = {}
+
+        for obj in objs:
+            obj.collection = self
+            obj.populate_typed_values()
+
+            try:
+                obj.clean_fields(exclude=('collection', 'dynamic_column'))
+            except ValidationError as e:
+                errors[obj.dynamic_column.slug] = e.messages
+
+        if errors:
+            log.error("Invalid KeyValue objects: %s", errors)
+            raise ValidationError(errors)
+
+        if objs:
+            from .storage import save_object
+            save_object(self, objs)
+
+            for obj in objs:
+                self._update_key_value_cache(obj)
+
+            key_values_saved.send(sender=KeyValue, key_values=objs)
+
+    def _convert_value(self, dc, value, field=None):
+        """
+        Validate and convert ``value`` to the string stored for ``dc``.
+
+        :param dc: The ``DynamicColumn`` object.
+        :type dc: ``DynamicColumn`` object
+        :param value: See ``set_key_value``.
+        :type value: string or CollectionBase object
+        :param field: See ``set_key_value``.
+        :type field: str or None
+        :rtype: str
+        :raises ValueError: If the value is invalid for the ``dc`` type.
+        """
+        if dc.value_type == dc.CHOICE:
+            value = self._is_set_choice(dc, value, field)
+        elif dc.value_type in (dc.TIME, dc.DATE, dc.DATETIME):
+            value = self._is_set_datetime(dc, value)
+        elif (dc.value_type == dc.NUMBER and
+              value in ('increment', 'decrement')):
+            pass
+        elif dc.value_type == dc.BOOLEAN:
+            value = self._is_set_boolean(dc, value)
+        elif dc.value_type == dc.FLOAT:
+            value = self._is_set_float(dc, value)
+        elif dc.value_type == dc.NUMBER:
+            value = self._is_set_number(dc, value)
+        elif (dc.value_type in (dc.TEXT, dc.TEXT_BLOCK) and
+              isinstance(value, str)):
+            pass
+        else: # pragma: no cover
+            # This should never happen. An invalid value_type
+            # will raise a ValidationError when the DynamicColumn
+            # is created.
+            self._raise_exception(dc, value)
+
+        return value
+
+    def _prepare_key_value(self, dc, value, obj=None):
+        """
+        Set an already converted ``value`` on the ``KeyValue`` object,
+        which is found or created if not passed in. The object is not
+        saved.
+
+        :param dc: The ``DynamicColumn`` object.
+        :type dc: ``DynamicColumn`` object
+        :param value: The value from ``_convert_value``.
+        :type value: str
+        :param obj: A ``KeyValue`` object.
+        :type obj: ``KeyValue`` object
+        :rtype: The ``KeyValue`` object.
+        """
+        if not obj:
+            obj = self._get_cached_key_value(dc.slug)
+
+            if obj is None:
+                obj = KeyValue(collection=self, dynamic_column=dc)
+
+        if value in self.COUNTER_STEPS:
+            # A missing or non-numeric value counts as zero.
+            try:
+                count = int(obj.value)
+            except (TypeError, ValueError):
+                count = 0
+
+            value = str(count + self.COUNTER_STEPS[value])
+
+        obj.value = value
+        return obj
+
+    def add(self, slug, n=1):
+        """
+        Atomically add ``n`` to the value of a ``NUMBER`` slug in the
+        database, so concurrent updates are not lost. A missing value
+        counts as zero.
+
+        :param slug: The slug of a ``NUMBER`` ``DynamicColumn``.
+        :type slug: str
+        :param n: The amount to add, may be negative. The default is 1.
+        :type n: int
+        :rtype: The new value as an int, or ``None`` if the slug is in the
+                counter buffer, see ``get_counter``.
+        :raises ValueError: If the slug is not a ``NUMBER`` column or ``n``
+                            is not an int.
+        """
+        dc = self.get_dynamic_column(slug)
+
+        if not dc or dc.value_type != dc.NUMBER:
+            msg = ("Could not find a NUMBER DynamicColumn for slug "
+                   "'{}'.").format(slug)
+            log.error(msg)
+            raise ValueError(msg)
+
+        if not isinstance(n, int) or isinstance(n, bool):
+            msg = "Invalid amount '{}' for slug '{}'.".format(n, slug)
+            log.error(msg)
+            raise ValueError(msg)
+
+        return self._add(dc, n)
+
+    def _add(self, dc, n):
+        from .counters import get_counter_buffer
+
+        buffer = get_counter_buffer(dc.slug)
+
+        if buffer:
+            buffer.add(self.pk, dc.pk, n)
+            result = None
+        else:
+            from .storage import add_value
+            obj = add_value(self, dc, n)
+            self._update_key_value_cache(obj)
+            key_values_saved.send(sender=KeyValue, key_values=[obj])
+            result = obj.value_int
+
+        return result
+
+    def get_counter(self, slug):
+        """
+        Get the value of a ``NUMBER`` slug with any amount still pending in
+        the counter buffer, see ``dcolumn.dcolumns.counters``.
+
+        :param slug: The slug of a ``NUMBER`` ``DynamicColumn``.
+        :type slug: str
+        :rtype: int
+        :raises ValueError: If the slug is not a ``NUMBER`` column.
+        """
+        from .counters import get_counter_buffer
+
+        dc = self.get_dynamic_column(slug)
+
+        if not dc or dc.value_type != dc.NUMBER:
+            msg = ("Could not find a NUMBER DynamicColumn for slug "
+                   "'{}'.").format(slug)
+            log.error(msg)
+            raise ValueError(msg)
+
+        # The cached value may be older than the last flush.
+        self.refresh_from_db(fields=['json_values'])
+        value = self.get_key_value(slug) or 0
+        buffer = get_counter_buffer(slug)
+
+        if buffer:
+            value += buffer.pending(self.pk, dc.pk)
+
+        return value
+
     def _is_set_choice(self, dc, value, field):
         model, m_field = dc.get_choice_relation_object_and_field()
 
@@ -816,32 +1778,21 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
 
     def _is_set_datetime(self, dc, value):
         if isinstance(value, (datetime.time, datetime.date,
-                              datetime.datetime)):
-            result = value.isoformat()
-        elif isinstance(value, str):
+                              datetime.datetime, str)):
             try:
-                dt = parser.parse(value)
+                result = KeyValue.canonical_value(dc, value)
             except ValueError as e:
                 self._raise_exception(dc, value, except_msg=e)
-            else:
-                result = value
         else:
             self._raise_exception(dc, value)
 
         return result
 
     def _is_set_boolean(self, dc, value):
-        if isinstance(value, bool):
-            result = str(value)
-        elif isinstance(value, int):
-            result = str(0 if value == 0 else 1)
-        elif isinstance(value, str):
-            if (value.lower() in self.TRUE_FALSE or
-                value.lower() in self.YES_NO):
-                result = value
-            elif value.isdigit():
-                result = str(0 if int(value) == 0 else 1)
-            else:
+        if isinstance(value, (bool, int, str)):
+            try:
+                result = KeyValue.canonical_value(dc, value)
+            except ValueError:
                 self._raise_exception(dc, value)
         else:
             self._raise_exception(dc, value)
@@ -849,12 +1800,16 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
         return result
 
     def _is_set_float(self, dc, value):
-        if isinstance(value, float):
-            result = str(value)
-        elif isinstance(value, int):
-            result = str(float(value))
-        elif isinstance(value, str) and value.replace('.', '').isdigit():
-            result = str(float(value))
+        number = math.nan
+
+        if isinstance(value, (float, int, str)):
+            try:
+                number = float(value)
+            except (ValueError, OverflowError):
+                pass
+
+        if math.isfinite(number):
+            result = KeyValue.float_string(number)
         else:
             self._raise_exception(dc, value)
 
@@ -863,8 +1818,9 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
     def _is_set_number(self, dc, value):
         if isinstance(value, int):
             result = str(value)
-        elif isinstance(value, str) and value.isdigit():
-            result = value
+        elif isinstance(value, str) and (
+            value.isdigit() or (value[:1] == '-' and value[1:].isdigit())):
+            result = str(int(value))
         else:
             self._raise_exception(dc, value)
 
@@ -883,10 +1839,98 @@ class CollectionBase(TimeModelMixin, UserModelMixin, StatusModelMixin):
 # KeyValue
 #
 class KeyValueManager(models.Manager):
-    pass
+    """
+    Manager for the ``KeyValue`` model.
+    """
+
+    def backfill_typed_values(self, chunk_size=1000):
+        """
+        Set the typed shadow fields on all existing ``KeyValue`` objects.
+        The objects are read in primary key order and written with one
+        ``bulk_update`` per chunk, so large tables are not loaded at once.
+
+        :param chunk_size: The number of objects per chunk.
+        :type chunk_size: int
+        :rtype: The number of ``KeyValue`` objects processed.
+        """
+        queryset = self.select_related('dynamic_column').order_by('pk')
+        last_pk = 0
+        count = 0
+
+        while True:
+            objs = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+
+            if not objs:
+                break
+
+            for obj in objs:
+                obj.populate_typed_values()
+
+            self.bulk_update(objs, self.model.TYPED_FIELDS)
+            last_pk = objs[-1].pk
+            count += len(objs)
+            log.info("Backfilled typed values on %s KeyValue objects.", count)
+
+        return count
+
+    def normalize_values(self, chunk_size=1000):
+        """
+        Rewrite the stored values of all existing ``KeyValue`` objects in
+        the canonical encoding of ``KeyValue.canonical_value``. The
+        objects are read in primary key order and locked one chunk at a
+        time, only changed objects are written with one ``bulk_update``
+        per chunk. Values that cannot be converted are logged and left as
+        they are.
+
+        :param chunk_size: The number of objects per chunk.
+        :type chunk_size: int
+        :rtype: The number of ``KeyValue`` objects changed.
+        """
+        dcs = DynamicColumn.objects.in_bulk()
+        queryset = self.order_by('pk')
+        last_pk = 0
+        count = 0
+
+        while True:
+            with transaction.atomic(using=self.db):
+                objs = list(queryset.select_for_update().filter(
+                    pk__gt=last_pk)[:chunk_size])
+                changed = []
+
+                for obj in objs:
+                    obj.dynamic_column = dcs[obj.dynamic_column_id]
+
+                    try:
+                        value = self.model.canonical_value(
+                            obj.dynamic_column, obj.value)
+                    except (ValueError, OverflowError) as e:
+                        log.warning("Could not normalize KeyValue %s, %s",
+                                    obj.pk, e)
+                    else:
+                        if value != obj.value:
+                            obj.value = value
+                            obj.populate_typed_values()
+                            changed.append(obj)
+
+                self.bulk_update(changed, self.model.VALUE_FIELDS)
+
+            if not objs:
+                break
+
+            last_pk = objs[-1].pk
+            count += len(changed)
+            log.info("Normalized %s KeyValue objects.", count)
+
+        return count
 
 
 class KeyValue(ValidateOnSaveMixin):
+    TYPED_FIELDS = ('value_int', 'value_float', 'value_datetime',
+                    'value_bool',)
+    VALUE_FIELDS = ('value',) + TYPED_FIELDS
+    # TIME values are stored on this date so they can be compared.
+    TIME_DATE = datetime.datetime(1970, 1, 1)
+
     collection = models.ForeignKey(
         CollectionBase, on_delete=models.CASCADE,
         verbose_name=_("Collection Type"), related_name='keyvalues')
@@ -894,6 +1938,17 @@ class KeyValue(ValidateOnSaveMixin):
         DynamicColumn, on_delete=models.CASCADE,
         verbose_name=_("Dynamic Column"), related_name='keyvalues')
     value = models.TextField(verbose_name=_("Value"), null=True, blank=True)
+    value_int = models.BigIntegerField(
+        verbose_name=_("Integer Value"), null=True, blank=True,
+        editable=False)
+    value_float = models.FloatField(
+        verbose_name=_("Float Value"), null=True, blank=True, editable=False)
+    value_datetime = models.DateTimeField(
+        verbose_name=_("Date Time Value"), null=True, blank=True,
+        editable=False)
+    value_bool = models.BooleanField(
+        verbose_name=_("Boolean Value"), null=True, blank=True,
+        editable=False)
 
     objects = KeyValueManager()
 
@@ -904,8 +1959,14 @@ class KeyValue(ValidateOnSaveMixin):
         log.debug("KeyValue pk: %s,  collection: %s, dynamic_column: %s, "
                   "value: %s, args: %s, kwargs: %s", self.pk, self.collection,
                   self.dynamic_column, self.value, args, kwargs)
+        self.populate_typed_values()
         super().save(*args, **kwargs)
 
+        if KeyValue.collection.is_cached(self):
+            self.collection._update_key_value_cache(self)
+
+        key_values_saved.send(sender=KeyValue, key_values=[self])
+
     def __str__(self):
         return self.dynamic_column.name
 
@@ -913,3 +1974,237 @@ class KeyValue(ValidateOnSaveMixin):
         ordering = ('dynamic_column__location', 'dynamic_column__order',)
         verbose_name = _("Key Value")
         verbose_name_plural = _("Key Values")
+        constraints = [
+            models.UniqueConstraint(fields=['collection', 'dynamic_column'],
+                                    name='dcolumns_kv_collection_dc_uniq'),
+            ]
+        indexes = [
+            models.Index(fields=['dynamic_column', 'value_int'],
+                         name='dcolumns_kv_int_idx'),
+            models.Index(fields=['dynamic_column', 'value_float'],
+                         name='dcolumns_kv_float_idx'),
+            models.Index(fields=['dynamic_column', 'value_datetime'],
+                         name='dcolumns_kv_datetime_idx'),
+            models.Index(fields=['dynamic_column', 'value_bool'],
+                         name='dcolumns_kv_bool_idx'),
+            ]
+
+    def populate_typed_values(self):
+        """
+        Set the typed shadow fields from the ``value`` string, so that
+        ``NUMBER``, ``FLOAT``, ``DATE``, ``DATETIME``, ``TIME``,
+        ``BOOLEAN`` and ``CHOICE`` (stored as a pk) values can be filtered
+        and ordered with an index. A value that cannot be converted leaves
+        all the typed fields ``None``.
+        """
+        for name in self.TYPED_FIELDS:
+            setattr(self, name, None)
+
+        value = self.value
+
+        if value and self.dynamic_column_id is not None:
+            field = self.get_typed_field(self.dynamic_column)
+
+            if field != 'value':
+                try:
+                    setattr(self, field, self.to_typed_value(field, value))
+                except (ValueError, OverflowError) as e:
+                    log.warning("Could not set typed value for KeyValue "
+                                "pk: %s, value: %s, %s", self.pk, value, e)
+
+    @classmethod
+    def get_typed_field(cls, dc):
+        """
+        Get the name of the field that holds the values of ``dc``.
+
+        :param dc: The ``DynamicColumn`` object.
+        :type dc: ``DynamicColumn`` object
+        :rtype: One of ``TYPED_FIELDS`` or ``'value'`` for text types.
+        """
+        if dc.value_type == dc.NUMBER or (
+            dc.value_type == dc.CHOICE and not dc.store_relation):
+            field = 'value_int'
+        elif dc.value_type == dc.FLOAT:
+            field = 'value_float'
+        elif dc.value_type in (dc.DATE, dc.DATETIME, dc.TIME):
+            field = 'value_datetime'
+        elif dc.value_type == dc.BOOLEAN:
+            field = 'value_bool'
+        else:
+            field = 'value'
+
+        return field
+
+    @classmethod
+    def to_typed_value(cls, field, value):
+        """
+        Convert a stored string or a Python value to the type of ``field``.
+
+        :param field: A name from ``get_typed_field``.
+        :type field: str
+        :param value: The value to convert.
+        :type value: str, int, float, bool, date, time, datetime or a
+                     ``CollectionBase`` or ``BaseChoice`` object.
+        :rtype: The converted value.
+        :raises ValueError: If the value cannot be converted.
+        :raises OverflowError: If an integer does not fit the field.
+        """
+        if field == 'value_int':
+            result = cls._typed_int(value)
+        elif field == 'value_float':
+            result = float(value)
+        elif field == 'value_datetime':
+            result = cls._typed_datetime(value)
+        elif field == 'value_bool':
+            result = cls._typed_bool(value)
+        else:
+            result = value
+
+        return result
+
+    @classmethod
+    def canonical_value(cls, dc, value):
+        """
+        Encode a value the way it is stored for ``dc``. Dates and times are
+        ISO 8601, booleans are '0' or '1', floats are
+        ``float_string`` and numbers are the ``str`` of the Python value.
+        Other types are returned unchanged.
+
+        :param dc: The ``DynamicColumn`` object.
+        :type dc: ``DynamicColumn`` object
+        :param value: A stored string or a Python value.
+        :type value: str, int, float, bool, date, time or datetime
+        :rtype: str
+        :raises ValueError: If the value cannot be converted.
+        """
+        if dc.value_type in (dc.DATE, dc.DATETIME, dc.TIME):
+            result = cls._canonical_datetime(dc, value)
+        elif dc.value_type == dc.BOOLEAN:
+            result = '1' if cls._typed_bool(value) else '0'
+        elif dc.value_type == dc.FLOAT:
+            result = cls.float_string(value)
+        elif dc.value_type == dc.NUMBER:
+            result = str(int(value))
+        else:
+            result = value
+
+        return result
+
+    @staticmethod
+    def float_string(value):
+        """
+        Encode a float as the shortest string that reads back as the same
+        float, without an exponent, ex. '0.00001' not '1e-05'.
+
+        :param value: A float or a value ``float`` accepts.
+        :type value: str, int or float
+        :rtype: str
+        :raises ValueError: If the value is not a finite float.
+        """
+        value = float(value)
+
+        if not math.isfinite(value):
+            raise ValueError("{} is not a finite float.".format(value))
+
+        result = format(Decimal(repr(value)), 'f')
+
+        if '.' not in result:
+            result += '.0'
+
+        return result
+
+    @staticmethod
+    def _canonical_datetime(dc, value):
+        if isinstance(value, str):
+            value = parse_datetime(value)
+
+        if isinstance(value, datetime.datetime):
+            dt = value
+        elif isinstance(value, datetime.date):
+            dt = datetime.datetime.combine(value, datetime.time())
+        elif isinstance(value, datetime.time):
+            dt = datetime.datetime.combine(datetime.date.today(), value)
+        else:
+            raise ValueError("{} is not a date or time.".format(value))
+
+        if dc.value_type == dc.DATE:
+            result = dt.date().isoformat()
+        elif dc.value_type == dc.TIME:
+            result = dt.timetz().isoformat()
+        else:
+            result = dt.isoformat()
+
+        return result
+
+    @staticmethod
+    def _typed_int(value):
+        if isinstance(value, (CollectionBase, BaseChoice)):
+            value = value.pk
+
+        result = int(value)
+
+        # Must fit in a BigIntegerField.
+        if not -2**63 <= result < 2**63:
+            raise OverflowError("{} is out of range.".format(value))
+
+        return result
+
+    @classmethod
+    def _typed_datetime(cls, value):
+        if isinstance(value, datetime.datetime):
+            result = value
+        elif isinstance(value, datetime.date):
+            result = datetime.datetime.combine(value, datetime.time())
+        elif isinstance(value, datetime.time):
+            result = datetime.datetime.combine(cls.TIME_DATE.date(), value)
+        else:
+            result = parse_datetime(value, default=cls.TIME_DATE)
+
+        if settings.USE_TZ and timezone.is_naive(result):
+            result = timezone.make_aware(result, datetime.timezone.utc)
+        elif not settings.USE_TZ and timezone.is_aware(result):
+            result = timezone.make_naive(result, datetime.timezone.utc)
+
+        return result
+
+    @staticmethod
+    def _typed_bool(value):
+        if isinstance(value, bool):
+            result = value
+        else:
+            value = str(value).lower()
+
+            if value.isdigit():
+                result = int(value) != 0
+            elif value in CollectionBase.TRUE_FALSE:
+                result = value in (CollectionBase.TRUE, 'true')
+            elif value in CollectionBase.YES_NO:
+                result = value in (CollectionBase.YES, 'yes')
+            else:
+                raise ValueError("{} is not a boolean.".format(value))
+
+        return result
+
+
+class ImportProgress(models.Model):
+    """
+    The resume point of an import by ``dcolumn.dcolumns.imports``. It is
+    written in the transaction of each batch, so it always matches the
+    committed rows.
+    """
+    key = models.CharField(
+        verbose_name=_("Key"), unique=True, max_length=64,
+        help_text=_("A hash of the model label and the absolute path."))
+    path = models.TextField(
+        verbose_name=_("Path"), help_text=_("The path of the file."))
+    rows = models.PositiveIntegerField(
+        verbose_name=_("Rows"), default=0,
+        help_text=_("The number of rows of the file done."))
+    updated = models.DateTimeField(verbose_name=_("Updated"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Import Progress")
+        verbose_name_plural = _("Import Progress")
+
+    def __str__(self):
+        return "{} ({} rows)".format(self.path, self.rows)
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/pivot.py
+#
+
+"""
+Optional denormalized pivot tables of the ``KeyValue`` objects of a
+``ColumnCollection``. Enable them for related models in the settings::
+
+  DYNAMIC_COLUMNS = {
+      'PIVOT_TABLES': ['book'],
+      }
+
+Then run ``manage.py dcolumn_rebuild_pivot`` once to create and fill the
+tables.
+"""
+__docformat__ = "restructuredtext en"
+
+import logging
+
+from django.apps.registry import Apps
+from django.db import (
+    models, transaction, connections, router, IntegrityError)
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .manager import dcolumn_manager
+from .models import DynamicColumn, ColumnCollection, CollectionBase, KeyValue
+from .schema import get_schema_version, bump_schema_version
+from .signals import key_values_saved, collections_created
+from .storage import get_object_engine
+
+log = logging.getLogger('dcolumns.dcolumns.pivot')
+
+
+class PivotTable:
+    """
+    A table named ``dcolumns_pivot_<related model>`` with a
+    ``collection_id`` primary key and one nullable, typed column named by
+    the slug of each active ``DynamicColumn`` in the collection. There is
+    one row per object that inherits ``CollectionBase``, so reads, filters
+    and sorts are single table queries on ``model``.
+
+    The table is kept current on every ``KeyValue`` write and its columns
+    are added or dropped with ``ALTER TABLE`` after the collection's
+    dynamic columns change. The model is built from the columns of the
+    table and is built again when the schema version changes, so every
+    process sees the new columns.
+    """
+    FIELD_CLASSES = {
+        'value_int': models.BigIntegerField,
+        'value_float': models.FloatField,
+        'value_datetime': models.DateTimeField,
+        'value_bool': models.BooleanField,
+        'value': models.TextField,
+        }
+
+    def __init__(self, name):
+        """
+        Constructor
+
+        :param name: The ``ColumnCollection.related_model`` name.
+        :type name: str
+        """
+        self.name = name.lower()
+        self.table_name = 'dcolumns_pivot_{}'.format(self.name)
+        self._version = None
+        self.reset()
+
+    def reset(self):
+        """
+        Discard the model and table state so they are found again.
+        """
+        self._model = None
+        self._fields = {}
+        self._exists = None
+
+    def _check_version(self):
+        version = get_schema_version()
+
+        if version != self._version:
+            self.reset()
+            self._version = version
+
+    @property
+    def connection(self):
+        return connections[router.db_for_write(KeyValue)]
+
+    @property
+    def model(self):
+        """
+        The unmanaged model of the table, built from the columns of the
+        table or, if it does not exist yet, from the current
+        ``DynamicColumn`` objects of the collection.
+
+        :rtype: A Django model class.
+        """
+        self._check_version()
+
+        if self._model is None:
+            if self.exists():
+                self._fields = self._get_table_fields()
+            else:
+                self._fields = self._get_fields()
+
+            self._model = self._build_model(self._fields)
+
+        return self._model
+
+    def _get_fields(self):
+        """
+        :rtype: A dict of ``{<slug>: <KeyValue typed field>, ...}`` of the
+                active ``DynamicColumn`` objects of the collection.
+        """
+        dcs = DynamicColumn.objects.active().filter(
+            column_collection__active=True,
+            column_collection__related_model__iexact=self.name)
+        return {dc.slug: KeyValue.get_typed_field(dc) for dc in dcs}
+
+    def _get_table_fields(self):
+        """
+        :rtype: A dict of ``{<column>: <KeyValue typed field>, ...}`` of
+                the columns in the table, a column of an unknown type maps
+                to ``None``.
+        """
+        introspection = self.connection.introspection
+        names = {cls.__name__: field
+                 for field, cls in self.FIELD_CLASSES.items()}
+
+        with self.connection.cursor() as cursor:
+            description = introspection.get_table_description(
+                cursor, self.table_name)
+
+        return {column.name: names.get(introspection.get_field_type(
+            column.type_code, column)) for column in description
+                if column.name != 'collection_id'}
+
+    def _build_model(self, fields):
+        # An isolated registry keeps rebuilt models out of the app registry.
+        meta = type('Meta', (), {'apps': Apps(), 'app_label': 'dcolumns',
+                                 'db_table': self.table_name,
+                                 'managed': False})
+        attrs = {'__module__': __name__, 'Meta': meta,
+                 'collection_id': models.BigIntegerField(primary_key=True)}
+
+        for slug, field in fields.items():
+            # A column of an unknown type is only built to be dropped.
+            field = field or 'value'
+            attrs[slug] = self.FIELD_CLASSES[field](
+                null=True, db_index=field != 'value')
+
+        return type('Pivot{}'.format(self.name.title()), (models.Model,),
+                    attrs)
+
+    def exists(self):
+        """
+        Check if the table has been created.
+
+        :rtype: ``True`` or ``False``.
+        """
+        self._check_version()
+
+        if self._exists is None:
+            with self.connection.cursor() as cursor:
+                self._exists = (self.table_name in
+                                self.connection.introspection.table_names(
+                                    cursor))
+
+        return self._exists
+
+    def rebuild(self, chunk_size=1000):
+        """
+        Drop and create the table with the current ``DynamicColumn``
+        objects, then fill it from the storage engine of each object in
+        chunks of ``chunk_size`` objects. This cannot run inside a
+        transaction on SQLite.
+
+        :param chunk_size: The number of objects per chunk.
+        :type chunk_size: int
+        :rtype: The number of rows written.
+        """
+        exists = self.exists()
+        old_model = self.model
+        fields = self._get_fields()
+        model = self._build_model(fields)
+
+        with self.connection.schema_editor() as editor:
+            if exists:
+                editor.delete_model(old_model)
+
+            editor.create_model(model)
+
+        count = self._fill(model, fields, chunk_size=chunk_size)
+        bump_schema_version()
+        log.info("Rebuilt pivot table %s with %s rows.", self.table_name,
+                 count)
+        return count
+
+    def sync(self, chunk_size=1000):
+        """
+        Add and drop the columns of the table with ``ALTER TABLE`` to
+        match the current ``DynamicColumn`` objects, a column whose type
+        changed is dropped and added again. Added columns are only filled
+        if there are stored values for them, a missing table is created
+        with ``rebuild``. This cannot run inside a transaction on SQLite.
+
+        :param chunk_size: The number of objects per chunk of the fill.
+        :type chunk_size: int
+        :rtype: A list of the slugs of the added columns.
+        """
+        if not self.exists():
+            self.rebuild(chunk_size=chunk_size)
+            result = list(self._get_fields())
+        else:
+            fields = self._get_fields()
+            current = self._get_table_fields()
+            result = [slug for slug, field in fields.items()
+                      if current.get(slug) != field]
+            removed = [slug for slug, field in current.items()
+                       if fields.get(slug) != field]
+
+            if result or removed:
+                # Each change is made on a model of the table as it is, the
+                # SQLite backend copies the table for some of them.
+                with self.connection.schema_editor() as editor:
+                    for slug in removed:
+                        model = self._build_model(current)
+                        editor.remove_field(model, model._meta.get_field(
+                            slug))
+                        del current[slug]
+
+                    for slug in result:
+                        current[slug] = fields[slug]
+                        model = self._build_model(current)
+                        editor.add_field(model, model._meta.get_field(slug))
+
+                added = {slug: fields[slug] for slug in result}
+
+                if self._has_values(result):
+                    self._fill(self._build_model(current), added,
+                               chunk_size=chunk_size, update=True)
+
+                bump_schema_version()
+                log.info("Altered pivot table %s, added %s, dropped %s.",
+                         self.table_name, result, removed)
+
+        return result
+
+    def _has_values(self, slugs):
+        """
+        Check if any object has a stored value for ``slugs``, with
+        ``KeyValue`` rows or in ``json_values``.
+        """
+        result = False
+
+        if slugs:
+            dc_pks = list(DynamicColumn.objects.filter(
+                slug__in=slugs,
+                column_collection__related_model__iexact=self.name
+                ).values_list('pk', flat=True))
+            result = (
+                KeyValue.objects.filter(dynamic_column__in=dc_pks).exists()
+                or CollectionBase.objects.filter(
+                    json_values__has_any_keys=[str(pk) for pk in dc_pks]
+                    ).exists())
+
+        return result
+
+    def _fill(self, model, fields, chunk_size=1000, update=False):
+        """
+        Write the values of ``fields`` of all the objects of the
+        collection in chunks of ``chunk_size`` objects. New rows are
+        inserted, or if ``update`` is ``True`` the rows with a value are
+        updated.
+
+        :rtype: The number of objects read.
+        """
+        queryset = CollectionBase.objects.filter(
+            column_collection__related_model__iexact=self.name).order_by(
+            'pk').only('pk', 'json_values')
+        slugs = list(fields) if update else None
+        last_pk = 0
+        count = 0
+
+        while True:
+            objs = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+
+            if not objs:
+                break
+
+            rows = {obj.pk: model(pk=obj.pk) for obj in objs}
+            changed = {}
+            engines = {}
+
+            for obj in objs:
+                engines.setdefault(get_object_engine(obj), []).append(obj)
+
+            for engine, engine_objs in engines.items():
+                for pk, key_values in engine.load(engine_objs,
+                                                  slugs=slugs).items():
+                    for kv in key_values:
+                        field = fields.get(kv.dynamic_column.slug)
+
+                        if field:
+                            kv.populate_typed_values()
+                            setattr(rows[pk], kv.dynamic_column.slug,
+                                    getattr(kv, field))
+                            changed[pk] = rows[pk]
+
+            if not update:
+                model.objects.bulk_create(rows.values())
+            elif changed:
+                model.objects.bulk_update(changed.values(), list(fields))
+
+            last_pk = objs[-1].pk
+            count += len(objs)
+
+        return count
+
+    def update(self, pk, key_values=()):
+        """
+        Write the values of ``key_values`` to the row of ``pk``, the row
+        is created if missing.
+
+        :param pk: The pk of the object that inherits ``CollectionBase``.
+        :type pk: int
+        :param key_values: ``KeyValue`` objects of this object.
+        :type key_values: list
+        """
+        if self.exists():
+            model = self.model
+            values = self._get_values(key_values)
+
+            if not (values and model.objects.filter(pk=pk).update(**values)):
+                try:
+                    with transaction.atomic():
+                        model.objects.create(pk=pk, **values)
+                except IntegrityError:
+                    # The row exists, possibly from a concurrent write.
+                    if values:
+                        model.objects.filter(pk=pk).update(**values)
+
+    def create_many(self, objs):
+        """
+        Insert the rows of new objects with one ``bulk_create``.
+
+        :param objs: A list of ``(<object>, <KeyValue objects>)`` tuples of
+                     objects that inherit ``CollectionBase``.
+        :type objs: list
+        """
+        if self.exists() and objs:
+            model = self.model
+            model.objects.bulk_create([
+                model(pk=obj.pk, **self._get_values(key_values))
+                for obj, key_values in objs])
+
+    def _get_values(self, key_values):
+        """
+        :rtype: A dict of ``{<slug>: <typed value>, ...}`` of the
+                ``key_values`` with a column in the table.
+        """
+        values = {}
+
+        for kv in key_values:
+            slug = kv.dynamic_column.slug
+            field = self._fields.get(slug)
+
+            if field:
+                values[slug] = getattr(kv, field)
+
+        return values
+
+    def delete(self, pk):
+        """
+        Delete the row of ``pk``.
+
+        :param pk: The pk of the object that inherits ``CollectionBase``.
+        :type pk: int
+        """
+        if self.exists():
+            self.model.objects.filter(pk=pk).delete()
+
+
+_pivot_tables = {}
+
+
+def get_pivot_table(name):
+    """
+    Get the ``PivotTable`` of a ``ColumnCollection.related_model`` name.
+
+    :param name: The related model name, ex. 'book' or 'Book'.
+    :type name: str
+    :rtype: A ``PivotTable`` or ``None`` if it is not in
+            ``settings.DYNAMIC_COLUMNS['PIVOT_TABLES']``.
+    """
+    name = name.lower()
+    result = None
+
+    if name in dcolumn_manager.pivot_tables:
+        if name not in _pivot_tables:
+            _pivot_tables[name] = PivotTable(name)
+
+        result = _pivot_tables[name]
+
+    return result
+
+
+def _schedule_sync(names):
+    for name in set(names):
+        table = get_pivot_table(name)
+
+        if table:
+            transaction.on_commit(table.sync,
+                                  using=router.db_for_write(KeyValue))
+
+
+@receiver(key_values_saved, sender=KeyValue)
+def _key_values_saved(sender, key_values, **kwargs):
+    if dcolumn_manager.pivot_tables and key_values:
+        collection = key_values[0].collection
+
+        # A parent object does not know its related model.
+        if type(collection) is CollectionBase:
+            name = collection.column_collection.related_model
+        else:
+            name = collection._meta.model_name
+
+        table = get_pivot_table(name)
+
+        if table:
+            table.update(collection.pk, key_values)
+
+
+@receiver(collections_created)
+def _collections_created(sender, objs, **kwargs):
+    if dcolumn_manager.pivot_tables:
+        table = get_pivot_table(sender._meta.model_name)
+
+        if table:
+            table.create_many(objs)
+
+
+@receiver(post_save)
+def _collection_saved(sender, instance, created, raw=False, **kwargs):
+    if (created and not raw and isinstance(instance, CollectionBase) and
+        dcolumn_manager.pivot_tables):
+        table = get_pivot_table(instance._meta.model_name)
+
+        if table:
+            table.update(instance.pk)
+
+
+@receiver(post_delete, sender=CollectionBase)
+def _collection_deleted(sender, instance, **kwargs):
+    for name in dcolumn_manager.pivot_tables:
+        get_pivot_table(name).delete(instance.pk)
+
+
+@receiver(m2m_changed, sender=ColumnCollection.dynamic_column.through)
+def _dynamic_columns_changed(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if (action in ('post_add', 'post_remove', 'post_clear') and
+        dcolumn_manager.pivot_tables):
+        if not reverse:
+            names = [instance.related_model]
+        elif pk_set:
+            names = ColumnCollection.objects.filter(
+                pk__in=pk_set).values_list('related_model', flat=True)
+        else:
+            names = dcolumn_manager.pivot_tables
+
+        _schedule_sync(names)
+
+
+@receiver(post_save, sender=DynamicColumn)
+def _dynamic_column_saved(sender, instance, raw=False, **kwargs):
+    if not raw and dcolumn_manager.pivot_tables:
+        _schedule_sync(instance.column_collection.values_list(
+            'related_model', flat=True))
+
+
+@receiver(post_delete, sender=DynamicColumn)
+def _dynamic_column_deleted(sender, instance, **kwargs):
+    _schedule_sync(dcolumn_manager.pivot_tables)
+
+
+@receiver(post_save, sender=ColumnCollection)
+def _column_collection_saved(sender, instance, raw=False, **kwargs):
+    if not raw and dcolumn_manager.pivot_tables:
+        _schedule_sync([instance.related_model])
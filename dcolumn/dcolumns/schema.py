@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/schema.py
+#
+
+"""
+Caches of the ``DynamicColumn`` schema of each ``ColumnCollection``. The
+schema changes rarely, so writes and reads of values look up their
+``DynamicColumn`` objects here instead of in the database.
+
+The schema is kept in the Django cache set by
+``settings.DYNAMIC_COLUMNS.SCHEMA_CACHE`` under a version number that is
+shared by all processes. The save, delete and ``m2m_changed`` signals of
+the schema models bump the version, so every process reads the new schema
+on its next request.
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+import logging
+import threading
+from types import MappingProxyType
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .manager import dcolumn_manager
+from .models import DynamicColumn, ColumnCollection
+
+log = logging.getLogger('dcolumns.dcolumns.schema')
+
+VERSION_KEY = 'dcolumn:schema:version'
+KEY_PREFIX = 'dcolumn:schema:'
+
+_lock = threading.Lock()
+_dynamic_column_maps = {}
+
+
+def _get_cache():
+    return caches[dcolumn_manager.schema_cache['CACHE']]
+
+
+def get_schema_version():
+    """
+    Get the current version of the schema, a missing version is started
+    from the clock so a version evicted from the cache is never reused.
+
+    :rtype: int
+    """
+    cache = _get_cache()
+    result = cache.get(VERSION_KEY)
+
+    if result is None:
+        result = int(time.time() * 1000)
+
+        if not cache.add(VERSION_KEY, result, None):
+            result = cache.get(VERSION_KEY, result)
+
+    return result
+
+
+def bump_schema_version():
+    """
+    Invalidate the cached schema in all processes.
+    """
+    cache = _get_cache()
+
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+
+    clear_dynamic_column_maps()
+
+
+def get_schema(key, func):
+    """
+    Get a cached part of the schema, on a miss ``func`` is called and its
+    result is cached under the current version.
+
+    :param key: The name of the part of the schema.
+    :type key: str
+    :param func: A callable without arguments that builds the value, it
+                 must not return None.
+    :type func: function
+    :rtype: The value returned by ``func``.
+    """
+    cache = _get_cache()
+    version = get_schema_version()
+    key = KEY_PREFIX + key
+    result = cache.get(key, version=version)
+
+    if result is None:
+        log.debug("Schema cache miss on %s version %s", key, version)
+        result = func()
+        cache.set(key, result, dcolumn_manager.schema_cache['TIMEOUT'],
+                  version=version)
+
+    return result
+
+
+def get_dynamic_column_map(column_collection_id):
+    """
+    Get the ``DynamicColumn`` objects of a ``ColumnCollection`` keyed by
+    slug. The map is built with one query the first time it is asked for
+    in this process and rebuilt when the schema version changes.
+
+    :param column_collection_id: The pk of the ``ColumnCollection``.
+    :type column_collection_id: int
+    :rtype: A read only mapping of ``{<slug>: <DynamicColumn object>}``.
+    :raises DynamicColumn.MultipleObjectsReturned: If a slug is used by more
+                                                  than one column of the
+                                                  collection.
+    """
+    version = get_schema_version()
+    version_map = _dynamic_column_maps.get(column_collection_id)
+
+    if version_map is None or version_map[0] != version:
+        dcs = {}
+
+        for dc in DynamicColumn.objects.filter(
+            column_collection=column_collection_id):
+            if dc.slug in dcs:
+                msg = ("The slug '{}' is used by more than one "
+                       "DynamicColumn of ColumnCollection {}.").format(
+                    dc.slug, column_collection_id)
+                log.error(msg)
+                raise DynamicColumn.MultipleObjectsReturned(msg)
+
+            dcs[dc.slug] = dc
+
+        result = MappingProxyType(dcs)
+
+        with _lock:
+            _dynamic_column_maps[column_collection_id] = (version, result)
+    else:
+        result = version_map[1]
+
+    return result
+
+
+def clear_dynamic_column_maps():
+    """
+    Discard all the ``DynamicColumn`` maps of this process.
+    """
+    with _lock:
+        _dynamic_column_maps.clear()
+
+
+@receiver(post_save, sender=DynamicColumn)
+@receiver(post_delete, sender=DynamicColumn)
+@receiver(post_save, sender=ColumnCollection)
+@receiver(post_delete, sender=ColumnCollection)
+@receiver(m2m_changed, sender=ColumnCollection.dynamic_column.through)
+def _schema_changed(sender, **kwargs):
+    # Bump now so this process sees its own change, and again on commit
+    # so a process that cached the old schema meanwhile reads it again.
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_schema_version()
+        transaction.on_commit(bump_schema_version)
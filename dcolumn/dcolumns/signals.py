@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/signals.py
+#
+
+"""
+Signals sent by the dynamic column models.
+"""
+__docformat__ = "restructuredtext en"
+
+from django.dispatch import Signal
+
+# Sent after ``KeyValue`` objects are written, by ``KeyValue.save`` and by
+# the bulk writes of ``CollectionBase``. ``bulk_create`` and
+# ``bulk_update`` do not send ``post_save``.
+#
+# Arguments: ``sender`` (``KeyValue``) and ``key_values`` (a list of the
+# written ``KeyValue`` objects, all of the same collection).
+key_values_saved = Signal()
+
+# Sent once by ``CollectionBaseManager.bulk_create_with_values`` after the
+# objects and their values are inserted, it sends neither ``post_save`` nor
+# ``key_values_saved``.
+#
+# Arguments: ``sender`` (the model of the objects) and ``objs`` (a list of
+# ``(<object>, <list of its KeyValue objects>)`` tuples).
+collections_created = Signal()
@@ -0,0 +1,718 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/storage.py
+#
+
+"""
+Storage engines for the dynamic column values of ``CollectionBase``
+objects. Every engine reads and writes the values as ``KeyValue``
+objects, which may or may not be rows in the ``KeyValue`` table, so the
+decoding in ``CollectionBase`` is the same for all of them.
+
+A ``ColumnCollection.storage`` chooses the engine of new objects, the
+``dcolumn_migrate_storage`` management command moves existing objects.
+"""
+__docformat__ = "restructuredtext en"
+
+import logging
+
+from django.db import (
+    models, transaction, connections, router, IntegrityError)
+from django.db.models import sql, Case, Q, When
+from django.db.models.functions import Cast, Coalesce
+
+from .models import ColumnCollection, CollectionBase, DynamicColumn, KeyValue
+
+log = logging.getLogger('dcolumns.dcolumns.storage')
+
+
+class StorageEngineChanged(Exception):
+    """
+    Raised by a write of an engine that no longer owns the object, it was
+    migrated to another engine after it was loaded. Nothing was written.
+    """
+    pass
+
+
+class StorageEngine:
+    """
+    The interface of a storage engine. The engine of an object is the
+    first registered engine that ``owns`` it, or the default
+    ``KeyValueEngine``.
+    """
+    number = None
+
+    def owns(self, obj):
+        """
+        Check if the values of ``obj`` are in this engine.
+
+        :param obj: An object that inherits ``CollectionBase``.
+        :type obj: ``CollectionBase`` object
+        :rtype: ``True`` or ``False``.
+        """
+        raise NotImplementedError
+
+    def initialize(self, obj):
+        """
+        Mark ``obj`` as stored in this engine, called before a new object
+        is first saved and when an object is migrated to this engine.
+
+        :param obj: An object that inherits ``CollectionBase``.
+        :type obj: ``CollectionBase`` object
+        """
+        pass
+
+    def load(self, objs, slugs=None):
+        """
+        Load the ``KeyValue`` objects of ``objs``, with their
+        ``DynamicColumn`` objects, in as few queries as possible.
+
+        :param objs: Objects that inherit ``CollectionBase`` owned by this
+                     engine.
+        :type objs: list
+        :param slugs: Only load the values of these slugs, all if ``None``.
+        :type slugs: list or None
+        :rtype: A dict of ``{<obj pk>: [<KeyValue object>, ...], ...}``.
+        """
+        raise NotImplementedError
+
+    def save(self, obj, key_values):
+        """
+        Write validated ``KeyValue`` objects of ``obj``. Use
+        ``save_object`` instead, it retries a write to a migrated object.
+
+        :param obj: An object that inherits ``CollectionBase`` owned by
+                    this engine.
+        :type obj: ``CollectionBase`` object
+        :param key_values: The ``KeyValue`` objects with their typed fields
+                           set.
+        :type key_values: list
+        :raises StorageEngineChanged: If the object is no longer owned by
+                                      this engine.
+        """
+        raise NotImplementedError
+
+    def save_new(self, pairs):
+        """
+        Write the ``KeyValue`` objects of many objects that were just
+        inserted and have no values yet, as ``save`` does one. Engines that
+        can should override this with a batched write.
+
+        :param pairs: A list of ``(<obj>, <key_values>)`` tuples, the
+                      objects are owned by this engine.
+        :type pairs: list
+        """
+        for obj, key_values in pairs:
+            if key_values:
+                self.save(obj, key_values)
+
+    def add(self, obj, dc, n):
+        """
+        Atomically add ``n`` to the ``NUMBER`` value of ``dc``, a missing
+        or non-numeric value counts as zero.
+
+        :param obj: An object that inherits ``CollectionBase`` owned by
+                    this engine.
+        :type obj: ``CollectionBase`` object
+        :param dc: A ``NUMBER`` ``DynamicColumn`` object.
+        :type dc: ``DynamicColumn`` object
+        :param n: The amount to add, may be negative.
+        :type n: int
+        :rtype: The saved ``KeyValue`` object with the new value.
+        :raises StorageEngineChanged: If the object is no longer owned by
+                                      this engine.
+        """
+        raise NotImplementedError
+
+    def add_many(self, deltas):
+        """
+        Add many amounts, as ``add`` does one, in one transaction so
+        nothing is written if one fails. Engines that can should override
+        this with a batched write.
+
+        :param deltas: A list of ``(<obj>, <DynamicColumn object>, <n>)``
+                       tuples, the objects are owned by this engine.
+        :type deltas: list
+        :rtype: A list of the saved ``KeyValue`` objects.
+        :raises StorageEngineChanged: If an object is no longer owned by
+                                      this engine.
+        """
+        with transaction.atomic(using=router.db_for_write(CollectionBase)):
+            return [self.add(obj, dc, n) for obj, dc, n in deltas]
+
+    def remove(self, obj):
+        """
+        Delete all the values of ``obj`` and release it from this engine,
+        used when an object is migrated to another engine.
+
+        :param obj: An object that inherits ``CollectionBase`` owned by
+                    this engine.
+        :type obj: ``CollectionBase`` object
+        """
+        raise NotImplementedError
+
+
+class KeyValueEngine(StorageEngine):
+    """
+    One ``KeyValue`` row per value, this is the default.
+    """
+    number = ColumnCollection.KEY_VALUE
+    # Keeps the OR and CASE expressions well under the SQLite depth limit.
+    ADD_MANY_BATCH_SIZE = 100
+
+    def owns(self, obj):
+        return True
+
+    def load(self, objs, slugs=None):
+        result = {obj.pk: [] for obj in objs}
+
+        if result:
+            queryset = KeyValue.objects.select_related(
+                'dynamic_column').filter(collection_id__in=list(result)
+                                         ).order_by()
+
+            if slugs is not None:
+                queryset = queryset.filter(dynamic_column__slug__in=slugs)
+
+            for kv in queryset:
+                result[kv.collection_id].append(kv)
+
+        return result
+
+    def save(self, obj, key_values):
+        """
+        Write new ``KeyValue`` objects with one upsert and existing
+        objects with one ``bulk_update``. The object's row is locked first,
+        so a migration to another engine waits for the write.
+        """
+        new_objs = [kv for kv in key_values if kv.pk is None]
+        old_objs = [kv for kv in key_values if kv.pk is not None]
+
+        # No savepoint, nothing has been written when the lock fails.
+        with transaction.atomic(using=router.db_for_write(KeyValue),
+                                savepoint=False):
+            moved = self._lock([obj])
+
+            if not moved:
+                self._upsert(obj, new_objs)
+                KeyValue.objects.bulk_update(old_objs, KeyValue.VALUE_FIELDS)
+
+        if moved:
+            raise StorageEngineChanged(moved)
+
+    def _lock(self, objs):
+        """
+        Lock the rows of ``objs``.
+
+        :rtype: A list of the pks of the objects migrated to another
+                engine.
+        """
+        return list(CollectionBase.objects.select_for_update().filter(
+            pk__in=[obj.pk for obj in objs], json_values__isnull=False
+            ).values_list('pk', flat=True))
+
+    def save_new(self, pairs):
+        """
+        New objects cannot conflict, all the values are one
+        ``bulk_create``.
+        """
+        objs = []
+
+        for obj, key_values in pairs:
+            for kv in key_values:
+                kv.collection = obj
+                objs.append(kv)
+
+        if objs:
+            KeyValue.objects.bulk_create(objs)
+
+    def _upsert(self, obj, key_values):
+        """
+        Insert new ``KeyValue`` objects, updating the value of any that a
+        concurrent write has already created. Where the database and Django
+        support it this is a single ``INSERT ... ON CONFLICT DO UPDATE``
+        statement, otherwise the conflicting objects are updated after an
+        ``IntegrityError``.
+        """
+        if key_values:
+            features = connections[router.db_for_write(KeyValue)].features
+
+            if getattr(features, 'supports_update_conflicts', False):
+                kwargs = {'update_conflicts': True,
+                          'update_fields': KeyValue.VALUE_FIELDS}
+
+                if features.supports_update_conflicts_with_target:
+                    kwargs['unique_fields'] = ('collection', 'dynamic_column')
+
+                KeyValue.objects.bulk_create(key_values, **kwargs)
+            else: # pragma: no cover
+                try:
+                    with transaction.atomic():
+                        KeyValue.objects.bulk_create(key_values)
+                except IntegrityError:
+                    self._set_pks(obj, key_values)
+                    KeyValue.objects.bulk_create(
+                        [kv for kv in key_values if kv.pk is None])
+                    KeyValue.objects.bulk_update(
+                        [kv for kv in key_values if kv.pk is not None],
+                        KeyValue.VALUE_FIELDS)
+
+            # Conflict handling inserts do not return the pks.
+            self._set_pks(obj, key_values)
+
+    def _set_pks(self, obj, key_values):
+        """
+        Set the pk of any ``key_values`` without one from the database.
+        """
+        missing = {kv.dynamic_column_id: kv for kv in key_values
+                   if kv.pk is None}
+
+        if missing:
+            queryset = KeyValue.objects.filter(
+                collection_id=obj.pk, dynamic_column_id__in=list(missing)
+                ).order_by().values_list('dynamic_column_id', 'pk')
+
+            for dc_id, pk in queryset:
+                kv = missing[dc_id]
+                kv.pk = pk
+                kv._state.adding = False
+
+    def add(self, obj, dc, n):
+        """
+        The value is changed by one ``UPDATE`` of the typed column, where
+        the database supports ``UPDATE ... RETURNING`` the new value is
+        returned by the same statement. A missing row is first inserted
+        as zero, ignoring a concurrent insert.
+        """
+        queryset = KeyValue.objects.filter(collection_id=obj.pk,
+                                           dynamic_column_id=dc.pk)
+        total = self._stored_int() + models.Value(n)
+        # The text value is first, MySQL sets the columns left to right.
+        values = {'value': Cast(total, models.TextField()),
+                  'value_int': total}
+
+        with transaction.atomic(using=router.db_for_write(KeyValue),
+                                savepoint=False):
+            moved = self._lock([obj])
+
+            if not moved:
+                row = self._update_returning(queryset, values)
+
+                if row is None:
+                    KeyValue.objects.bulk_create(
+                        [KeyValue(collection=obj, dynamic_column=dc,
+                                  value='0', value_int=0)],
+                        ignore_conflicts=True)
+                    row = self._update_returning(queryset, values)
+
+        if moved:
+            raise StorageEngineChanged(moved)
+
+        pk, total = row
+        kv = KeyValue(pk=pk, collection=obj, dynamic_column=dc,
+                      value=str(total), value_int=total)
+        kv._state.adding = False
+        return kv
+
+    def add_many(self, deltas):
+        """
+        In chunks of ``ADD_MANY_BATCH_SIZE`` amounts, missing rows are
+        inserted as zero with one ``INSERT`` then all the amounts are
+        added with one ``UPDATE``, the new values are read back with one
+        ``SELECT``. All the chunks are one transaction.
+        """
+        key_values = []
+
+        with transaction.atomic(using=router.db_for_write(KeyValue)):
+            for i in range(0, len(deltas), self.ADD_MANY_BATCH_SIZE):
+                key_values.extend(self._add_batch(
+                    deltas[i:i + self.ADD_MANY_BATCH_SIZE]))
+
+        return key_values
+
+    def _add_batch(self, deltas):
+        objs = {}
+        condition = Q()
+        whens = []
+        key_values = []
+
+        for obj, dc, n in deltas:
+            q = Q(collection_id=obj.pk, dynamic_column_id=dc.pk)
+            objs[obj.pk] = obj
+            condition |= q
+            whens.append(When(q, then=models.Value(n)))
+
+        total = self._stored_int() + Case(
+            *whens, default=models.Value(0),
+            output_field=models.BigIntegerField())
+        queryset = KeyValue.objects.filter(condition)
+        moved = self._lock(objs.values())
+
+        if moved:
+            raise StorageEngineChanged(moved)
+
+        KeyValue.objects.bulk_create(
+            [KeyValue(collection=obj, dynamic_column=dc, value='0',
+                      value_int=0) for obj, dc, n in deltas],
+            ignore_conflicts=True)
+        # The text value is first, MySQL sets the columns left to right.
+        queryset.update(value=Cast(total, models.TextField()),
+                        value_int=total)
+
+        for kv in queryset.select_related('dynamic_column').order_by():
+            kv.collection = objs[kv.collection_id]
+            key_values.append(kv)
+
+        return key_values
+
+    @staticmethod
+    def _stored_int():
+        """
+        The stored integer of a row. Rows written before ``value_int``
+        was added have it null until ``dcolumn_backfill_typed`` is run, so
+        the text value is used, a missing or non-numeric value counts as
+        zero.
+        """
+        return Coalesce(models.F('value_int'), Case(
+            When(value__regex=r'^-?[0-9]+$',
+                 then=Cast('value', models.BigIntegerField())),
+            default=models.Value(0), output_field=models.BigIntegerField()))
+
+    def _update_returning(self, queryset, values):
+        """
+        Update the single row of ``queryset``.
+
+        :rtype: A tuple of ``(<pk>, <value_int>)`` or ``None`` if there
+                is no row.
+        """
+        using = router.db_for_write(KeyValue)
+        connection = connections[using]
+
+        if (connection.vendor in ('postgresql', 'sqlite') and
+            connection.features.can_return_columns_from_insert):
+            query = queryset.query.chain(sql.UpdateQuery)
+            query.add_update_values(values)
+            statement, params = query.get_compiler(using).as_sql()
+            qn = connection.ops.quote_name
+            statement += ' RETURNING {}, {}'.format(
+                qn(KeyValue._meta.pk.column), qn('value_int'))
+
+            with connection.cursor() as cursor:
+                cursor.execute(statement, params)
+                row = cursor.fetchone()
+        else: # pragma: no cover
+            with transaction.atomic(using=using):
+                if queryset.update(**values):
+                    row = queryset.values_list('pk', 'value_int').get()
+                else:
+                    row = None
+
+        return row
+
+    def remove(self, obj):
+        KeyValue.objects.filter(collection_id=obj.pk).delete()
+
+
+class JSONMerge(models.Func):
+    """
+    Merge a JSON object into a JSON field in the database, keys in the
+    second expression replace the keys in the first.
+    """
+    VENDORS = ('sqlite', 'postgresql', 'mysql')
+    output_field = models.JSONField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='JSON_PATCH',
+                           **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='JSON_MERGE_PATCH',
+                           **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='(%(expressions)s)',
+                           arg_joiner=' || ', **extra_context)
+
+
+class JSONEngine(StorageEngine):
+    """
+    All values of an object in ``CollectionBase.json_values`` keyed by
+    ``DynamicColumn`` pk, a read is the object's row and a write is one
+    ``UPDATE``.
+    """
+    number = ColumnCollection.JSON
+    # Keeps the CASE expression well under the SQLite depth limit.
+    SAVE_NEW_BATCH_SIZE = 100
+
+    def owns(self, obj):
+        return obj.json_values is not None
+
+    def initialize(self, obj):
+        if obj.json_values is None:
+            obj.json_values = {}
+
+        if obj.pk is not None:
+            CollectionBase.objects.filter(
+                pk=obj.pk, json_values__isnull=True).update(json_values={})
+
+    def load(self, objs, slugs=None):
+        dcs = DynamicColumn.objects.in_bulk(
+            {int(pk) for obj in objs for pk in obj.json_values})
+        result = {}
+
+        for obj in objs:
+            result[obj.pk] = [
+                KeyValue(collection=obj, dynamic_column=dcs[int(pk)],
+                         value=value)
+                for pk, value in obj.json_values.items()
+                if int(pk) in dcs and (slugs is None or
+                                       dcs[int(pk)].slug in slugs)]
+
+        return result
+
+    def save(self, obj, key_values):
+        """
+        Merge the values into ``json_values`` in the database so
+        concurrent writes of other slugs are not lost. A document set to
+        null by a migration is not updated.
+        """
+        values = {str(kv.dynamic_column_id): kv.value for kv in key_values}
+        queryset = CollectionBase.objects.filter(pk=obj.pk,
+                                                 json_values__isnull=False)
+        vendor = connections[router.db_for_write(CollectionBase)].vendor
+        document = dict(obj.json_values, **values)
+
+        if vendor in JSONMerge.VENDORS:
+            count = queryset.update(json_values=JSONMerge(
+                'json_values', models.Value(
+                    values, output_field=models.JSONField())))
+        else: # pragma: no cover
+            count = queryset.update(json_values=document)
+
+        if not count:
+            raise StorageEngineChanged([obj.pk])
+
+        obj.json_values = document
+
+    def save_new(self, pairs):
+        """
+        The documents are set with one ``UPDATE ... CASE`` per
+        ``SAVE_NEW_BATCH_SIZE`` objects.
+        """
+        docs = {}
+
+        for obj, key_values in pairs:
+            if key_values:
+                obj.json_values.update({str(kv.dynamic_column_id): kv.value
+                                        for kv in key_values})
+                docs[obj.pk] = obj.json_values
+
+        pks = list(docs)
+
+        for i in range(0, len(pks), self.SAVE_NEW_BATCH_SIZE):
+            batch = pks[i:i + self.SAVE_NEW_BATCH_SIZE]
+            whens = [When(pk=pk, then=models.Value(
+                docs[pk], output_field=models.JSONField())) for pk in batch]
+            CollectionBase.objects.filter(pk__in=batch).update(
+                json_values=Case(*whens, output_field=models.JSONField()))
+
+    def add(self, obj, dc, n):
+        """
+        The document is read with its row locked and the new value merged
+        back, this is two statements in one transaction.
+        """
+        key = str(dc.pk)
+
+        with transaction.atomic(using=router.db_for_write(CollectionBase)):
+            values = CollectionBase.objects.select_for_update().filter(
+                pk=obj.pk).values_list('json_values', flat=True).get()
+
+            if values is None:
+                raise StorageEngineChanged([obj.pk])
+
+            try:
+                total = int(values.get(key)) + n
+            except (TypeError, ValueError):
+                total = n
+
+            kv = KeyValue(collection=obj, dynamic_column=dc,
+                          value=str(total))
+            kv.populate_typed_values()
+            obj.json_values = values
+            self.save(obj, [kv])
+
+        return kv
+
+    def remove(self, obj):
+        obj.json_values = None
+        CollectionBase.objects.filter(pk=obj.pk).update(json_values=None)
+
+
+_storage_engines = {}
+
+
+def register_storage_engine(engine):
+    """
+    Register a storage engine. The engine's ``number`` is the
+    ``ColumnCollection.storage`` value that selects it.
+
+    :param engine: An instance of a ``StorageEngine`` subclass.
+    :type engine: ``StorageEngine`` object
+    """
+    _storage_engines[engine.number] = engine
+
+
+def get_storage_engine(number):
+    """
+    Get a storage engine by its ``ColumnCollection.storage`` value.
+
+    :param number: The storage value.
+    :type number: int
+    :rtype: A ``StorageEngine`` object.
+    :raises ValueError: If the engine is not registered.
+    """
+    try:
+        return _storage_engines[number]
+    except KeyError:
+        msg = "Storage engine {} is not registered.".format(number)
+        log.error(msg)
+        raise ValueError(msg)
+
+
+def get_object_engine(obj):
+    """
+    Get the storage engine that owns the values of ``obj``.
+
+    :param obj: An object that inherits ``CollectionBase``.
+    :type obj: ``CollectionBase`` object
+    :rtype: A ``StorageEngine`` object.
+    """
+    default = _storage_engines[ColumnCollection.KEY_VALUE]
+    engines = [engine for engine in _storage_engines.values()
+               if engine is not default and engine.owns(obj)]
+    return engines[0] if engines else default
+
+
+def _reload_engines(objs):
+    """
+    Read the ``json_values`` of ``objs`` again, which selects their
+    engine.
+    """
+    values = dict(CollectionBase.objects.filter(
+        pk__in=[obj.pk for obj in objs]).values_list('pk', 'json_values'))
+
+    for obj in objs:
+        obj.json_values = values.get(obj.pk)
+
+
+def save_object(obj, key_values):
+    """
+    Write the ``KeyValue`` objects of ``obj`` with the engine that owns it.
+    If the object was migrated to another engine after it was loaded the
+    write is done again with the new engine.
+
+    :param obj: An object that inherits ``CollectionBase``.
+    :type obj: ``CollectionBase`` object
+    :param key_values: The ``KeyValue`` objects with their typed fields
+                       set.
+    :type key_values: list
+    """
+    try:
+        get_object_engine(obj).save(obj, key_values)
+    except StorageEngineChanged:
+        log.warning("Object %s changed storage engine, retrying.", obj.pk)
+        _reload_engines([obj])
+        get_object_engine(obj).save(obj, key_values)
+
+
+def add_value(obj, dc, n):
+    """
+    Add ``n`` to a ``NUMBER`` value of ``obj`` as ``StorageEngine.add``
+    does, retried as in ``save_object``.
+
+    :param obj: An object that inherits ``CollectionBase``.
+    :type obj: ``CollectionBase`` object
+    :param dc: A ``NUMBER`` ``DynamicColumn`` object.
+    :type dc: ``DynamicColumn`` object
+    :param n: The amount to add, may be negative.
+    :type n: int
+    :rtype: The saved ``KeyValue`` object with the new value.
+    """
+    try:
+        result = get_object_engine(obj).add(obj, dc, n)
+    except StorageEngineChanged:
+        log.warning("Object %s changed storage engine, retrying.", obj.pk)
+        _reload_engines([obj])
+        result = get_object_engine(obj).add(obj, dc, n)
+
+    return result
+
+
+def add_many_values(deltas):
+    """
+    Add many amounts with one ``add_many`` per engine, the deltas of an
+    engine are retried as in ``save_object``.
+
+    :param deltas: A list of ``(<obj>, <DynamicColumn object>, <n>)``
+                   tuples.
+    :type deltas: list
+    :rtype: A list of the saved ``KeyValue`` objects.
+    """
+    result = []
+    engines = {}
+
+    for obj, dc, n in deltas:
+        engines.setdefault(get_object_engine(obj), []).append((obj, dc, n))
+
+    for engine, engine_deltas in engines.items():
+        try:
+            result.extend(engine.add_many(engine_deltas))
+        except StorageEngineChanged as e:
+            log.warning("Objects %s changed storage engine, retrying.", e)
+            _reload_engines([obj for obj, dc, n in engine_deltas])
+            retry = {}
+
+            for delta in engine_deltas:
+                retry.setdefault(get_object_engine(delta[0]), []).append(
+                    delta)
+
+            for retry_engine, retry_deltas in retry.items():
+                result.extend(retry_engine.add_many(retry_deltas))
+
+    return result
+
+
+def migrate_object(obj, engine):
+    """
+    Move the values of ``obj`` to ``engine``. This should be done in a
+    transaction with the object's row locked.
+
+    :param obj: An object that inherits ``CollectionBase``.
+    :type obj: ``CollectionBase`` object
+    :param engine: The target storage engine.
+    :type engine: ``StorageEngine`` object
+    :rtype: ``True`` if the object was moved, ``False`` if it was
+            already in ``engine``.
+    """
+    source = get_object_engine(obj)
+    result = source is not engine
+
+    if result:
+        key_values = []
+
+        for kv in source.load([obj])[obj.pk]:
+            key_values.append(KeyValue(collection=obj,
+                                       dynamic_column=kv.dynamic_column,
+                                       value=kv.value))
+            key_values[-1].populate_typed_values()
+
+        source.remove(obj)
+        engine.initialize(obj)
+        engine.save(obj, key_values)
+        obj.refresh_from_db(fields=['json_values'])
+
+    return result
+
+
+register_storage_engine(KeyValueEngine())
+register_storage_engine(JSONEngine())
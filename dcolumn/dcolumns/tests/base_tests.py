@@ -88,6 +88,8 @@ class BaseDcolumns:
             defaults=kwargs)
 
         if not created:
+            # Save through the instance so its KeyValue cache is current.
+            obj.collection = collection
             obj.value = value
             obj.save()
 
@@ -98,7 +100,7 @@ class BaseDcolumns:
         """
         Create  a set of Author objects.
         """
-        dcs = extra_dcs
+        dcs = list(extra_dcs)
         dc0 = self._create_dynamic_column_record(
             "Web Site", DynamicColumn.TEXT, 'author_top', 1, required=required)
         dcs.append(dc0)
@@ -118,7 +120,7 @@ class BaseDcolumns:
         """
         Create  a set of Publisher objects.
         """
-        dcs = extra_dcs
+        dcs = list(extra_dcs)
         dc0 = self._create_dynamic_column_record(
             "Web Site", DynamicColumn.TEXT, 'publisher_top', 1,
             required=required)
@@ -141,7 +143,7 @@ class BaseDcolumns:
         """
         Create  a set of Promotion objects.
         """
-        dcs = extra_dcs
+        dcs = list(extra_dcs)
         # Create promotion description
         dc0 = self._create_dynamic_column_record(
             "Description", DynamicColumn.TEXT, 'promotion_top', 1,
@@ -184,7 +186,7 @@ class BaseDcolumns:
         """
         Create  a set of Book objects.
         """
-        dcs = extra_dcs
+        dcs = list(extra_dcs)
         dc0 = self._create_dynamic_column_record(
             "Abstract", DynamicColumn.TEXT_BLOCK, 'book_top', 1,
             required=required)
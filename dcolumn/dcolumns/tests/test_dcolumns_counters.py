@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/tests/test_dcolumns_counters.py
+#
+# WARNING: These unittests can only be run from within the original test
+#          framework from https://github.com/cnobile2012/dcolumn.
+#
+
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+
+from example_site.books.models import Book
+
+from .. import counters
+from ..models import DynamicColumn, ColumnCollection, KeyValue
+from .base_tests import BaseDcolumns
+
+
+class TestCounterBuffer(BaseDcolumns, TestCase):
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def setUp(self):
+        super().setUp()
+        dc0 = self._create_dynamic_column_record(
+            "Views", DynamicColumn.NUMBER, 'book_top', 4)
+        dc1 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 5)
+        self.book, self.cc, b_values = self._create_book_objects(
+            extra_dcs=[dc0, dc1])
+        self.book_1 = self._create_dcolumn_record(Book, self.cc,
+                                                  title="Another Book")
+
+    def tearDown(self):
+        super().tearDown()
+        counters._counter_buffer = None
+        counters._counter_buffer_config = None
+        cache.clear()
+
+    def _test_buffer(self):
+        # Test that increments are not written until a flush.
+        self.book.set_key_value('views', 5)
+
+        with self.assertNumQueries(0):
+            self.book.set_key_value('views', 'increment')
+            self.assertEqual(self.book.add('views', 3), None)
+
+        self.book_1.set_key_values({'views': 'decrement'})
+        self.assertEqual(Book.objects.get(pk=self.book.pk).get_key_value(
+            'views'), 5)
+        # Test that the read API merges the pending amounts.
+        self.assertEqual(self.book.get_counter('views'), 9)
+        self.assertEqual(self.book_1.get_counter('views'), -1)
+        # Test that a flush is one batched write.
+        buffer = counters.get_counter_buffer()
+
+        with self.assertNumQueries(8):
+            self.assertEqual(buffer.flush(), 2)
+
+        dc = self.book.get_dynamic_column('views')
+        self.assertEqual(buffer.pending(self.book.pk, dc.pk), 0)
+        kv = KeyValue.objects.get(collection=self.book,
+                                  dynamic_column__slug='views')
+        self.assertEqual((kv.value, kv.value_int), ('9', 9))
+        self.assertEqual(Book.objects.get(pk=self.book_1.pk).get_key_value(
+            'views'), -1)
+        self.assertEqual(self.book.get_counter('views'), 9)
+        # Test that slugs not in the buffer are written at once.
+        self.assertEqual(self.book.add('edition', 2), 2)
+
+    @override_settings(DYNAMIC_COLUMNS={'COUNTER_BUFFER': {
+        'SLUGS': ['views'], 'FLUSH_INTERVAL': 3600}})
+    def test_memory_buffer(self):
+        """
+        Test that the in-process buffer batches increments.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.assertIsInstance(counters.get_counter_buffer(),
+                              counters.MemoryCounterBuffer)
+        self._test_buffer()
+
+    @override_settings(DYNAMIC_COLUMNS={'COUNTER_BUFFER': {
+        'SLUGS': ['views'], 'BACKEND': 'cache', 'FLUSH_INTERVAL': 3600}})
+    def test_cache_buffer(self):
+        """
+        Test that the cache buffer batches increments.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.assertIsInstance(counters.get_counter_buffer(),
+                              counters.CacheCounterBuffer)
+        self._test_buffer()
+        # Test that a counter pending again after a flush is logged again.
+        self.book.add('views', 1)
+        out = StringIO()
+        call_command('dcolumn_flush_counters', stdout=out)
+        self.assertIn("Flushed 1 counters.", out.getvalue())
+        self.assertEqual(Book.objects.get(pk=self.book.pk).get_key_value(
+            'views'), 10)
+
+    @override_settings(DYNAMIC_COLUMNS={'COUNTER_BUFFER': {
+        'SLUGS': ['views'], 'MAX_PENDING': 2, 'FLUSH_INTERVAL': 3600}})
+    def test_flush_threshold(self):
+        """
+        Test that the buffer is flushed when it is full and that JSON
+        storage objects are written.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.cc.storage = ColumnCollection.JSON
+        self.cc.save()
+        book_2 = self._create_dcolumn_record(Book, self.cc, title="JSON")
+        self.book.add('views', 1)
+        self.book.add('views', 1)
+        self.assertEqual(KeyValue.objects.filter(
+            dynamic_column__slug='views').count(), 0)
+        book_2.add('views', 4)
+        self.assertEqual(KeyValue.objects.get(
+            dynamic_column__slug='views').value_int, 2)
+        self.assertEqual(Book.objects.get(pk=book_2.pk).get_key_value(
+            'views'), 4)
+        # Test an invalid backend.
+        with self.settings(DYNAMIC_COLUMNS={'COUNTER_BUFFER': {
+            'SLUGS': ['views'], 'BACKEND': 'disk'}}):
+            self.assertRaises(ValueError, counters.get_counter_buffer)
+
+    @override_settings(DYNAMIC_COLUMNS={'COUNTER_BUFFER': {
+        'SLUGS': ['views'], 'MAX_PENDING': 2, 'FLUSH_INTERVAL': 3600}})
+    def test_failed_flush(self):
+        """
+        Test that a failed flush keeps the amounts and does not raise in
+        the increment that caused it.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc = self.book.get_dynamic_column('views')
+
+        with mock.patch.object(counters, 'write_deltas',
+                               side_effect=DatabaseError("Failed")):
+            self.book.add('views', 1)
+            self.book_1.add('views', 2)
+
+        buffer = counters.get_counter_buffer()
+        self.assertEqual(buffer.pending(self.book.pk, dc.pk), 1)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(Book.objects.get(pk=self.book_1.pk).get_key_value(
+            'views'), 2)
+
+    def test_write_deltas_batches(self):
+        """
+        Test that many amounts are written in chunks, one expression for
+        all of them is too deep for SQLite.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc = self.book.get_dynamic_column('views')
+        user = {'creator': self.user, 'updater': self.user}
+        books = Book.objects.bulk_create_with_values(
+            [(dict(title="Book {}".format(i), **user), {})
+             for i in range(1500)])
+        key_values = counters.write_deltas(
+            {(book.pk, dc.pk): i for i, book in enumerate(books)})
+        self.assertEqual(len(key_values), 1500)
+        self.assertEqual(KeyValue.objects.get(
+            collection=books[-1], dynamic_column=dc).value_int, 1499)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/tests/test_dcolumns_dates.py
+#
+# WARNING: These unittests can only be run from within the original test
+#          framework from https://github.com/cnobile2012/dcolumn.
+#
+
+from datetime import datetime, timezone
+from io import StringIO
+
+from dateutil import parser
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from ..dates import parse_datetime, _parse_datetime
+
+
+class TestParseDatetime(SimpleTestCase):
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def test_parse_datetime(self):
+        """
+        Test that the results are the same as dateutil.
+        """
+        #self.skipTest("Temporarily skipped")
+        default = datetime(1970, 1, 1)
+        values = (
+            '2020-03-04T05:06:07.000008+00:00', '2020-03-04T05:06:07',
+            '2020-03-04 05:06', '2020-03-04', '05:06:07.000008+00:00',
+            '05:06', '2020-03-04T05:06:07Z', 'March 4, 2020 5:06 PM',
+            '3/4/2020', 'T05:06',
+            # Only digits are dates to dateutil, not times.
+            '2020', '12', '0130', '1230', '20200304')
+
+        for value in values:
+            msg = "value: {}".format(value)
+            self.assertEqual(parse_datetime(value), parser.parse(value), msg)
+            self.assertEqual(parse_datetime(value, default=default),
+                             parser.parse(value, default=default), msg)
+
+        # Test that results are cached by string.
+        _parse_datetime.cache_clear()
+        parse_datetime(values[0])
+        parse_datetime(values[0])
+        self.assertEqual(_parse_datetime.cache_info().hits, 1)
+        # Test invalid values.
+        self.assertRaises(ValueError, parse_datetime, 'not a date')
+        self.assertRaises(ValueError, parse_datetime, '99999999999999999999')
+
+    def test_benchmark_command(self):
+        """
+        Test that the benchmark runs.
+        """
+        #self.skipTest("Temporarily skipped")
+        out = StringIO()
+        call_command('dcolumn_benchmark_dates', count=30, distinct=10,
+                     stdout=out)
+        self.assertIn("Decoded 30 values, 10 distinct.", out.getvalue())
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/tests/test_dcolumns_export.py
+#
+# WARNING: These unittests can only be run from within the original test
+#          framework from https://github.com/cnobile2012/dcolumn.
+#
+
+import csv
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from example_site.books.models import Author, Book
+
+from ..choices import get_value_cache
+from ..export import export_collection, get_collection_model
+from ..models import DynamicColumn, ColumnCollection
+from .base_tests import BaseDcolumns
+
+
+class TestExport(BaseDcolumns, TestCase):
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def setUp(self):
+        super().setUp()
+        self.author, a_cc, a_values = self._create_author_objects()
+        dc0 = self._create_dynamic_column_record(
+            "Abstract", DynamicColumn.TEXT_BLOCK, 'book_top', 1)
+        dc1 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 2)
+        dc2 = self._create_dynamic_column_record(
+            "Author", DynamicColumn.CHOICE, 'book_top', 3,
+            relation=self.choice2index.get("Author"))
+        self.cc = self._create_column_collection_record(
+            "Book Current", 'book', dynamic_columns=[dc0, dc1, dc2])
+        self.book = self._create_dcolumn_record(Book, self.cc, title="One")
+        self.book.set_key_values({'abstract': "First", 'edition': 2,
+                                  'author': self.author})
+        self.book_1 = self._create_dcolumn_record(Book, self.cc, title="Two")
+        self.book_1.set_key_values({'edition': 3})
+
+    def test_get_collection_model(self):
+        """
+        Test that the related model names map to their models.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.assertEqual(get_collection_model('Book'), Book)
+        self.assertEqual(get_collection_model('author'), Author)
+        self.assertRaises(ValueError, get_collection_model, 'keyvalue')
+
+    def test_export_csv(self):
+        """
+        Test that the objects and their decoded values are written as CSV
+        with a constant number of queries.
+        """
+        #self.skipTest("Temporarily skipped")
+        get_value_cache(Author).clear()
+        stream = StringIO()
+
+        # The slugs, the DynamicColumns, the books, the KeyValues and the
+        # authors.
+        with self.assertNumQueries(5):
+            count = export_collection(Book, stream, chunk_size=1)
+
+        self.assertEqual(count, 2)
+        rows = list(csv.DictReader(StringIO(stream.getvalue())))
+        msg = "rows: {}".format(rows)
+        self.assertEqual(rows[0]['title'], "One", msg)
+        self.assertEqual(rows[0]['abstract'], "First", msg)
+        self.assertEqual(rows[0]['edition'], "2", msg)
+        self.assertEqual(rows[0]['author'], self.author.name, msg)
+        self.assertEqual(rows[1]['abstract'], "", msg)
+        self.assertEqual(rows[1]['edition'], "3", msg)
+        self.assertEqual(int(rows[1]['id']), self.book_1.pk, msg)
+        self.assertIn('creator_id', rows[0], msg)
+        # Test that the format is validated.
+        self.assertRaises(ValueError, export_collection, Book, stream,
+                          format='xml')
+
+    def test_export_jsonl(self):
+        """
+        Test that JSON lines are written and JSON storage is exported.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.cc.storage = ColumnCollection.JSON
+        self.cc.save()
+        book = self._create_dcolumn_record(Book, self.cc, title="Three")
+        book.set_key_values({'abstract': "JSON", 'author': self.author})
+        stream = StringIO()
+        count = export_collection(Book, stream, format='jsonl',
+                                  slugs=['abstract', 'author'],
+                                  choice_raw=True)
+        rows = [json.loads(line) for line in stream.getvalue().splitlines()]
+        msg = "rows: {}".format(rows)
+        self.assertEqual(count, 3, msg)
+        self.assertEqual(rows[2]['abstract'], "JSON", msg)
+        self.assertEqual(rows[2]['author'], self.author.pk, msg)
+        self.assertNotIn('edition', rows[2], msg)
+
+    def test_export_command(self):
+        """
+        Test that the command writes to stdout or a file.
+        """
+        #self.skipTest("Temporarily skipped")
+        out = StringIO()
+        err = StringIO()
+        call_command('dcolumn_export', 'book', slugs='edition', stdout=out,
+                     stderr=err)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(rows[0][-1], 'edition')
+        self.assertEqual([row[-1] for row in rows[1:]], ['2', '3'])
+        self.assertIn("Exported 2 book objects.", err.getvalue())
+        # Test that an invalid model raises.
+        with self.assertRaises(CommandError) as cm:
+            call_command('dcolumn_export', 'junk', stdout=out)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/tests/test_dcolumns_imports.py
+#
+# WARNING: These unittests can only be run from within the original test
+#          framework from https://github.com/cnobile2012/dcolumn.
+#
+
+import os
+import json
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError
+from django.test import TestCase
+
+from example_site.books.models import Book
+
+from ..export import export_collection
+from ..imports import import_collection, get_import_key
+from ..models import DynamicColumn, ColumnCollection, KeyValue, ImportProgress
+from .base_tests import BaseDcolumns
+
+
+class TestImport(BaseDcolumns, TestCase):
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.author, a_cc, a_values = self._create_author_objects()
+        dc0 = self._create_dynamic_column_record(
+            "Abstract", DynamicColumn.TEXT_BLOCK, 'book_top', 1)
+        dc1 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 2)
+        dc2 = self._create_dynamic_column_record(
+            "Author", DynamicColumn.CHOICE, 'book_top', 3,
+            relation=self.choice2index.get("Author"))
+        self.cc = self._create_column_collection_record(
+            "Book Current", 'book', dynamic_columns=[dc0, dc1, dc2])
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, lines):
+        path = os.path.join(self.tmp_dir, name)
+
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        return path
+
+    def test_import_export_round_trip(self):
+        """
+        Test that an export with raw choices imports the same objects.
+        """
+        #self.skipTest("Temporarily skipped")
+        book = self._create_dcolumn_record(Book, self.cc, title="One")
+        book.set_key_values({'abstract': "First", 'edition': 2,
+                             'author': self.author})
+        path = os.path.join(self.tmp_dir, 'books.csv')
+
+        with open(path, 'w', newline='') as f:
+            export_collection(Book, f, choice_raw=True)
+
+        Book.objects.all().delete()
+        count, errors = import_collection(Book, path, batch_size=1,
+                                          workers=0)
+        msg = "errors: {}".format(errors)
+        self.assertEqual(count, 1, msg)
+        self.assertEqual(errors, [], msg)
+        book = Book.objects.get()
+        self.assertEqual(book.title, "One")
+        self.assertEqual(book.creator, self.user)
+        self.assertEqual(book.get_key_value('abstract'), "First")
+        self.assertEqual(book.get_key_value('edition'), 2)
+        self.assertEqual(book.get_key_value('author'), self.author.name)
+        # Test that the typed fields are set.
+        self.assertEqual(KeyValue.objects.get(
+            collection=book, dynamic_column__slug='edition').value_int, 2)
+        self.assertFalse(ImportProgress.objects.exists())
+
+    def test_import_export_store_relation(self):
+        """
+        Test that an export with raw choices imports the stored value of a
+        store_relation CHOICE column unchanged.
+        """
+        #self.skipTest("Temporarily skipped")
+        promotion, p_cc, p_values = self._create_promotion_objects()
+        dc = self._create_dynamic_column_record(
+            "Promotion", DynamicColumn.CHOICE, 'book_top', 4,
+            relation=self.choice2index.get("Promotion"),
+            store_relation=DynamicColumn.YES)
+        self.cc.dynamic_column.add(dc)
+        book = self._create_dcolumn_record(Book, self.cc, title="One")
+        book.set_key_values({'edition': 2, 'promotion': promotion})
+        path = os.path.join(self.tmp_dir, 'books.csv')
+
+        with open(path, 'w', newline='') as f:
+            export_collection(Book, f, choice_raw=True)
+
+        Book.objects.all().delete()
+        count, errors = import_collection(Book, path, workers=0)
+        msg = "errors: {}".format(errors)
+        self.assertEqual(count, 1, msg)
+        self.assertEqual(errors, [], msg)
+        book = Book.objects.get()
+        self.assertEqual(book.get_key_value('promotion'), promotion.name)
+        self.assertEqual(book.get_key_value('edition'), 2)
+
+    def test_import_collection_lookup(self):
+        """
+        Test that the collection and its columns are found like the rest
+        of the manager, active only and in any case.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc = self._create_dynamic_column_record(
+            "Retired", DynamicColumn.TEXT, 'book_top', 5, active=False)
+        self.cc.dynamic_column.add(dc)
+        self.cc.related_model = 'Book'
+        self.cc.save()
+        path = self._write('books.jsonl', [
+            json.dumps({'title': "One", 'edition': 1}),
+            json.dumps({'title': "Two", 'retired': "old"}),
+            ])
+        count, errors = import_collection(Book, path, workers=0,
+                                          user=self.user)
+        msg = "errors: {}".format(errors)
+        self.assertEqual(count, 1, msg)
+        self.assertEqual([line for line, error in errors], [2], msg)
+        self.assertIn("retired", errors[0][1], msg)
+        # Test that an inactive collection is not found.
+        self.cc.active = False
+        self.cc.save()
+
+        with self.assertRaises(ValueError) as cm:
+            import_collection(Book, path, workers=0, user=self.user)
+
+    def test_import_invalid_and_resume(self):
+        """
+        Test that invalid rows are reported and that a run is resumed
+        after the rows already done.
+        """
+        #self.skipTest("Temporarily skipped")
+        path = self._write('books.jsonl', [
+            json.dumps({'title': "One", 'edition': 1}),
+            json.dumps({'title': "Two", 'edition': "abc"}),
+            json.dumps({'title': "Three", 'junk': 1}),
+            json.dumps({'title': "Four", 'edition': 'increment',
+                        'author': self.author.pk}),
+            ])
+
+        ImportProgress.objects.create(key=get_import_key(Book, path),
+                                      path=path, rows=1)
+
+        done = []
+        count, errors = import_collection(
+            Book, path, batch_size=2, workers=0, resume=True, user=self.user,
+            progress=lambda *args: done.append(args))
+        msg = "errors: {}".format(errors)
+        self.assertEqual(count, 1, msg)
+        self.assertEqual([line for line, error in errors], [2, 3], msg)
+        self.assertIn("junk", errors[1][1], msg)
+        self.assertEqual(done, [(3, 0, 2), (4, 1, 2)])
+        book = Book.objects.get()
+        self.assertEqual(book.title, "Four")
+        self.assertEqual(book.get_key_value('edition'), 1)
+        self.assertEqual(book.get_key_value('author', choice_raw=True),
+                         self.author.pk)
+        self.assertFalse(ImportProgress.objects.exists())
+
+    def test_import_progress_in_transaction(self):
+        """
+        Test that the resume point is committed with its batch, a failed
+        batch leaves the point after the last committed batch.
+        """
+        #self.skipTest("Temporarily skipped")
+        path = self._write('books.csv', ['title,edition', 'One,1', 'Two,2',
+                                         'Three,3'])
+        create = Book.objects.bulk_create_with_values
+        calls = []
+
+        def fail_second(rows, **kwargs):
+            calls.append(rows)
+
+            if len(calls) == 2:
+                raise IntegrityError("Failed")
+
+            return create(rows, **kwargs)
+
+        with mock.patch.object(Book.objects, 'bulk_create_with_values',
+                               side_effect=fail_second):
+            self.assertRaises(IntegrityError, import_collection, Book, path,
+                              batch_size=1, workers=0, user=self.user)
+
+        self.assertEqual(ImportProgress.objects.get().rows, 1)
+        self.assertEqual(Book.objects.count(), 1)
+        count, errors = import_collection(Book, path, batch_size=1,
+                                          workers=0, resume=True,
+                                          user=self.user)
+        self.assertEqual((count, errors), (2, []))
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)),
+                         ["One", "Three", "Two"])
+
+    def test_import_json_storage_workers(self):
+        """
+        Test that rows are converted in worker processes and that JSON
+        storage is written.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.cc.storage = ColumnCollection.JSON
+        self.cc.save()
+        path = self._write('books.csv', [
+            'title,abstract,edition', 'One,First,1', 'Two,,2'])
+        count, errors = import_collection(Book, path, batch_size=1,
+                                          workers=2, user=self.user)
+        self.assertEqual((count, errors), (2, []))
+        books = list(Book.objects.order_by('pk').with_key_values())
+        self.assertTrue(books[0].uses_json_storage)
+        self.assertEqual(books[0].get_key_value('abstract'), "First")
+        self.assertEqual(books[1].get_key_value('edition'), 2)
+        self.assertFalse(
+            KeyValue.objects.filter(collection__in=books).exists())
+
+    def test_import_command(self):
+        """
+        Test that the command reports progress and invalid rows.
+        """
+        #self.skipTest("Temporarily skipped")
+        path = self._write('books.csv', ['title,edition', 'One,1', 'Two,x'])
+        out = StringIO()
+        err = StringIO()
+        call_command('dcolumn_import', 'book', path, workers=0,
+                     user=self.user.username, stdout=out, stderr=err)
+        self.assertIn("Imported 1 book objects, 1 invalid rows.",
+                      out.getvalue())
+        self.assertIn("2 rows done", out.getvalue())
+        self.assertIn("Line 3:", err.getvalue())
+        # Test that an invalid user raises.
+        with self.assertRaises(CommandError) as cm:
+            call_command('dcolumn_import', 'book', path, user='nobody',
+                         stdout=out)
+
+        # Test that a failed batch is reported, the rows have no creator.
+        with self.assertRaises(CommandError) as cm:
+            call_command('dcolumn_import', 'book', path, workers=0,
+                         stdout=out, stderr=err)
+
+        self.assertIn("--resume", str(cm.exception))
@@ -75,7 +75,7 @@ class TestManager(BaseDcolumns, TestCase):
             methods.append(method)
 
         msg = "methods: {}".format(methods)
-        self.assertEqual(len(methods), 11, msg)
+        self.assertEqual(len(methods), 14, msg)
 
     def test_register_choice(self):
         """
@@ -316,6 +316,51 @@ class TestManager(BaseDcolumns, TestCase):
         msg = "state: {}".format(state)
         self.assertEqual(state, False, msg)
 
+    @override_settings()
+    def test_pivot_tables(self):
+        """
+        Test that the pivot table names are returned properly.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.assertEqual(self.manager.pivot_tables, [])
+        settings.DYNAMIC_COLUMNS = {'PIVOT_TABLES': ['Book']}
+        self.assertEqual(self.manager.pivot_tables, ['book'])
+        # Remove the DYNAMIC_COLUMNS settings
+        del settings.DYNAMIC_COLUMNS
+        self.assertEqual(self.manager.pivot_tables, [])
+
+    @override_settings()
+    def test_counter_buffer(self):
+        """
+        Test that the counter buffer settings are merged with the
+        defaults.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.assertEqual(self.manager.counter_buffer['SLUGS'], [])
+        settings.DYNAMIC_COLUMNS = {'COUNTER_BUFFER': {
+            'SLUGS': ['views'], 'BACKEND': 'cache'}}
+        result = self.manager.counter_buffer
+        self.assertEqual(result['SLUGS'], ['views'])
+        self.assertEqual(result['BACKEND'], 'cache')
+        self.assertEqual(result['MAX_PENDING'], 100)
+        # Remove the DYNAMIC_COLUMNS settings
+        del settings.DYNAMIC_COLUMNS
+        self.assertEqual(self.manager.counter_buffer['BACKEND'], 'memory')
+
+    def test_schema_cache(self):
+        """
+        Test that the schema cache settings are merged with the defaults.
+        """
+        #self.skipTest("Temporarily skipped")
+        self.assertEqual(self.manager.schema_cache['CACHE'], 'default')
+        settings.DYNAMIC_COLUMNS = {'SCHEMA_CACHE': {'TIMEOUT': 60}}
+        result = self.manager.schema_cache
+        self.assertEqual(result['CACHE'], 'default')
+        self.assertEqual(result['TIMEOUT'], 60)
+        # Remove the DYNAMIC_COLUMNS settings
+        del settings.DYNAMIC_COLUMNS
+        self.assertEqual(self.manager.schema_cache['TIMEOUT'], 86400)
+
     def test_get_related_object_names(self):
         """
         Test that the model list is returned.
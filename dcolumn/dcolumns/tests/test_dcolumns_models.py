@@ -8,15 +8,24 @@
 
 from datetime import (
     datetime, timedelta, timezone, date as dt_date, time as dt_time)
+from io import StringIO
 import dateutil
 
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Avg, Count, Max, Min, Sum
 from django.test import TestCase
 
 from example_site.books.choices import Language
 from example_site.books.models import Author, Book, Publisher, Promotion
 
 from ..models import DynamicColumn, ColumnCollection, KeyValue
+from ..choices import (
+    ValueCache, MISSING, get_value_cache, _request_started,
+    _request_finished)
+from ..counters import write_deltas
+from ..schema import bump_schema_version
 from .base_tests import BaseDcolumns
 
 
@@ -350,6 +359,44 @@ class TestColumnCollection(BaseDcolumns, TestCase):
             self.assertTrue(key in dict(result), msg)
             self.assertTrue(value in dict(result).values(), msg)
 
+    def test_schema_cache(self):
+        """
+        Test that the schema is read from the cache until it changes.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Author", DynamicColumn.CHOICE, 'book_top', 1,
+            relation=self.choice2index.get("Author"))
+        dc1 = self._create_dynamic_column_record(
+            "Abstract", DynamicColumn.TEXT_BLOCK, 'book_top', 3)
+        cc0 = self._create_column_collection_record(
+            "Books", 'book', dynamic_columns=[dc0])
+        ColumnCollection.objects.serialize_columns('book')
+        DynamicColumn.objects.get_fk_slugs()
+        # Test that cached reads are not queries.
+        with self.assertNumQueries(0):
+            result = ColumnCollection.objects.serialize_columns('book')
+            items = ColumnCollection.objects.get_active_relation_items('book')
+            fk_slugs = DynamicColumn.objects.get_fk_slugs()
+            columns = ColumnCollection.objects.get_column_collection('book')
+
+        # Test that the columns are a query set that can be chained.
+        self.assertEqual(list(columns.values_list('pk', flat=True)),
+                         [dc0.pk])
+        self.assertEqual(list(result), [dc0.pk])
+        self.assertEqual(items, ['Author'])
+        self.assertEqual(fk_slugs, {'Author': 'author'})
+        # Test that a change to the collection is seen.
+        cc0.dynamic_column.add(dc1)
+        result = ColumnCollection.objects.serialize_columns('book')
+        self.assertEqual(list(result), [dc0.pk, dc1.pk])
+        # Test that a bump from another process is seen.
+        ColumnCollection.objects.filter(pk=cc0.pk).update(active=False)
+
+        with self.assertRaises(ColumnCollection.DoesNotExist) as cm:
+            bump_schema_version()
+            ColumnCollection.objects.get_column_collection('book')
+
 
 class TestCollectionBase(BaseDcolumns, TestCase):
 
@@ -453,6 +500,47 @@ class TestCollectionBase(BaseDcolumns, TestCase):
         with self.assertRaises(AttributeError) as cm:
             Book.objects.get_value_by_pk(book.pk, 'bad_field')
 
+    def test_get_value_by_pk_cache(self):
+        """
+        Test that values are cached until the object is saved or deleted.
+        """
+        #self.skipTest("Temporarily skipped")
+        author, a_cc, a_values = self._create_author_objects()
+        get_value_cache(Author).clear()
+        Author.objects.get_value_by_pk(author.pk, 'name')
+
+        with self.assertNumQueries(0):
+            result = Author.objects.get_value_by_pk(str(author.pk), 'name')
+
+        self.assertEqual(result, author.name)
+        info = Author.objects.value_cache_info()
+        msg = "info: {}".format(info)
+        self.assertEqual(info['hits'], 1, msg)
+        self.assertEqual(info['misses'], 1, msg)
+        self.assertEqual(info['size'], 1, msg)
+        # Test that a save evicts the value.
+        author.name = "Another Name"
+        author.save()
+        result = Author.objects.get_value_by_pk(author.pk, 'name')
+        self.assertEqual(result, "Another Name")
+        # Test that a delete evicts the value.
+        pk = author.pk
+        author.delete()
+
+        with self.assertRaises(Author.DoesNotExist) as cm:
+            Author.objects.get_value_by_pk(pk, 'name')
+
+        # Test that the least recently used value is discarded.
+        cache = ValueCache(maxsize=2)
+
+        for pk in (1, 2, 1, 3):
+            if cache.get((pk, 'name')) is MISSING:
+                cache.set((pk, 'name'), pk)
+
+        self.assertEqual(cache.get((2, 'name')), MISSING)
+        self.assertEqual(cache.get((1, 'name')), 1)
+        self.assertEqual(cache.info()['size'], 2)
+
     def test_get_all_slugs(self):
         """
         Test that all dynamic column slugs are returned in a list.
@@ -499,6 +587,118 @@ class TestCollectionBase(BaseDcolumns, TestCase):
         msg = "result: {}, b_values: {}".format(result, b_values)
         self.assertEqual(len(result), 10, msg)
 
+    def test_get_all_slugs_cache(self):
+        """
+        Test that the slugs come from the collection, even without any
+        objects, and are cached until the collection changes.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Abstract", DynamicColumn.TEXT_BLOCK, 'book_top', 1)
+        dc1 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 2)
+        cc = self._create_column_collection_record(
+            "Books", 'book', dynamic_columns=[dc1, dc0])
+        self.assertEqual(Book.objects.get_all_slugs(), ['abstract', 'edition'])
+        fields = Book.objects.get_all_fields()
+        Book.objects.get_all_fields_and_slugs()
+        # Test that cached calls are not queries.
+        with self.assertNumQueries(0):
+            result = Book.objects.get_all_fields_and_slugs()
+            self.assertEqual(Book.objects.get_all_slugs(),
+                             ['abstract', 'edition'])
+
+        self.assertEqual(result, sorted(fields + ['abstract', 'edition']))
+        # Test that a change to the collection is seen.
+        cc.dynamic_column.remove(dc1)
+        self.assertEqual(Book.objects.get_all_slugs(), ['abstract'])
+        self.assertNotIn('edition', Book.objects.get_all_fields_and_slugs())
+
+    def test_bulk_create_with_values(self):
+        """
+        Test that objects, their child rows and their values are inserted
+        in a constant number of queries.
+        """
+        #self.skipTest("Temporarily skipped")
+        author, a_cc, a_values = self._create_author_objects()
+        dc0 = self._create_dynamic_column_record(
+            "Abstract", DynamicColumn.TEXT_BLOCK, 'book_top', 1)
+        dc1 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 2)
+        dc2 = self._create_dynamic_column_record(
+            "Author", DynamicColumn.CHOICE, 'book_top', 3,
+            relation=self.choice2index.get("Author"))
+        cc = self._create_column_collection_record(
+            "Book Current", 'book', dynamic_columns=[dc0, dc1, dc2])
+        user = {'creator': self.user, 'updater': self.user}
+        rows = [(dict(title="Book {}".format(i), **user),
+                 {'abstract': "Abstract {}".format(i), 'edition': i + 1,
+                  'author': author})
+                for i in range(5)]
+        rows.append((dict(title="Empty", **user), {'abstract': ''}))
+        Book.objects.get_all_slugs()
+        Book.objects.bulk_create_with_values(rows[:1])
+
+        # The collection, the savepoint, the parents, the children, the
+        # KeyValues and the savepoint release.
+        with self.assertNumQueries(6):
+            books = Book.objects.bulk_create_with_values(rows[1:])
+
+        msg = "books: {}".format(books)
+        self.assertEqual(len(books), 5, msg)
+        self.assertEqual(Book.objects.count(), 6, msg)
+        self.assertTrue(all(book.pk for book in books), msg)
+        self.assertEqual([book.pk for book in books],
+                         [book.id for book in books], msg)
+        # Test that the objects are saved and their values cached.
+        with self.assertNumQueries(0):
+            self.assertEqual(books[0].get_key_value('edition'), 2)
+            self.assertEqual(books[-1].get_key_value('abstract'), '')
+
+        book = Book.objects.get(pk=books[1].pk)
+        self.assertEqual(book.title, "Book 2", msg)
+        self.assertEqual(book.column_collection, cc, msg)
+        self.assertEqual(book.get_key_value('abstract'), "Abstract 2", msg)
+        self.assertEqual(book.get_key_value('author'), author.name, msg)
+        self.assertEqual(KeyValue.objects.get(
+            collection=book, dynamic_column=dc1).value_int, 3, msg)
+        self.assertEqual(KeyValue.objects.filter(
+            collection__in=books).count(), 12, msg)
+
+    def test_bulk_create_with_values_json(self):
+        """
+        Test that JSON storage is written and that nothing is written when
+        a value is invalid.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 1)
+        cc = self._create_column_collection_record(
+            "Book Current", 'book', dynamic_columns=[dc0])
+        cc.storage = ColumnCollection.JSON
+        cc.save()
+        user = {'creator': self.user, 'updater': self.user}
+        books = Book.objects.bulk_create_with_values([
+            (dict(title="One", **user), {'edition': 1}),
+            (dict(title="Two", **user), {'edition': 'increment'}),
+            ])
+        books = list(Book.objects.order_by('pk').with_key_values())
+        msg = "books: {}".format(books)
+        self.assertTrue(books[0].uses_json_storage, msg)
+        self.assertEqual(books[0].get_key_value('edition'), 1, msg)
+        self.assertEqual(books[1].get_key_value('edition'), 1, msg)
+        self.assertFalse(KeyValue.objects.exists(), msg)
+        # Test that invalid values and slugs raise before any insert.
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.bulk_create_with_values([
+                (dict(title="Three", **user), {'edition': 2}),
+                (dict(title="Four", **user), {'edition': "abc"}),
+                ])
+
+        self.assertRaises(ValueError, Book.objects.bulk_create_with_values,
+                          [(dict(title="Five", **user), {'junk': 1})])
+        self.assertEqual(Book.objects.count(), 2, msg)
+
     def test_serialize_key_values(self):
         """
         Test that the key values get serialized in a dict.
@@ -515,8 +715,17 @@ class TestCollectionBase(BaseDcolumns, TestCase):
             self.assertEqual(value, b_values.get(key), msg)
 
         self.assertEqual(len(result), len(b_values), msg)
+        # Test that the KeyValues are fetched and decoded in one query.
+        book = Book.objects.get(pk=book.pk)
+
+        with self.assertNumQueries(1):
+            result = book.serialize_key_values()
+
+        msg = "result: {}, b_values: {}".format(result, b_values)
+        self.assertEqual(len(result), len(b_values), msg)
 
-        # TODO Add test for by_slug.
+        for dc in b_cc.dynamic_column.all():
+            self.assertEqual(result.get(dc.pk), b_values.get(dc.slug), msg)
 
     def test_get_dynamic_column(self):
         """
@@ -530,6 +739,40 @@ class TestCollectionBase(BaseDcolumns, TestCase):
         self.assertEqual(obj.name, 'Abstract', msg)
         self.assertEqual(obj.value_type, DynamicColumn.TEXT_BLOCK, msg)
 
+    def test_get_dynamic_column_cache(self):
+        """
+        Test that the cached columns follow changes to the schema.
+        """
+        #self.skipTest("Temporarily skipped")
+        book, b_cc, b_values = self._create_book_objects()
+        book.get_dynamic_column('abstract')
+        # Test that a cached column is not a query.
+        with self.assertNumQueries(0):
+            book.get_dynamic_column('abstract')
+
+        # Test that a new column is found.
+        self.assertEqual(book.get_dynamic_column('isbn'), None)
+        dc = self._create_dynamic_column_record(
+            "ISBN", DynamicColumn.TEXT, 'book_center', 20)
+        b_cc.dynamic_column.add(dc)
+        self.assertEqual(book.get_dynamic_column('isbn'), dc)
+        # Test that a changed column is found.
+        dc.order = 21
+        dc.save()
+        self.assertEqual(book.get_dynamic_column('isbn').order, 21)
+        # Test that a removed column is gone.
+        b_cc.dynamic_column.remove(dc)
+        self.assertEqual(book.get_dynamic_column('isbn'), None)
+        # Test that a slug used twice in the collection is an error.
+        dc_0 = self._create_dynamic_column_record(
+            "ISBN", DynamicColumn.TEXT, 'book_center', 22)
+        dc_1 = self._create_dynamic_column_record(
+            "ISBN", DynamicColumn.TEXT, 'book_center', 23)
+        b_cc.dynamic_column.add(dc_0, dc_1)
+
+        with self.assertRaises(DynamicColumn.MultipleObjectsReturned) as cm:
+            book.get_dynamic_column('isbn')
+
     def test_get_key_value(self):
         """
         Check that all the possible combinations of this method work
@@ -700,6 +943,132 @@ class TestCollectionBase(BaseDcolumns, TestCase):
             a_value = Promotion.objects.get_value_by_pk(promotion.pk,
                                                         'unknown')
 
+    def test_with_key_values(self):
+        """
+        Test that the KeyValue objects for a queryset are loaded in one
+        query and that get_key_value is served from memory.
+        """
+        #self.skipTest("Temporarily skipped")
+        promotion, p_cc, p_values = self._create_promotion_objects()
+        book, b_cc, b_values = self._create_book_objects(
+            promotion=promotion)
+        self._create_dcolumn_record(Book, b_cc, title="Second Book")
+
+        # One query for the books and one for all their KeyValues.
+        with self.assertNumQueries(2):
+            books = list(Book.objects.with_key_values())
+
+        with self.assertNumQueries(0):
+            values = [(obj.get_key_value('abstract'),
+                       obj.get_key_value('promotion')) for obj in books]
+
+        msg = "values: {}, b_values: {}".format(values, b_values)
+        self.assertEqual(values[1], (b_values.get('abstract'),
+                                     b_values.get('promotion')), msg)
+        self.assertEqual(values[0], ('', ''), msg)
+        # Test that slugs not loaded are still found in the database.
+        books = list(Book.objects.filter(pk=book.pk).with_key_values(
+            slugs=['abstract']))
+
+        with self.assertNumQueries(0):
+            value = books[0].get_key_value('abstract')
+
+        self.assertEqual(value, b_values.get('abstract'))
+
+        with self.assertNumQueries(1):
+            value = books[0].get_key_value('promotion')
+
+        self.assertEqual(value, b_values.get('promotion'))
+
+    def test_with_key_values_choices(self):
+        """
+        Test that the CHOICE values of a page are resolved with one query
+        per choice model and kept for the rest of the request.
+        """
+        #self.skipTest("Temporarily skipped")
+        author, a_cc, a_values = self._create_author_objects()
+        publisher, p_cc, p_values = self._create_publisher_objects()
+        book, b_cc, b_values = self._create_book_objects(
+            author=author, publisher=publisher)
+        author_1 = self._create_dcolumn_record(
+            Author, a_cc, name="Second Author")
+        book_1 = self._create_dcolumn_record(Book, b_cc, title="Second Book")
+        book_1.set_key_values({'author': author_1, 'publisher': publisher})
+        books = list(Book.objects.order_by('pk').with_key_values())
+
+        # One query for the authors and one for the publishers.
+        with self.assertNumQueries(2):
+            values = [(obj.get_key_value('author'),
+                       obj.get_key_value('publisher')) for obj in books]
+
+        self.assertEqual(values, [(author.name, publisher.name),
+                                  (author_1.name, publisher.name)])
+        # Test that a single object resolves all its choices at once.
+        book = Book.objects.get(pk=book.pk)
+        get_value_cache(Author).clear()
+        get_value_cache(Publisher).clear()
+
+        with self.assertNumQueries(3):
+            self.assertEqual(book.get_key_value('author'), author.name)
+            self.assertEqual(book.get_key_value('publisher'),
+                             publisher.name)
+
+        # Test that the objects are kept for the rest of the request.
+        _request_started(self.__class__)
+
+        try:
+            queryset = Book.objects.order_by('pk').with_key_values()
+            get_value_cache(Author).clear()
+            list(queryset)[0].get_key_value('author')
+            get_value_cache(Author).clear()
+            books = list(queryset.all())
+
+            with self.assertNumQueries(0):
+                self.assertEqual(books[1].get_key_value('author'),
+                                 author_1.name)
+        finally:
+            _request_finished(self.__class__)
+
+        # Test that a missing object still raises.
+        Author.objects.filter(pk=author_1.pk).delete()
+        books = list(Book.objects.order_by('pk').with_key_values())
+
+        with self.assertRaises(Author.DoesNotExist) as cm:
+            books[1].get_key_value('author')
+
+    def test_get_key_value_cache(self):
+        """
+        Test that the KeyValue objects are loaded once per instance and
+        that the cache follows set_key_value.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 6)
+        book, b_cc, b_values = self._create_book_objects(extra_dcs=[dc0])
+        book.set_key_value('edition', 2)
+        book = Book.objects.get(pk=book.pk)
+
+        # The first access loads all KeyValues, then all are in memory.
+        with self.assertNumQueries(1):
+            for i in range(3):
+                abstract = book.get_key_value('abstract')
+                edition = book.get_key_value('edition')
+
+        self.assertEqual(abstract, b_values.get('abstract'))
+        self.assertEqual(edition, 2)
+        # Test that set_key_value updates the cache.
+        book.set_key_value('edition', 3)
+
+        with self.assertNumQueries(0):
+            edition = book.get_key_value('edition')
+
+        self.assertEqual(edition, 3)
+        # Test that refresh_from_db discards the cache.
+        KeyValue.objects.filter(collection=book, dynamic_column=dc0).update(
+            value='4')
+        book.refresh_from_db()
+        self.assertEqual(book.get_key_value('edition'), 4)
+
     def _create_test_objects(self):
         # Add a few columns to author, promotion, and book.
         language = Language.objects.model_objects()[3] # Russian
@@ -738,6 +1107,168 @@ class TestCollectionBase(BaseDcolumns, TestCase):
         return (book, b_values, author, a_values, new_author, promotion,
                 p_values, new_promotion, language)
 
+    def test_filter_dcolumns(self):
+        """
+        Check that objects are filtered on their KeyValue values in the
+        database.
+        """
+        #self.skipTest("Temporarily skipped")
+        # Get the test objects
+        (book, b_values, author, a_values, new_author, promotion, p_values,
+         new_promotion, language) = self._create_test_objects()
+        book.set_key_values({'edition': 2, 'ignore': True,
+                             'percentage': 20.5})
+        book_1 = self._create_dcolumn_record(
+            Book, book.column_collection, title="Another Book")
+        book_1.set_key_values({'edition': 10, 'ignore': False,
+                               'author': new_author})
+        # Test a numeric range lookup.
+        found = Book.objects.filter_dcolumns(edition__gte=2)
+        self.assertEqual(set(found), {book, book_1})
+        found = Book.objects.filter_dcolumns(edition__gt=2)
+        self.assertEqual(list(found), [book_1])
+        # Test several lookups together with a normal filter.
+        found = Book.objects.filter(title__startswith='Test').filter_dcolumns(
+            edition__lt=5, ignore=True, percentage__range=(20, 21))
+        self.assertEqual(list(found), [book])
+        # Test CHOICE objects and pks.
+        self.assertEqual(list(Book.objects.filter_dcolumns(
+            author=new_author)), [book_1])
+        self.assertEqual(list(Book.objects.filter_dcolumns(
+            language=language.pk)), [book])
+        self.assertEqual(list(Book.objects.filter_dcolumns(
+            language__isnull=True)), [book_1])
+        # Test text lookups.
+        self.assertEqual(list(Book.objects.filter_dcolumns(
+            abstract__icontains='SHORT')), [book])
+        # Test that there is one query for the columns and one filter query.
+        with self.assertNumQueries(2):
+            list(Book.objects.filter_dcolumns(edition=10, ignore='no'))
+
+        # Test an unknown slug and an invalid value.
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.filter_dcolumns(bad_slug=1)
+
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.filter_dcolumns(edition='junk')
+
+        # Test that a collection with JSON storage is not queried.
+        cc = book.column_collection
+        cc.storage = ColumnCollection.JSON
+        cc.save()
+        book_2 = self._create_dcolumn_record(Book, cc, title="JSON Book")
+        book_2.set_key_value('edition', 5)
+
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.filter_dcolumns(edition=5)
+
+    def test_annotate_dcolumn(self):
+        """
+        Check that objects are annotated and ordered by their KeyValue
+        values in the database.
+        """
+        #self.skipTest("Temporarily skipped")
+        # Get the test objects
+        (book, b_values, author, a_values, new_author, promotion, p_values,
+         new_promotion, language) = self._create_test_objects()
+        book.set_key_value('edition', 5)
+        book_1 = self._create_dcolumn_record(
+            Book, book.column_collection, title="Another Book")
+        book_1.set_key_value('edition', 10)
+        book_2 = self._create_dcolumn_record(
+            Book, book.column_collection, title="No Edition")
+        # Test the annotation and its type.
+        found = Book.objects.annotate_dcolumn('edition', alias='ed').order_by(
+            'title').values_list('title', 'ed')
+        self.assertEqual(list(found), [("Another Book", 10),
+                                       ("No Edition", None),
+                                       ("Test Book", 5)])
+        found = Book.objects.annotate_dcolumn('percentage').get(pk=book.pk)
+        self.assertEqual(found.percentage, 20.5)
+        # Test ordering both ways.
+        found = Book.objects.filter_dcolumns(
+            edition__isnull=False).order_by_dcolumn('edition')
+        self.assertEqual(list(found), [book, book_1])
+        found = Book.objects.filter_dcolumns(
+            edition__isnull=False).order_by_dcolumn('-edition')
+        self.assertEqual(list(found), [book_1, book])
+        # Test that slicing for a page is done in the database.
+        with self.assertNumQueries(2):
+            self.assertEqual(len(Book.objects.order_by_dcolumn(
+                '-edition', 'abstract')[:2]), 2)
+
+        # Test an unknown slug.
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.order_by_dcolumn('bad_slug')
+
+        # Test that a collection with JSON storage is not queried.
+        cc = book.column_collection
+        cc.storage = ColumnCollection.JSON
+        cc.save()
+        book_3 = self._create_dcolumn_record(Book, cc, title="JSON Book")
+        book_3.set_key_value('edition', 5)
+
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.annotate_dcolumn('edition')
+
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.order_by_dcolumn('edition')
+
+    def test_aggregate_dcolumn(self):
+        """
+        Check that KeyValue values are aggregated in the database.
+        """
+        #self.skipTest("Temporarily skipped")
+        # Get the test objects
+        (book, b_values, author, a_values, new_author, promotion, p_values,
+         new_promotion, language) = self._create_test_objects()
+        book.set_key_values({'edition': 4, 'author': author})
+        book_1 = self._create_dcolumn_record(
+            Book, book.column_collection, title="Another Book")
+        book_1.set_key_values({'edition': 10, 'author': new_author})
+        book_2 = self._create_dcolumn_record(
+            Book, book.column_collection, title="Third Book")
+        book_2.set_key_values({'edition': 6, 'author': new_author})
+
+        with self.assertNumQueries(2):
+            result = Book.objects.aggregate_dcolumn(
+                'edition', Sum, Avg, Min, Max, Count)
+
+        self.assertEqual(result, {
+            'edition__sum': 20, 'edition__avg': 20 / 3, 'edition__min': 4,
+            'edition__max': 10, 'edition__count': 3})
+        # Test that the queryset filters are used.
+        result = Book.objects.exclude(pk=book.pk).aggregate_dcolumn(
+            'edition', Sum)
+        self.assertEqual(result, {'edition__sum': 16})
+        # Test grouping by a CHOICE column.
+        book_3 = self._create_dcolumn_record(
+            Book, book.column_collection, title="No Author")
+        book_3.set_key_value('edition', 1)
+        result = Book.objects.aggregate_dcolumn(
+            'edition', Sum, Count, group_by='author')
+        self.assertEqual(result, {
+            author.pk: {'edition__sum': 4, 'edition__count': 1},
+            new_author.pk: {'edition__sum': 16, 'edition__count': 2},
+            None: {'edition__sum': 1, 'edition__count': 1}})
+
+        # Test invalid aggregates.
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.aggregate_dcolumn('edition')
+
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.aggregate_dcolumn('edition', 'Sum')
+
+        # Test that a collection with JSON storage is not queried.
+        cc = book.column_collection
+        cc.storage = ColumnCollection.JSON
+        cc.save()
+        book_4 = self._create_dcolumn_record(Book, cc, title="JSON Book")
+        book_4.set_key_value('edition', 5)
+
+        with self.assertRaises(ValueError) as cm:
+            Book.objects.aggregate_dcolumn('edition', Sum)
+
     def test_set_key_value_exceptions(self):
         """
         Check that exceptions are raised correctly.
@@ -959,6 +1490,21 @@ class TestCollectionBase(BaseDcolumns, TestCase):
         msg = "Initial value: {}, found_value: {}, float: {}".format(
             b_values.get(slug), found_value, value)
         self.assertEqual(found_value, float(value), msg)
+        # Test signed, exponent and padded string values.
+        for value, expect in (('-2.5', -2.5), ('1e-5', 0.00001),
+                              (' 2.5', 2.5), ('-3', -3.0)):
+            book.set_key_value(slug, value)
+            found_value = book.get_key_value(slug)
+            msg = "Value: {}, found_value: {}".format(value, found_value)
+            self.assertEqual(found_value, expect, msg)
+            kv = KeyValue.objects.get(collection=book,
+                                      dynamic_column__slug=slug)
+            self.assertEqual(kv.value, KeyValue.float_string(expect), msg)
+
+        # Test that infinity and strings that are not numbers are invalid.
+        for value in (float('inf'), 'inf', 'nan', '2.5.1', 'junk'):
+            with self.assertRaises(ValueError) as cm:
+                book.set_key_value(slug, value)
         # Test FLOAT with string value.
         value = 30
         book.set_key_value(slug, value)
@@ -1007,6 +1553,302 @@ class TestCollectionBase(BaseDcolumns, TestCase):
             b_values.get(slug), found_value, 1)
         self.assertEqual(found_value, 1, msg)
 
+    def test_add(self):
+        """
+        Check that add and increment/decrement are atomic updates that
+        return the new value.
+        """
+        #self.skipTest("Temporarily skipped")
+        # Get the test objects
+        (book, b_values, author, a_values, new_author, promotion, p_values,
+         new_promotion, language) = self._create_test_objects()
+        # Test that a missing value counts as zero.
+        KeyValue.objects.filter(collection=book,
+                                dynamic_column__slug='edition').delete()
+        book.refresh_from_db()
+        book.set_key_value('edition', 'decrement')
+        self.assertEqual(book.get_key_value('edition'), -1)
+        book.set_key_value('edition', 'increment')
+        self.assertEqual(book.get_key_value('edition'), 0)
+        # Test that an existing value is one statement after the row lock.
+        with self.assertNumQueries(2):
+            value = book.add('edition', 5)
+
+        self.assertEqual(value, 5)
+        # Test that a stale instance does not lose updates.
+        stale = Book.objects.get(pk=book.pk)
+        stale.get_key_value('edition')
+        book.add('edition', 10)
+        self.assertEqual(stale.add('edition', -3), 12)
+        kv = KeyValue.objects.get(collection=book,
+                                  dynamic_column__slug='edition')
+        self.assertEqual((kv.value, kv.value_int), ('12', 12))
+        self.assertEqual(stale.get_key_value('edition'), 12)
+        # Test that a row without its typed value, as written before it
+        # existed, adds to the text value.
+        KeyValue.objects.filter(pk=kv.pk).update(value='42', value_int=None)
+        self.assertEqual(book.add('edition', 1), 43)
+        write_deltas({(book.pk, kv.dynamic_column_id): 2})
+        KeyValue.objects.filter(pk=kv.pk).update(value_int=None)
+        write_deltas({(book.pk, kv.dynamic_column_id): 3})
+        kv = KeyValue.objects.get(pk=kv.pk)
+        self.assertEqual((kv.value, kv.value_int), ('48', 48))
+        # Test that a non-numeric value counts as zero.
+        KeyValue.objects.filter(pk=kv.pk).update(value='abc', value_int=None)
+        self.assertEqual(book.add('edition', 1), 1)
+        # Test invalid arguments.
+        self.assertRaises(ValueError, book.add, 'abstract', 1)
+        self.assertRaises(ValueError, book.add, 'edition', '1')
+
+    def test_set_key_values(self):
+        """
+        Check that many values are validated and written in a batch.
+        """
+        #self.skipTest("Temporarily skipped")
+        # Get the test objects
+        (book, b_values, author, a_values, new_author, promotion, p_values,
+         new_promotion, language) = self._create_test_objects()
+        book = Book.objects.get(pk=book.pk)
+        mapping = {'abstract': "A batched abstract", 'edition': 3,
+                   'ignore': True, 'author': new_author,
+                   'web_site': "www.example.org"}
+        # Test that an invalid value raises and nothing is written.
+        with self.assertRaises(ValueError) as cm:
+            book.set_key_values(dict(mapping, percentage='bad-float'))
+
+        self.assertEqual(book.get_key_value('edition'), 0)
+        # Test that an unknown slug raises.
+        with self.assertRaises(ValueError) as cm:
+            book.set_key_values(dict(mapping, bad_slug='junk'))
+
+        # One query for the KeyValues, the row lock, one upsert, the new
+        # pks and one update, the columns are cached.
+        book = Book.objects.get(pk=book.pk)
+
+        with self.assertNumQueries(5):
+            book.set_key_values(mapping)
+
+        book = Book.objects.get(pk=book.pk)
+        self.assertEqual(book.get_key_value('abstract'), mapping['abstract'])
+        self.assertEqual(book.get_key_value('edition'), 3)
+        self.assertEqual(book.get_key_value('ignore'), True)
+        self.assertEqual(book.get_key_value('author'), new_author.name)
+        self.assertEqual(book.get_key_value('web_site'), mapping['web_site'])
+        # Test that deferred values are written by save_deferred.
+        book.set_key_values({'edition': 'increment'}, defer=True)
+        book.save_deferred()
+        book = Book.objects.get(pk=book.pk)
+        self.assertEqual(book.get_key_value('edition'), 4)
+
+    def test_save_deferred(self):
+        """
+        Check that deferred values are flushed in one batch.
+        """
+        #self.skipTest("Temporarily skipped")
+        # Get the test objects
+        (book, b_values, author, a_values, new_author, promotion, p_values,
+         new_promotion, language) = self._create_test_objects()
+        book = Book.objects.get(pk=book.pk)
+        book.set_key_value('abstract', "A deferred abstract", defer=True)
+        book.set_key_value('edition', 2, defer=True)
+        book.set_key_value('edition', 5, defer=True)
+        book.set_key_value('web_site', "www.example.org", defer=True)
+
+        # The row lock, one upsert, the new pks and one update.
+        with self.assertNumQueries(4):
+            book.save_deferred()
+
+        # Test that the buffer was emptied.
+        with self.assertNumQueries(0):
+            book.save_deferred()
+
+        book = Book.objects.get(pk=book.pk)
+        self.assertEqual(book.get_key_value('abstract'), "A deferred abstract")
+        self.assertEqual(book.get_key_value('edition'), 5)
+        self.assertEqual(book.get_key_value('web_site'), "www.example.org")
+        self.assertEqual(KeyValue.objects.filter(
+            collection=book, dynamic_column__slug='web_site').count(), 1)
+
+    def test_set_key_value_upsert(self):
+        """
+        Check that writes from stale instances do not create duplicate
+        KeyValue objects.
+        """
+        #self.skipTest("Temporarily skipped")
+        # Get the test objects
+        (book, b_values, author, a_values, new_author, promotion, p_values,
+         new_promotion, language) = self._create_test_objects()
+        book_0 = Book.objects.get(pk=book.pk)
+        book_1 = Book.objects.get(pk=book.pk)
+        # Load both caches before either instance writes.
+        book_0.get_key_value('abstract')
+        book_1.get_key_value('abstract')
+        book_0.set_key_value('web_site', "www.example.org")
+        book_1.set_key_value('web_site', "www.example.com")
+        queryset = KeyValue.objects.filter(
+            collection=book, dynamic_column__slug='web_site')
+        self.assertEqual(queryset.count(), 1)
+        self.assertEqual(queryset[0].value, "www.example.com")
+        # Test that the written object got its pk.
+        self.assertEqual(book_1._get_cached_key_value('web_site').pk,
+                         queryset[0].pk)
+        # Test that a write is one statement after the row lock, the
+        # column is cached.
+        with self.assertNumQueries(2):
+            book_1.set_key_value('web_site', "www.example.net")
+
+        # Test that a duplicate is rejected.
+        with self.assertRaises(ValidationError) as cm:
+            KeyValue.objects.create(
+                collection=book, dynamic_column=queryset[0].dynamic_column,
+                value="www.example.edu")
+
+    def test_json_storage(self):
+        """
+        Check that values stored in the JSON document work the same as
+        KeyValue rows.
+        """
+        #self.skipTest("Temporarily skipped")
+        author, a_cc, a_values = self._create_author_objects()
+        dc0 = self._create_dynamic_column_record(
+            "Abstract", DynamicColumn.TEXT_BLOCK, 'book_top', 1)
+        dc1 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 2)
+        dc2 = self._create_dynamic_column_record(
+            "Author", DynamicColumn.CHOICE, 'book_top', 3,
+            relation=self.choice2index.get("Author"))
+        cc = self._create_column_collection_record(
+            "Book Current", 'book', dynamic_columns=[dc0, dc1, dc2])
+        cc.storage = ColumnCollection.JSON
+        cc.save()
+        book = self._create_dcolumn_record(Book, cc, title="JSON Book")
+        self.assertTrue(book.uses_json_storage)
+        # Test that a write is one statement.
+        book.get_key_value('abstract')
+
+        with self.assertNumQueries(2):
+            book.set_key_value('abstract', "A JSON abstract")
+
+        book.set_key_values({'edition': 2, 'author': author})
+        book.set_key_value('edition', 'increment')
+        self.assertEqual(KeyValue.objects.filter(collection=book).count(), 0)
+        # Test that a fresh instance reads the values with one query.
+        book = Book.objects.get(pk=book.pk)
+
+        with self.assertNumQueries(1):
+            result = book.serialize_key_values(by_slug=True)
+
+        self.assertEqual(result, {'abstract': "A JSON abstract",
+                                  'edition': 3, 'author': author.pk})
+        self.assertEqual(book.get_key_value('author'), author.name)
+        self.assertEqual(book.json_values, {
+            str(dc0.pk): "A JSON abstract", str(dc1.pk): '3',
+            str(dc2.pk): str(author.pk)})
+        # Test that a list loads the values of both storages.
+        cc.storage = ColumnCollection.KEY_VALUE
+        cc.save()
+        book_1 = self._create_dcolumn_record(Book, cc, title="EAV Book")
+        book_1.set_key_value('edition', 7)
+        self.assertFalse(book_1.uses_json_storage)
+
+        with self.assertNumQueries(3):
+            books = list(Book.objects.with_key_values().order_by('title'))
+            self.assertEqual([obj.get_key_value('edition') for obj in books],
+                             [7, 3])
+
+    def test_migrate_storage(self):
+        """
+        Check that the values of a collection are moved between storage
+        engines by the dcolumn_migrate_storage command.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Abstract", DynamicColumn.TEXT_BLOCK, 'book_top', 1)
+        dc1 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 2)
+        cc = self._create_column_collection_record(
+            "Book Current", 'book', dynamic_columns=[dc0, dc1])
+        book_0 = self._create_dcolumn_record(Book, cc, title="Book 0")
+        book_0.set_key_values({'abstract': "Abstract 0", 'edition': 1})
+        book_1 = self._create_dcolumn_record(Book, cc, title="Book 1")
+        book_1.set_key_value('edition', 2)
+        # Test moving to the JSON storage.
+        out = StringIO()
+        call_command('dcolumn_migrate_storage', 'book', 'json',
+                     chunk_size=1, stdout=out)
+        self.assertIn("Moved 2 objects", out.getvalue())
+        self.assertEqual(KeyValue.objects.count(), 0)
+        self.assertEqual(ColumnCollection.objects.get(pk=cc.pk).storage,
+                         ColumnCollection.JSON)
+        book_0 = Book.objects.get(pk=book_0.pk)
+        self.assertTrue(book_0.uses_json_storage)
+        self.assertEqual(book_0.serialize_key_values(by_slug=True),
+                         {'abstract': "Abstract 0", 'edition': 1})
+        # Test that a second run skips the moved objects.
+        out = StringIO()
+        call_command('dcolumn_migrate_storage', 'book', 'json', stdout=out)
+        self.assertIn("Moved 0 objects", out.getvalue())
+        # Test moving back to KeyValue rows with their typed values.
+        call_command('dcolumn_migrate_storage', 'book', 'key_value',
+                     stdout=StringIO())
+        book_1 = Book.objects.get(pk=book_1.pk)
+        self.assertFalse(book_1.uses_json_storage)
+        self.assertEqual(book_1.get_key_value('edition'), 2)
+        self.assertEqual(list(KeyValue.objects.filter(
+            dynamic_column=dc1).order_by('collection').values_list(
+                'value_int', flat=True)), [1, 2])
+        # Test invalid arguments.
+        self.assertRaises(CommandError, call_command,
+                          'dcolumn_migrate_storage', 'book', 'xml')
+        self.assertRaises(CommandError, call_command,
+                          'dcolumn_migrate_storage', 'nothing', 'json')
+        # Test that the model name is matched in any case.
+        cc.related_model = 'Book'
+        cc.save()
+        out = StringIO()
+        call_command('dcolumn_migrate_storage', 'BOOK', 'json', stdout=out)
+        self.assertIn("Moved 2 objects", out.getvalue())
+        # Test that an inactive collection is not found.
+        cc.active = False
+        cc.save()
+        self.assertRaises(CommandError, call_command,
+                          'dcolumn_migrate_storage', 'book', 'key_value')
+
+    def test_write_after_migrate_storage(self):
+        """
+        Check that writes of an instance loaded before its object was
+        migrated go to the new storage engine.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 1)
+        cc = self._create_column_collection_record(
+            "Book Current", 'book', dynamic_columns=[dc0])
+        book = self._create_dcolumn_record(Book, cc, title="Book 0")
+        book.set_key_value('edition', 3)
+        # Test a KeyValue instance written after a move to JSON.
+        stale = Book.objects.get(pk=book.pk)
+        call_command('dcolumn_migrate_storage', 'book', 'json',
+                     stdout=StringIO())
+        stale.set_key_value('edition', 9)
+        self.assertTrue(stale.uses_json_storage)
+        self.assertEqual(KeyValue.objects.count(), 0)
+        self.assertEqual(Book.objects.get(pk=book.pk).get_key_value(
+            'edition'), 9)
+        stale = Book.objects.get(pk=book.pk)
+        stale.add('edition', 1)
+        # Test a JSON instance written after a move back to KeyValues.
+        stale = Book.objects.get(pk=book.pk)
+        stale_1 = Book.objects.get(pk=book.pk)
+        call_command('dcolumn_migrate_storage', 'book', 'key_value',
+                     stdout=StringIO())
+        stale.set_key_value('edition', 12)
+        self.assertFalse(stale.uses_json_storage)
+        self.assertEqual(stale_1.add('edition', 2), 14)
+        book = Book.objects.get(pk=book.pk)
+        self.assertIsNone(book.json_values)
+        self.assertEqual(book.get_key_value('edition'), 14)
+
     def test_set_key_value_TEXT_and_TEXT_BLOCK(self):
         """
         Check that the TEXT and TEXT_BLOCK type works correctly.
@@ -1055,3 +1897,124 @@ class TestKeyValue(BaseDcolumns, TestCase):
         # Test that the values are the same.
         msg = "value: {}, instance value: {!s}".format(kv.value, kv)
         self.assertEqual(value, str(kv), msg)
+
+    def test_populate_typed_values(self):
+        """
+        Test that the typed shadow fields are set from the value.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 4)
+        dc1 = self._create_dynamic_column_record(
+            "Published", DynamicColumn.DATE, 'book_top', 5)
+        dc2 = self._create_dynamic_column_record(
+            "Ignore", DynamicColumn.BOOLEAN, 'book_top', 6)
+        dc3 = self._create_dynamic_column_record(
+            "Percentage", DynamicColumn.FLOAT, 'book_top', 7)
+        book, b_cc, b_values = self._create_book_objects(
+            extra_dcs=[dc0, dc1, dc2, dc3])
+        book.set_key_values({'edition': 12, 'published': dt_date(2015, 3, 1),
+                             'ignore': 'yes', 'percentage': 20.5})
+        kvs = {kv.dynamic_column.slug: kv for kv in KeyValue.objects.filter(
+            collection=book)}
+        self.assertEqual(kvs['edition'].value_int, 12)
+        self.assertEqual(kvs['published'].value_datetime,
+                         datetime(2015, 3, 1, tzinfo=timezone.utc))
+        self.assertEqual(kvs['ignore'].value_bool, True)
+        self.assertEqual(kvs['percentage'].value_float, 20.5)
+        self.assertEqual(kvs['abstract'].value_int, None)
+        # Test that an updated value updates the typed field.
+        book.set_key_value('edition', 'increment')
+        self.assertEqual(KeyValue.objects.filter(
+            dynamic_column=dc0, value_int__gt=12).count(), 1)
+        # Test that a value that cannot be converted sets None.
+        kv = kvs['edition']
+        kv.value = 'junk'
+        kv.populate_typed_values()
+        self.assertEqual(kv.value_int, None)
+
+    def test_backfill_typed_values(self):
+        """
+        Test that the management command sets the typed fields on
+        existing rows.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 4)
+        book, b_cc, b_values = self._create_book_objects(extra_dcs=[dc0,])
+        book.set_key_value('edition', 3)
+        # Simulate rows written before the typed fields existed.
+        KeyValue.objects.update(value_int=None)
+        out = StringIO()
+        call_command('dcolumn_backfill_typed', chunk_size=1, stdout=out)
+        self.assertIn("Backfilled 2 KeyValue objects.", out.getvalue())
+        self.assertEqual(KeyValue.objects.get(
+            dynamic_column=dc0).value_int, 3)
+
+    def test_canonical_values(self):
+        """
+        Test that values are stored in their canonical encoding and that
+        the management command rewrites legacy values.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Ignore", DynamicColumn.BOOLEAN, 'book_top', 4)
+        dc1 = self._create_dynamic_column_record(
+            "Published", DynamicColumn.DATE, 'book_top', 5)
+        dc2 = self._create_dynamic_column_record(
+            "Percentage", DynamicColumn.FLOAT, 'book_top', 6)
+        dc3 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 7)
+        book, b_cc, b_values = self._create_book_objects(
+            extra_dcs=[dc0, dc1, dc2, dc3])
+        # Test canonical writes.
+        book.set_key_values({'ignore': "Yes", 'published': "March 4, 2020",
+                             'percentage': "20.50", 'edition': "007"})
+        kvs = {kv.dynamic_column.slug: kv.value for kv in
+               KeyValue.objects.filter(collection=book).select_related(
+                   'dynamic_column')}
+        self.assertEqual((kvs['ignore'], kvs['published'],
+                          kvs['percentage'], kvs['edition']),
+                         ('1', '2020-03-04', '20.5', '7'))
+        self.assertEqual(book.get_key_value('ignore'), True)
+        # Test that the command rewrites legacy values.
+        KeyValue.objects.filter(dynamic_column=dc0).update(value='FALSE')
+        KeyValue.objects.filter(dynamic_column=dc1).update(
+            value='2020/03/05')
+        KeyValue.objects.filter(dynamic_column=dc2).update(value='0.00001')
+        out = StringIO()
+        call_command('dcolumn_normalize_values', chunk_size=2, stdout=out)
+        self.assertIn("Normalized 2 KeyValue objects.", out.getvalue())
+        self.assertEqual(KeyValue.objects.get(dynamic_column=dc0).value, '0')
+        kv = KeyValue.objects.get(dynamic_column=dc1)
+        self.assertEqual(kv.value, '2020-03-05')
+        self.assertEqual(kv.value_datetime.day, 5)
+        # Test that small and large floats have no exponent and read back.
+        book = Book.objects.get(pk=book.pk)
+        self.assertEqual(KeyValue.objects.get(dynamic_column=dc2).value,
+                         '0.00001')
+        self.assertEqual(book.get_key_value('percentage'), 1e-05)
+        book.set_key_value('percentage', 1e20)
+        self.assertEqual(KeyValue.objects.get(dynamic_column=dc2).value,
+                         '100000000000000000000.0')
+        self.assertEqual(Book.objects.get(pk=book.pk).get_key_value(
+            'percentage'), 1e20)
+        self.assertEqual(KeyValue.canonical_value(dc2, '-2.5e-3'), '-0.0025')
+        self.assertRaises(ValueError, KeyValue.canonical_value, dc2, 'inf')
+        # Test that legacy exponents and signs are read.
+        KeyValue.objects.filter(dynamic_column=dc2).update(value='-1e-05')
+        self.assertEqual(Book.objects.get(pk=book.pk).get_key_value(
+            'percentage'), -1e-05)
+        # Test JSON documents.
+        b_cc.storage = ColumnCollection.JSON
+        b_cc.save()
+        book_1 = self._create_dcolumn_record(Book, b_cc, title="JSON Book")
+        book_1.set_key_value('ignore', 'no')
+        book_1.json_values[str(dc0.pk)] = 'no'
+        Book.objects.filter(pk=book_1.pk).update(
+            json_values=book_1.json_values)
+        out = StringIO()
+        call_command('dcolumn_normalize_values', stdout=out)
+        self.assertIn("Normalized 1 JSON documents.", out.getvalue())
+        self.assertEqual(Book.objects.get(pk=book_1.pk).json_values,
+                         {str(dc0.pk): '0'})
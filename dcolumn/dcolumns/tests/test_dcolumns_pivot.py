@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# dcolumn/dcolumns/tests/test_dcolumns_pivot.py
+#
+# WARNING: These unittests can only be run from within the original test
+#          framework from https://github.com/cnobile2012/dcolumn.
+#
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from example_site.books.models import Author, Book
+
+from ..models import DynamicColumn
+from ..pivot import PivotTable, get_pivot_table, _pivot_tables
+
+from .base_tests import BaseDcolumns
+
+
+# The pivot tables are created with DDL which SQLite cannot run inside the
+# transaction of a TestCase.
+@override_settings(DYNAMIC_COLUMNS={'PIVOT_TABLES': ['book']})
+class TestPivotTable(BaseDcolumns, TransactionTestCase):
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def tearDown(self):
+        super().tearDown()
+        table = get_pivot_table('book')
+
+        if table.exists():
+            with connection.schema_editor() as editor:
+                editor.delete_model(table.model)
+
+        _pivot_tables.clear()
+
+    def test_pivot_table_is_maintained(self):
+        """
+        Test that the pivot table follows KeyValue writes and deletes.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 4)
+        book, b_cc, b_values = self._create_book_objects(extra_dcs=[dc0,])
+        row = Book.objects.pivot().get(pk=book.pk)
+        self.assertEqual(row.abstract, b_values['abstract'])
+        self.assertEqual(row.edition, None)
+        # Test single and bulk writes.
+        book.set_key_value('edition', 5)
+        book_1 = self._create_dcolumn_record(Book, b_cc, title="Another")
+        self.assertEqual(Book.objects.pivot().get(pk=book_1.pk).edition, None)
+        book_1.set_key_values({'edition': 9, 'abstract': "Another abstract"})
+        found = Book.objects.pivot().filter(edition__gte=5).order_by(
+            '-edition').values_list('collection_id', 'edition')
+        self.assertEqual(list(found), [(book_1.pk, 9), (book.pk, 5)])
+        # Test that a deleted object removes its row.
+        book_1.delete()
+        self.assertEqual(list(Book.objects.pivot().values_list(
+            'collection_id', flat=True)), [book.pk])
+
+    def test_pivot_table_bulk_create(self):
+        """
+        Test that objects created in bulk get their rows with one insert,
+        with or without values.
+        """
+        #self.skipTest("Temporarily skipped")
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 4)
+        book, b_cc, b_values = self._create_book_objects(extra_dcs=[dc0,])
+        user = {'creator': self.user, 'updater': self.user}
+        rows = [(dict(title="Book {}".format(i), **user), {'edition': i})
+                for i in range(1, 4)]
+        rows.append((dict(title="Empty", **user), {}))
+        Book.objects.get_all_slugs()
+        Book.objects.pivot().count()
+
+        # The collection, the transaction, the parents, the children, the
+        # KeyValues and the pivot rows.
+        with self.assertNumQueries(7):
+            books = Book.objects.bulk_create_with_values(rows)
+
+        found = Book.objects.pivot().filter(
+            collection_id__in=[obj.pk for obj in books]).order_by(
+            'collection_id').values_list('edition', flat=True)
+        self.assertEqual(list(found), [1, 2, 3, None])
+
+    def test_pivot_table_is_rebuilt(self):
+        """
+        Test that the pivot table is rebuilt when the columns change.
+        """
+        #self.skipTest("Temporarily skipped")
+        book, b_cc, b_values = self._create_book_objects()
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 4)
+        book.set_key_value('abstract', "A new abstract")
+        b_cc.process_dynamic_columns(list(b_cc.dynamic_column.all()) + [dc0])
+        book = Book.objects.get(pk=book.pk)
+        book.set_key_value('edition', 2)
+        row = Book.objects.pivot().get(pk=book.pk)
+        self.assertEqual((row.abstract, row.edition), ("A new abstract", 2))
+        # Test the management command.
+        out = StringIO()
+        call_command('dcolumn_rebuild_pivot', stdout=out)
+        self.assertIn("Rebuilt dcolumns_pivot_book with 1 rows.",
+                      out.getvalue())
+        self.assertEqual(Book.objects.pivot().get(pk=book.pk).edition, 2)
+
+        # Test that a model without a pivot table raises.
+        with self.assertRaises(ValueError) as cm:
+            Author.objects.pivot()
+
+    def test_pivot_table_is_altered(self):
+        """
+        Test that a column change alters the table in place and that a
+        model built before another process changed the table is built
+        again.
+        """
+        #self.skipTest("Temporarily skipped")
+        book, b_cc, b_values = self._create_book_objects()
+        table = get_pivot_table('book')
+        self.assertNotIn('edition', [field.name for field in
+                                     table.model._meta.fields])
+        # Another process adds a column while this one keeps its model.
+        _pivot_tables['book'] = PivotTable('book')
+        dc0 = self._create_dynamic_column_record(
+            "Edition", DynamicColumn.NUMBER, 'book_top', 4)
+        b_cc.process_dynamic_columns(list(b_cc.dynamic_column.all()) + [dc0])
+        _pivot_tables['book'] = table
+        # Test that the existing row was kept.
+        row = Book.objects.pivot().get(pk=book.pk)
+        self.assertEqual(row.abstract, b_values['abstract'])
+        self.assertEqual(row.edition, None)
+        book = Book.objects.get(pk=book.pk)
+        book.set_key_value('edition', 3)
+        book_1 = self._create_dcolumn_record(Book, b_cc, title="Another")
+        book_1.set_key_value('edition', 4)
+        found = Book.objects.pivot().order_by('edition').values_list(
+            'collection_id', 'edition')
+        self.assertEqual(list(found), [(book.pk, 3), (book_1.pk, 4)])
+        # Test that a removed column is dropped.
+        b_cc.dynamic_column.remove(dc0)
+        self.assertNotIn('edition', table._get_table_fields())
+        self.assertEqual(Book.objects.pivot().get(pk=book.pk).abstract,
+                         b_values['abstract'])
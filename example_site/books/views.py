@@ -98,7 +98,7 @@ book_detail_view = BookDetailView.as_view()
 class BookListView(LoginRequiredMixin,
                    ListView):
     template_name = 'books/book_list_view.html'
-    model = Book
+    queryset = Book.objects.with_key_values()
     paginate_by = 50
 
 book_list_view = BookListView.as_view()
@@ -182,7 +182,7 @@ publisher_detail_view = PublisherDetailView.as_view()
 class PublisherListView(LoginRequiredMixin,
                         ListView):
     template_name = 'books/publisher_list_view.html'
-    model = Publisher
+    queryset = Publisher.objects.with_key_values()
     paginate_by = 50
 
 publisher_list_view = PublisherListView.as_view()
@@ -266,7 +266,7 @@ author_detail_view = AuthorDetailView.as_view()
 class AuthorListView(LoginRequiredMixin,
                      ListView):
     template_name = 'books/author_list_view.html'
-    model = Author
+    queryset = Author.objects.with_key_values()
     paginate_by = 50
 
 author_list_view = AuthorListView.as_view()
@@ -351,7 +351,7 @@ promotion_detail_view = PromotionDetailView.as_view()
 class PromotionListView(LoginRequiredMixin,
                         ListView):
     template_name = 'books/promotion_list_view.html'
-    model = Promotion
+    queryset = Promotion.objects.with_key_values()
     paginate_by = 50
 
 promotion_list_view = PromotionListView.as_view()
@@ -25,7 +25,8 @@ setup(
     name='django-dcolumns',
     version=version(),
     packages=['dcolumn', 'dcolumn.dcolumns', 'dcolumn.dcolumns.migrations',
-              'dcolumn.common',],
+              'dcolumn.dcolumns.management',
+              'dcolumn.dcolumns.management.commands', 'dcolumn.common',],
     include_package_data=True,
     license='MIT',
     description=('An app to give any Django database model the ability to '